@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Compare two result files written by benchmarks/run.py
+
+Prints the median of every number in both files and the change in percent,
+flagging changes worse than --threshold. Rates are better when higher, everything
+else (latency, cost, memory) is better when lower.
+
+    python benchmarks/compare.py baseline.json candidate.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# Result keys where a higher value is better
+HIGHER_IS_BETTER = ("messages_per_second",)
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        document = json.load(file)
+
+    results = {}
+    for benchmark in document["benchmarks"]:
+        key = (
+            benchmark["name"],
+            benchmark.get("port_transport_tls"),
+            benchmark.get("protocol"),
+        )
+        results[key] = benchmark.get("results", {})
+    return document, results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold", type=float, default=10, help="Regression limit in percent"
+    )
+    args = parser.parse_args(argv)
+
+    baseline_document, baseline = load(args.baseline)
+    candidate_document, candidate = load(args.candidate)
+
+    print(
+        f"baseline {baseline_document.get('commit')} -> candidate {candidate_document.get('commit')}"
+    )
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys(), key=str):
+        name = " ".join(part for part in key if part)
+        for metric in sorted(baseline[key].keys() & candidate[key].keys()):
+            old = baseline[key][metric]["median"]
+            new = candidate[key][metric]["median"]
+            change = (new - old) / old * 100 if old else 0.0
+
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > args.threshold:
+                regressions += 1
+                flag = "  REGRESSION"
+
+            print(f"{name:45} {metric:25} {old:14.1f} {new:14.1f} {change:+7.1f}%{flag}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+"""Throughput, latency and memory benchmarks for mqttwrapper
+
+Runs against a local broker with the same host/port/transport/TLS/protocol matrix as
+tests/fixtures.py and prints one JSON document with the results, compare two of them
+with benchmarks/compare.py.
+
+Benchmarks that do not touch the network (dispatch, construct, memory, logging) run without a broker.
+
+    python benchmarks/run.py --username admin --password testing --output results.json
+    python benchmarks/run.py --only dispatch construct memory
+"""
+import argparse
+import gc
+import itertools
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from importlib.metadata import version, PackageNotFoundError
+
+from paho.mqtt.client import MQTTMessage as PahoMQTTMessage
+
+from mqttwrapper.mqtt_client import MqttClient
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_message import MqttMessage, MqttReceivedMessage
+from mqttwrapper.mqtt_message_store import MqttRetentionPolicy
+from mqttwrapper.mqtt_probe import MqttLatencyProbe
+from mqttwrapper.helper import wait
+
+# Same values as tests/fixtures.py
+PORT_TRANSPORT_TLS = [
+    "1883-tcp-False",
+    "8883-tcp-True",
+    "8083-websockets-False",
+    "8084-websockets-True",
+]
+
+
+def make_config(args, port_transport_tls: str, protocol: str, **changes) -> MqttConfig:
+    port, transport, tls = port_transport_tls.split("-")
+    return MqttConfig(
+        host=args.host,
+        port=int(port),
+        username=args.username,
+        password=args.password,
+        transport=transport,
+        tls_enable=tls == "True",
+        tls_insecure=True,
+        protocol=protocol,
+        **changes,
+    )
+
+
+def paho_message(topic: str, payload: bytes, qos: int = 1) -> PahoMQTTMessage:
+    message = PahoMQTTMessage(mid=1, topic=topic.encode("utf-8"))
+    message.payload = payload
+    message.qos = qos
+    return message
+
+
+def measure(function, repeat: int) -> dict:
+    """measure Run function repeat times, function returns a dict of numbers per run
+
+    Returns:
+        dict: median, min and max of every number over the runs
+    """
+    runs = [function() for _ in range(repeat)]
+    summary = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        summary[key] = {
+            "median": statistics.median(values),
+            "min": min(values),
+            "max": max(values),
+        }
+    return summary
+
+
+def started_client(config: MqttConfig) -> MqttClient:
+    client = MqttClient(config)
+    client.start(timeout=5)
+    if not client.is_connected():
+        raise ConnectionError(f"Could not connect to {config.host}:{config.port}")
+    return client
+
+
+def bench_publish(args, config: MqttConfig) -> dict:
+    """Publish rate with publish_many, publish to last PUBACK"""
+    client = started_client(config)
+    payload = b"x" * args.payload_size
+    topic = "benchmark/publish"
+
+    def run():
+        start = time.perf_counter()
+        batch = client.publish_many(
+            ((topic, payload) for _ in range(args.messages)), qos=args.qos
+        )
+        batch.wait_all(60)
+        elapsed = time.perf_counter() - start
+        return {"messages_per_second": len(batch.completed) / elapsed}
+
+    try:
+        return measure(run, args.repeat)
+    finally:
+        client.stop()
+
+
+def bench_receive(args, config: MqttConfig) -> dict:
+    """Receive rate, first publish to last message received on a separate client"""
+    publisher = started_client(config.copy(client_id=None))
+    receiver = started_client(
+        config.copy(client_id=None, retention=MqttRetentionPolicy.count_only())
+    )
+    payload = b"x" * args.payload_size
+    topic = "benchmark/receive"
+
+    subscription = receiver.subscribe(topic, args.qos)
+    subscription.wait_for_active(5)
+
+    def run():
+        expected = subscription.total_message_count + args.messages
+        start = time.perf_counter()
+        publisher.publish_many(
+            ((topic, payload) for _ in range(args.messages)), qos=args.qos
+        )
+        wait(
+            condition=lambda: subscription.total_message_count >= expected,
+            timeout=60,
+            notifier=subscription._notifier,
+        )
+        elapsed = time.perf_counter() - start
+        received = args.messages - (expected - subscription.total_message_count)
+        return {"messages_per_second": received / elapsed}
+
+    try:
+        return measure(run, args.repeat)
+    finally:
+        publisher.stop()
+        receiver.stop()
+
+
+def bench_latency(args, config: MqttConfig) -> dict:
+    """Round trip latency with MqttLatencyProbe, messages sent one at a time"""
+    client = started_client(config.copy(retention=MqttRetentionPolicy.count_only()))
+    probe = MqttLatencyProbe(
+        client, "benchmark/latency", qos=args.qos, payload_size=args.payload_size
+    )
+    probe.subscription.wait_for_active(5)
+
+    def run():
+        for _ in range(min(args.messages, 1000)):
+            probe.send()
+            probe.wait_for_in_flight(5)
+        report = probe.report(reset=True)
+        receive = report.receive_latency.percentiles()
+        ack = report.ack_latency.percentiles()
+        return {
+            "receive_p50_us": receive[50.0] / 1000,
+            "receive_p99_us": receive[99.0] / 1000,
+            "receive_p999_us": receive[99.9] / 1000,
+            "ack_p50_us": ack[50.0] / 1000 if ack[50.0] is not None else 0,
+            "ack_p99_us": ack[99.0] / 1000 if ack[99.0] is not None else 0,
+            "lost": report.lost_count,
+        }
+
+    try:
+        return measure(run, args.repeat)
+    finally:
+        probe.close()
+        client.stop()
+
+
+def bench_dispatch(args, config: MqttConfig) -> dict:
+    """Cost of matching an incoming message against many subscriptions, no network"""
+    client = MqttClient(config.copy(retention=MqttRetentionPolicy.count_only()))
+    for index in range(args.subscriptions):
+        client.subscribe(f"benchmark/dispatch/{index}/+/value")
+    client.subscribe("benchmark/dispatch/#")
+
+    messages = [
+        paho_message(f"benchmark/dispatch/{index % args.subscriptions}/sensor/value", b"1")
+        for index in range(args.messages)
+    ]
+    paho_client = client.get_paho()
+    userdata = client.userdata
+
+    def run():
+        start = time.perf_counter()
+        for message in messages:
+            client._on_message(paho_client, userdata, message)
+        elapsed = time.perf_counter() - start
+        return {"ns_per_message": elapsed * 1e9 / len(messages)}
+
+    return measure(run, args.repeat)
+
+
+def bench_construct(args, config: MqttConfig) -> dict:
+    """Cost of building received and sent message objects, no network"""
+    client = MqttClient(config.copy(retention=MqttRetentionPolicy.count_only()))
+    subscription = client.subscribe("benchmark/construct")
+    message = paho_message("benchmark/construct", b"x" * args.payload_size)
+    count = args.messages
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(count):
+            MqttReceivedMessage.from_paho(subscription, message)
+        received_ns = (time.perf_counter() - start) * 1e9 / count
+
+        start = time.perf_counter()
+        for _ in range(count):
+            MqttMessage(
+                userdata=client.userdata,
+                mid=0,
+                topic="benchmark/construct",
+                payload=message.payload,
+                qos=1,
+                retain=False,
+            )
+        sent_ns = (time.perf_counter() - start) * 1e9 / count
+
+        return {"received_ns_per_message": received_ns, "sent_ns_per_message": sent_ns}
+
+    return measure(run, args.repeat)
+
+
+def bench_memory(args, config: MqttConfig) -> dict:
+    """Memory per message retained by a subscription, payload excluded, no network"""
+    message = paho_message("benchmark/memory", b"x" * args.payload_size)
+    count = args.messages
+
+    def run():
+        client = MqttClient(config.copy())
+        subscription = client.subscribe("benchmark/memory")
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(count):
+            subscription.message_callback(None, None, message)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        return {"bytes_per_message": (after - before) / count}
+
+    return measure(run, args.repeat)
+
+
+def bench_logging(args, config: MqttConfig) -> dict:
+    """Publish and is_active polling with logging at INFO, default vs quiet_hot_path, no network
+
+    Not connected, so QoS 1 publishes are only queued by paho.
+    """
+    count = args.messages
+    payload = b"x" * args.payload_size
+
+    def measure_config(quiet: bool):
+        client = MqttClient(
+            config.copy(client_id=None, quiet_hot_path=quiet),
+            log=logging.getLogger("Benchmark.Logging"),
+        )
+        subscription = client.subscribe("benchmark/logging")
+
+        start = time.perf_counter()
+        for _ in range(count):
+            client.publish("benchmark/logging", payload, qos=1)
+        publish_ns = (time.perf_counter() - start) * 1e9 / count
+
+        start = time.perf_counter()
+        for _ in range(count):
+            subscription.is_active()
+        is_active_ns = (time.perf_counter() - start) * 1e9 / count
+
+        return publish_ns, is_active_ns
+
+    def run():
+        logging.getLogger("Benchmark.Logging").setLevel(logging.INFO)
+        publish_ns, is_active_ns = measure_config(quiet=False)
+        quiet_publish_ns, quiet_is_active_ns = measure_config(quiet=True)
+        return {
+            "publish_ns_per_message": publish_ns,
+            "publish_quiet_ns_per_message": quiet_publish_ns,
+            "is_active_ns_per_call": is_active_ns,
+            "is_active_quiet_ns_per_call": quiet_is_active_ns,
+        }
+
+    return measure(run, args.repeat)
+
+
+# Name to (function, needs broker)
+BENCHMARKS = {
+    "publish": (bench_publish, True),
+    "receive": (bench_receive, True),
+    "latency": (bench_latency, True),
+    "dispatch": (bench_dispatch, False),
+    "construct": (bench_construct, False),
+    "memory": (bench_memory, False),
+    "logging": (bench_logging, False),
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def package_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument(
+        "--port-transport-tls",
+        nargs="+",
+        default=["1883-tcp-False"],
+        choices=PORT_TRANSPORT_TLS,
+        help="Same format as tests/fixtures.py",
+    )
+    parser.add_argument("--protocol", nargs="+", default=["3.1.1"])
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--payload-size", type=int, default=64)
+    parser.add_argument("--subscriptions", type=int, default=1000)
+    parser.add_argument("--qos", type=int, default=1, choices=[0, 1, 2])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    names = args.only if args.only else list(BENCHMARKS)
+    results = []
+    failed = False
+
+    for port_transport_tls, protocol in itertools.product(
+        args.port_transport_tls, args.protocol
+    ):
+        config = make_config(args, port_transport_tls, protocol)
+
+        for name in names:
+            function, needs_broker = BENCHMARKS[name]
+            # Offline benchmarks do not depend on the matrix, run them once
+            if not needs_broker and (
+                port_transport_tls != args.port_transport_tls[0]
+                or protocol != args.protocol[0]
+            ):
+                continue
+
+            params = {"name": name}
+            if needs_broker:
+                params.update(
+                    port_transport_tls=port_transport_tls, protocol=protocol
+                )
+
+            print(f"Running {params}", file=sys.stderr)
+            try:
+                params["results"] = function(args, config)
+            except Exception as error:
+                failed = True
+                params["error"] = f"{type(error).__name__}: {error}"
+                print(f"Failed {params}", file=sys.stderr)
+            results.append(params)
+
+    document = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "paho_mqtt": package_version("paho-mqtt"),
+        "settings": {
+            "messages": args.messages,
+            "payload_size": args.payload_size,
+            "subscriptions": args.subscriptions,
+            "qos": args.qos,
+            "repeat": args.repeat,
+        },
+        "benchmarks": results,
+    }
+
+    output = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
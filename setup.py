@@ -34,6 +34,13 @@ setup(
     test_suite="tests",
     tests_require=["pytest"],
     setup_requires=["pytest-runner"],
-    extras_require={},
+    extras_require={
+        "zstd": ["zstandard"],
+        "lz4": ["lz4"],
+        "msgpack": ["msgpack"],
+        "orjson": ["orjson"],
+        "numpy": ["numpy"],
+        "arrow": ["numpy", "pyarrow"],
+    },
     python_requires=">=3.6",
 )
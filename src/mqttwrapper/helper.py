@@ -1,14 +1,87 @@
 from typing import Callable
+import random
+import threading
 import time
 import logging
 
 
+class Notifier:
+    """Notifier Wake up threads waiting for state owned by another thread
+
+    Wraps a threading.Condition. The owner changes its state and then calls notify(),
+    waiters re-check their predicate when notified instead of polling on a sleep interval.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+
+    def notify(self):
+        """notify Wake up every thread currently waiting on this notifier"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait_for(self, condition: Callable, timeout: float = None) -> bool:
+        """wait_for Block until condition is true, re-checked on every notify
+
+        Args:
+            condition (Callable): Function that determins if we can stop waiting
+            timeout (float, optional): Max seconds to wait, None means no timeout. Defaults to None.
+
+        Returns:
+            bool: The last result of condition
+        """
+        with self._condition:
+            return self._condition.wait_for(condition, timeout)
+
+
+class Backoff:
+    """Backoff Exponential delays with jitter between retries
+
+    The delay doubles from min_delay every attempt up to max_delay, then up to jitter of it
+    is taken away at random so clients losing the same broker do not retry in lockstep.
+    jitter 0 gives plain exponential backoff, 1 gives "full jitter".
+    """
+
+    def __init__(
+        self,
+        min_delay: float = 1,
+        max_delay: float = 120,
+        jitter: float = 0.5,
+        random: Callable[[], float] = random.random,
+    ):
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"Invalid jitter '{jitter}', valid values are 0 to 1")
+
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts = 0
+
+        self._random = random
+
+    def next_delay(self) -> float:
+        """next_delay Delay before the next attempt, counts the attempt
+
+        Returns:
+            float: Seconds to wait
+        """
+        # Capped exponent, the delay has long hit max_delay by then
+        delay = min(self.max_delay, self.min_delay * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return delay * (1 - self.jitter * self._random())
+
+    def reset(self):
+        """reset Start over from min_delay, call after a successful attempt"""
+        self.attempts = 0
+
+
 def wait(
     condition: Callable,
     timeout: int = None,
     log: logging.Logger = None,
     reason: str = "",
     resolution: float = 100,
+    notifier: Notifier = None,
 ):
     """wait Timeout function
 
@@ -20,22 +93,36 @@ def wait(
         log (logging.Logger, optional): Logger object to use for logging. Defaults to None.
         reason (str, optional): Reason to give in the log. Defaults to "".
         resolution (float, optional): timeout devided by resolution = sleep interval, will never sleep longer than 1 second. Defaults to 100
+        notifier (Notifier, optional): Notifier signaled when condition might have changed.
+            When given, condition is only re-checked on notification and resolution is ignored. Defaults to None, polling condition.
 
     Returns:
         bool: If contidtion is true return True, if timeout return False
     """
-    timeout_time = None if timeout is None else time.time() + timeout
+    start_time = time.time()
+    timeout_time = None if timeout is None else start_time + timeout
     timeout_sleep = 1 if timeout is None else min(1, timeout / resolution)
 
+    def remaining():
+        return None if timeout is None else timeout_time - time.time()
+
     def timed_out():
-        return False if timeout is None else time.time() > timeout_time
+        return False if timeout is None else remaining() <= 0
 
     while not condition() and not timed_out():
-        time.sleep(timeout_sleep)
-        elapsed = time.time() - (timeout_time - timeout)
-        if log and round(elapsed, 1) % 1 == 0:
+        if notifier:
+            # Wake up at least once a second so progress can be logged
+            interval = 1 if timeout is None else max(0, min(1, remaining()))
+            notifier.wait_for(condition, interval)
+        else:
+            time.sleep(timeout_sleep)
+
+        elapsed = time.time() - start_time
+        if log and not condition() and round(elapsed, 1) % 1 == 0:
             log.info(
-                "[{0:.2f}/{1:.2f} seconds elapsed] {2}".format(elapsed, timeout, reason)
+                "[{0:.2f}/{1} seconds elapsed] {2}".format(
+                    elapsed, "inf" if timeout is None else f"{timeout:.2f}", reason
+                )
             )
 
     return condition()
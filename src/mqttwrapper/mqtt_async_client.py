@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import threading
+
+from .mqtt_config import MqttConfig
+from .mqtt_client import MqttClient
+from .mqtt_message import MqttMessage, MqttReceivedMessage
+from .mqtt_subscription import MqttSubscription
+from .mqtt_serializer import MqttSerializer
+
+from typing import Callable, List, Tuple, Union
+
+
+class AsyncMqttClient:
+    """AsyncMqttClient asyncio facade over MqttClient
+
+    Paho's socket is driven by the event loop with add_reader/add_writer instead of the
+    loop_start background thread, so every paho callback runs on the event loop thread.
+    Waiting is done with futures resolved after each read/write, no thread is used per waiter.
+
+    Only the initial blocking TCP/TLS connect is run in the default executor.
+    Connection loss is reported through the wrapped MqttClient, there is no automatic reconnect.
+    """
+
+    def __init__(self, config: MqttConfig, log: logging.Logger = None):
+        self._init(MqttClient(config, log=log))
+
+    @classmethod
+    def from_client(cls, client: MqttClient) -> "AsyncMqttClient":
+        """from_client Wrap an MqttClient that is not started
+
+        Args:
+            client (MqttClient): Client to drive from the event loop
+
+        Returns:
+            AsyncMqttClient: Facade sharing subscriptions and state with client
+        """
+        self = cls.__new__(cls)
+        self._init(client)
+        return self
+
+    def _init(self, client: MqttClient):
+        self.client = client
+        self.config = client.config
+        self.userdata = client.userdata
+        self.log = client.log.getChild("Async")
+
+        self._loop: asyncio.AbstractEventLoop = None
+        self._loop_thread_id: int = None
+        self._misc_task: asyncio.Task = None
+        self._waiters: List[Tuple[Callable, asyncio.Future]] = []
+
+    async def start(self, timeout: int = None) -> bool:
+        """start Connect and drive paho from the running event loop
+
+        Args:
+            timeout (int, optional): Max seconds to wait for CONNACK. Defaults to None, waiting forever
+
+        Returns:
+            bool: True if connected
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+
+        paho_client = self.client.get_paho()
+        paho_client.on_socket_open = self._on_socket_open
+        paho_client.on_socket_close = self._on_socket_close
+        paho_client.on_socket_register_write = self._on_socket_register_write
+        paho_client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        await self._loop.run_in_executor(None, self.client.connect)
+
+        if self._misc_task is None:
+            self._misc_task = self._loop.create_task(self._misc_loop())
+
+        return await self.wait_for(self.client.is_connected, timeout)
+
+    async def stop(self, timeout: int = None) -> bool:
+        """stop Send DISCONNECT and stop driving paho
+
+        Args:
+            timeout (int, optional): Max seconds to wait for the socket to close. Defaults to None, waiting forever
+
+        Returns:
+            bool: True if disconnected
+        """
+        self.log.info(f"Disonnecting from {self.config.host}:{self.config.port}")
+        paho_client = self.client.get_paho()
+        paho_client.disconnect()
+
+        disconnected = await self.wait_for(
+            lambda: paho_client.socket() is None, timeout
+        )
+
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+        if self.client.offline_queue is not None:
+            self.client.offline_queue.close()
+        if self.client.flow_control is not None:
+            self.client.flow_control.close()
+
+        return disconnected
+
+    async def publish(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int = 1,
+        retain: bool = False,
+        timeout: int = None,
+        serializer: Union[str, MqttSerializer] = None,
+    ) -> MqttMessage:
+        """publish Publish and wait for PUBACK/PUBCOMP, or the packet being written for QoS 0
+
+        Returns:
+            MqttMessage: Sent message, check is_communicated() when a timeout is given
+        """
+        message = self.client.publish(
+            topic, payload, qos=qos, retain=retain, serializer=serializer
+        )
+
+        await self.wait_for(
+            lambda: message.is_communicated() or message.is_failed(), timeout
+        )
+
+        return message
+
+    async def subscribe(
+        self, topic: str, qos: int = 1, timeout: int = None
+    ) -> "AsyncMqttSubscription":
+        """subscribe Subscribe and wait for SUBACK
+
+        Returns:
+            AsyncMqttSubscription: Async iterable over new messages on the subscription
+        """
+        subscription = self.client.subscribe(topic, qos)
+
+        await self.wait_for(subscription.is_active, timeout)
+
+        return AsyncMqttSubscription(self, subscription)
+
+    async def unsubscribe(self, topic: str, timeout: int = None) -> MqttSubscription:
+        """unsubscribe Unsubscribe and wait for UNSUBACK
+
+        Returns:
+            MqttSubscription: The removed subscription, None if not subscribed
+        """
+        subscription = self.client.unsubscribe(topic)
+
+        if subscription:
+            await self.wait_for(
+                lambda: self.userdata.get_subscription(topic=topic) is not subscription,
+                timeout,
+            )
+
+        return subscription
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    async def wait_for(self, condition: Callable, timeout: int = None) -> bool:
+        """wait_for Wait until condition is true, re-checked after paho handled network traffic
+
+        Args:
+            condition (Callable): Function that determins if we can stop waiting
+            timeout (int, optional): Max seconds to wait. Defaults to None, waiting forever
+
+        Returns:
+            bool: The last result of condition
+        """
+        if condition():
+            return True
+
+        waiter = (condition, self._loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        return condition()
+
+    def _check_waiters(self):
+        for condition, future in list(self._waiters):
+            if not future.done() and condition():
+                future.set_result(True)
+
+    def _call_in_loop(self, function: Callable, *args):
+        # Paho calls socket callbacks from whichever thread queued the packet
+        if threading.get_ident() == self._loop_thread_id:
+            function(*args)
+        else:
+            self._loop.call_soon_threadsafe(function, *args)
+
+    def _read(self):
+        self.client.get_paho().loop_read()
+        self._check_waiters()
+
+    def _write(self):
+        self.client.get_paho().loop_write()
+        self._check_waiters()
+
+    async def _misc_loop(self):
+        # Keepalive PINGREQ and timeouts, paho expects this about once a second
+        while True:
+            self.client.get_paho().loop_misc()
+            self._check_waiters()
+            await asyncio.sleep(1)
+
+    def _on_socket_open(self, paho_client, userdata, sock):
+        self._call_in_loop(self._loop.add_reader, sock, self._read)
+
+    def _on_socket_close(self, paho_client, userdata, sock):
+        def close():
+            self._loop.remove_reader(sock)
+            self._loop.remove_writer(sock)
+            self._check_waiters()
+
+        self._call_in_loop(close)
+
+    def _on_socket_register_write(self, paho_client, userdata, sock):
+        self._call_in_loop(self._loop.add_writer, sock, self._write)
+
+    def _on_socket_unregister_write(self, paho_client, userdata, sock):
+        self._call_in_loop(self._loop.remove_writer, sock)
+
+    async def __aenter__(self) -> "AsyncMqttClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+
+class AsyncMqttSubscription:
+    """AsyncMqttSubscription Async iterator over messages arriving on an MqttSubscription
+
+    Only messages arriving after it was created are yielded, the MqttSubscription keeps
+    storing messages according to its retention policy as usual.
+    """
+
+    def __init__(self, client: AsyncMqttClient, subscription: MqttSubscription):
+        self.client = client
+        self.subscription = subscription
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        subscription.add_listener(self._listener)
+
+    def _listener(self, message: MqttReceivedMessage):
+        self.client._call_in_loop(self._queue.put_nowait, message)
+
+    async def get(self, timeout: int = None) -> MqttReceivedMessage:
+        """get Wait for the next message
+
+        Args:
+            timeout (int, optional): Max seconds to wait. Defaults to None, waiting forever
+
+        Returns:
+            MqttReceivedMessage: Next message, None on timeout
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        """close Stop queueing messages for this iterator"""
+        self.subscription.remove_listener(self._listener)
+
+    def __aiter__(self) -> "AsyncMqttSubscription":
+        return self
+
+    async def __anext__(self) -> MqttReceivedMessage:
+        return await self._queue.get()
+
+    def __getattr__(self, name):
+        # topic, messages, total_message_count, is_active etc. come from the subscription
+        return getattr(self.subscription, name)
@@ -1,13 +1,30 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import copy
 import logging
+import multiprocessing
+import threading
 import time
+from time import time_ns, perf_counter_ns
+from typing import Any, Dict, Iterable, List, Set, Tuple, Union
 
 import paho.mqtt.client as PahoClient
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 from .mqtt_config import MqttConfig, map_to_paho_protocol
 from .mqtt_userdata import MqttUserdata
-from .mqtt_message import MqttMessage
+from .mqtt_message import MqttMessage, to_payload, to_paho_payload
 from .mqtt_subscription import MqttSubscription
-from .helper import wait
+from .mqtt_subscription_batch import MqttSubscriptionBatch, UNSUBSCRIBE
+from .mqtt_publish_batch import MqttPublishBatch, MqttPublishListener
+from .mqtt_handler import MqttHandler
+from .mqtt_metrics import MqttMetrics
+from .mqtt_offline_queue import MqttOfflineQueue, MqttOfflineRecord
+from .mqtt_flow_control import MqttFlowControl
+from .mqtt_topic_alias import MqttTopicAliases, MqttReceivedTopicAliases
+from .mqtt_compression import MqttCompression, CONTENT_ENCODING
+from .mqtt_serializer import MqttSerializer, MqttSerializers
+from .helper import wait, Backoff, Notifier
 
 
 class MqttClient:
@@ -15,6 +32,21 @@ class MqttClient:
 
         self._paho_rc = PahoClient.MQTT_ERR_NO_CONN
 
+        # Signaled on CONNACK and disconnect
+        self._connection_notifier = Notifier()
+
+        # MQTTv5 CONNACK properties of the current connection
+        self.connack_properties = None
+
+        # Set when the connection is lost, cleared once subscriptions are restored
+        self._disconnected_ns: int = None
+        # SUBSCRIBEs restoring subscriptions after a reconnect, waiting for SUBACK
+        self._restore_mids: Set[int] = set()
+
+        # Shared by subscription handlers, created on first use
+        self._executors: Dict[str, Executor] = {}
+        self._executors_lock = threading.Lock()
+
         # Set parameters passed in to class
         self.config = config
 
@@ -22,40 +54,349 @@ class MqttClient:
             log if log else logging.getLogger("Client.{}".format(self.config.client_id))
         )
 
+        self.offline_queue = (
+            MqttOfflineQueue(self.config.offline_queue, log=self.log.getChild("OfflineQueue"))
+            if self.config.offline_queue
+            else None
+        )
+
+        self.flow_control = (
+            MqttFlowControl(
+                self.config.rate_limits,
+                mode=self.config.flow_control,
+                queue_size=self.config.flow_control_queue_size,
+                send=self._send_queued,
+                log=self.log.getChild("FlowControl"),
+            )
+            if self.config.rate_limits
+            else None
+        )
+
+        # Max QoS 1/2 messages waiting for PUBACK/PUBCOMP, lowered to the broker's Receive Maximum
+        self.inflight_window = self.config.max_inflight_messages
+
+        # MQTTv5 topic aliases of the current connection, set up on CONNACK
+        self.topic_aliases = MqttTopicAliases()
+        self.received_topic_aliases = MqttReceivedTopicAliases()
+
+        # MQTTv5 marks compressed payloads with a user property, older protocols frame them
+        is_v5 = map_to_paho_protocol(self.config.protocol) == PahoClient.MQTTv5
+        self.compression = MqttCompression(
+            self.config.compression or [],
+            framed=not is_v5,
+            log=self.log.getChild("Compression"),
+            max_decompressed_size=self.config.max_decompressed_size,
+        )
+        # Opt-in, a v5 message names its codec but a client without policies did not ask for it
+        self._decode_payloads = bool(self.compression.policies) or (
+            is_v5 and self.config.decompress_received
+        )
+
+        self.serializers = MqttSerializers(self.config.serializers)
+
+        self.metrics = MqttMetrics(labels={"client_id": self.config.client_id})
+        self._init_metrics()
+
+        self._reconnect_backoff = Backoff(
+            min_delay=self.config.reconnect_min_delay,
+            max_delay=self.config.reconnect_max_delay,
+            jitter=self.config.reconnect_jitter,
+        )
+
         # Create userdata for this client
         self.userdata = MqttUserdata(self, log=self.log.getChild("Userdata"))
 
         # Create and configure Paho Client
         self.config._phao_initialize(self)
 
-        self._paho_client.enable_logger(logger=self.log.getChild("PahoClient"))
+        # Paho logs every packet sent and received
+        if not self.config.quiet_hot_path:
+            self._paho_client.enable_logger(logger=self.log.getChild("PahoClient"))
 
         # Add callbacks to Paho Client
         self._paho_client.on_connect = self._on_connect
+        self._paho_client.on_connect_fail = self._on_connect_fail
         self._paho_client.on_disconnect = self._on_disconnect
         self._paho_client.on_subscribe = self._on_subscribe
         self._paho_client.on_unsubscribe = self._on_unsubscribe
-        # self._paho_client.on_publish = self._on_publish
+        self._paho_client.on_publish = self._on_publish
         self._paho_client.on_message = self._on_message
 
+    def _init_metrics(self):
+        metrics = self.metrics
+
+        # Updated on the hot paths, kept as attributes to skip the registry lookup
+        self._published_messages = metrics.counter(
+            "mqtt_messages_published_total", "Messages handed to paho for sending"
+        )
+        self._published_bytes = metrics.counter(
+            "mqtt_published_bytes_total", "Payload bytes handed to paho for sending"
+        )
+        self._received_messages = metrics.counter(
+            "mqtt_messages_received_total", "Messages received from the broker"
+        )
+        self._received_bytes = metrics.counter(
+            "mqtt_received_bytes_total", "Payload bytes received from the broker"
+        )
+        self._acked_messages = metrics.counter(
+            "mqtt_messages_acked_total", "Sent messages completed with PUBACK/PUBCOMP"
+        )
+        self._dropped_messages = metrics.counter(
+            "mqtt_messages_dropped_total",
+            "Publishes paho refused and received messages matching no subscription",
+        )
+        self._message_callback_time = metrics.timer(
+            "mqtt_message_callback_seconds",
+            "Time spent dispatching a received message, including inline listeners",
+        )
+        self._ack_latency = metrics.timer(
+            "mqtt_ack_latency_seconds", "Publish to PUBACK/PUBCOMP"
+        )
+        self._reconnects = metrics.counter(
+            "mqtt_reconnects_total", "Connections restored after losing the connection"
+        )
+        self._connect_failures = metrics.counter(
+            "mqtt_connect_failures_total", "Reconnect attempts that could not open a connection"
+        )
+        self._reconnect_time = metrics.timer(
+            "mqtt_reconnect_seconds", "Connection lost to CONNACK of the reconnect"
+        )
+        self._outage_time = metrics.timer(
+            "mqtt_outage_seconds",
+            "Connection lost to every subscription restored, no messages arrive meanwhile",
+        )
+
+        # Read from state the client keeps anyway, nothing to update
+        metrics.gauge(
+            "mqtt_connected", "1 when connected", lambda: int(self.is_connected())
+        )
+        metrics.gauge(
+            "mqtt_inflight_messages",
+            "Sent QoS 1/2 messages waiting for PUBACK/PUBCOMP",
+            lambda: len(self.userdata._messages_by_mid),
+        )
+        metrics.gauge(
+            "mqtt_paho_queue_depth",
+            "Packets queued in paho waiting to be written to the socket",
+            lambda: len(self._paho_client._out_packet),
+        )
+        metrics.gauge(
+            "mqtt_subscriptions",
+            "Subscriptions, active or not",
+            lambda: len(self.userdata.subscriptions),
+        )
+        metrics.gauge(
+            "mqtt_active_subscriptions",
+            "Subscriptions with a granted SUBACK",
+            lambda: sum(
+                1 for subscription in list(self.userdata.subscriptions)
+                if subscription.is_active()
+            ),
+        )
+        metrics.gauge(
+            "mqtt_handler_queue_depth",
+            "Messages handed to subscription handlers not completed yet",
+            lambda: sum(
+                listener.stats.queue_depth
+                for subscription in list(self.userdata.subscriptions)
+                for listener in subscription._listeners
+                if isinstance(listener, MqttHandler)
+            ),
+        )
+
+        queue = self.offline_queue
+        if queue is not None:
+            metrics.gauge(
+                "mqtt_offline_queue_messages",
+                "Publishes held by the offline queue, replayed ones included until acknowledged",
+                lambda: len(queue),
+            )
+            metrics.gauge(
+                "mqtt_offline_queue_bytes",
+                "Topic and payload bytes held by the offline queue",
+                lambda: queue.byte_count,
+            )
+            metrics.counter(
+                "mqtt_offline_queued_total",
+                "Publishes captured by the offline queue",
+                lambda: queue.queued_count,
+            )
+            metrics.counter(
+                "mqtt_offline_dropped_total",
+                "Publishes the offline queue dropped to stay within its limits",
+                lambda: queue.dropped_count,
+            )
+            metrics.counter(
+                "mqtt_offline_replayed_total",
+                "Queued publishes replayed and acknowledged",
+                lambda: queue.replayed_count,
+            )
+
+        flow_control = self.flow_control
+        if flow_control is not None:
+            stats = flow_control.stats
+            metrics.counter(
+                "mqtt_flow_control_throttled_total",
+                "Publishes held back by a rate limit",
+                lambda: stats.throttled_count,
+            )
+            metrics.counter(
+                "mqtt_flow_control_rejected_total",
+                "Publishes rejected by a rate limit",
+                lambda: stats.rejected_count,
+            )
+            metrics.counter(
+                "mqtt_flow_control_throttle_seconds_total",
+                "Time publishes were held back by rate limits",
+                lambda: stats.throttle_time_ns / 1e9,
+            )
+            metrics.gauge(
+                "mqtt_flow_control_send_rate",
+                "Publishes per second through flow control, moving average",
+                lambda: stats.send_rate,
+            )
+            metrics.gauge(
+                "mqtt_flow_control_queue_depth",
+                "Publishes waiting for tokens in queue mode",
+                lambda: flow_control.queue_depth,
+            )
+
+        aliases = self.topic_aliases
+        received_aliases = self.received_topic_aliases
+        metrics.gauge(
+            "mqtt_topic_aliases", "Topic aliases set up for publishing", lambda: len(aliases)
+        )
+        metrics.counter(
+            "mqtt_topic_alias_publishes_total",
+            "Publishes sent with only a topic alias",
+            lambda: aliases.aliased_count,
+        )
+        metrics.counter(
+            "mqtt_topic_alias_evictions_total",
+            "Topic aliases handed to another topic because the table was full",
+            lambda: aliases.evicted_count,
+        )
+        # Gauges, setting up an alias costs bytes so they can go down
+        metrics.gauge(
+            "mqtt_topic_alias_bytes_saved",
+            "Bytes topic aliases saved on publishes, net of the alias properties",
+            lambda: aliases.bytes_saved,
+        )
+        metrics.gauge(
+            "mqtt_received_topic_alias_bytes_saved",
+            "Bytes topic aliases saved on received messages, net of the alias properties",
+            lambda: received_aliases.bytes_saved,
+        )
+
+        compression = self.compression.stats
+        metrics.counter(
+            "mqtt_compressed_messages_total",
+            "Publishes sent compressed",
+            lambda: compression.compressed_count,
+        )
+        metrics.counter(
+            "mqtt_compression_skipped_total",
+            "Publishes matching a compression policy sent as they are, too small or not compressible",
+            lambda: compression.skipped_count,
+        )
+        metrics.gauge(
+            "mqtt_compression_ratio",
+            "Compressed over original size of publishes sent compressed",
+            lambda: compression.ratio,
+        )
+        metrics.counter(
+            "mqtt_compression_cpu_seconds_total",
+            "CPU time spent compressing publishes",
+            lambda: compression.compress_time_ns / 1e9,
+        )
+        metrics.counter(
+            "mqtt_decompressed_messages_total",
+            "Received messages decompressed",
+            lambda: compression.decompressed_count,
+        )
+        metrics.counter(
+            "mqtt_decompression_cpu_seconds_total",
+            "CPU time spent decompressing received messages",
+            lambda: compression.decompress_time_ns / 1e9,
+        )
+        metrics.counter(
+            "mqtt_decompression_failed_total",
+            "Received messages delivered compressed because decompressing failed",
+            lambda: compression.failed_count,
+        )
+
+    def _message_acked(self, message: MqttMessage):
+        self._acked_messages.inc()
+        latency_ns = message.latency_ns
+        if latency_ns is not None:
+            self._ack_latency.record(latency_ns)
+
     def subscribe(self, topic: str, qos: int = 1) -> MqttSubscription:
 
         subscription = self.userdata.subscribe(topic, qos)
 
         return subscription
 
-    def unsubscribe(self, topic: str):
-        for subscription in self.userdata.subscriptions():
-            if subscription.topic == topic:
-                self._paho_client.unsubscribe(topic)
-                return subscription
+    def subscribe_many(self, topics: Iterable[Tuple[str, int]]) -> MqttSubscriptionBatch:
+        """subscribe_many Subscribe to (topic, qos) pairs with as few SUBSCRIBE packets as possible
 
-    def start(self, blocking=True, timeout=None):
+        Topics already subscribed to are part of the batch without sending anything,
+        see config.subscribe_batch_size for how many topics go in a packet.
+
+        Args:
+            topics (Iterable[Tuple[str, int]]): (topic, qos) pairs
+
+        Returns:
+            MqttSubscriptionBatch: Handle to wait on, with the granted QoS per topic
+        """
+        subscriptions = self.userdata.subscribe_many(topics)
+
+        return MqttSubscriptionBatch(self.userdata, subscriptions)
+
+    def unsubscribe(self, topic: str) -> MqttSubscription:
+        subscription = self.userdata.get_subscription(topic=topic)
+        if subscription is None:
+            self.log.warning(f"Not subscribed to topic: '{topic=}'")
+            return None
 
+        self.userdata.unsubscribe_subscriptions([subscription])
+
+        return subscription
+
+    def unsubscribe_many(self, topics: Iterable[str]) -> MqttSubscriptionBatch:
+        """unsubscribe_many Unsubscribe from topics with as few UNSUBSCRIBE packets as possible
+
+        Args:
+            topics (Iterable[str]): Topics to unsubscribe from, topics not subscribed to are skipped
+
+        Returns:
+            MqttSubscriptionBatch: Handle to wait on until every subscription is removed
+        """
+        subscriptions: List[MqttSubscription] = []
+        for topic in topics:
+            subscription = self.userdata.get_subscription(topic=topic)
+            if subscription is None:
+                self.log.warning(f"Not subscribed to topic: '{topic=}'")
+                continue
+            subscriptions.append(subscription)
+
+        self.userdata.unsubscribe_subscriptions(subscriptions)
+
+        return MqttSubscriptionBatch(self.userdata, subscriptions, action=UNSUBSCRIBE)
+
+    def connect(self):
+        """connect Configure paho and open the connection without starting a network loop
+
+        Used by start, and by AsyncMqttClient which drives paho from an asyncio event loop.
+        """
         self.log.info(f"Connecting to {self.config.host}:{self.config.port}")
 
         self.config._paho_config(self)
 
+    def start(self, blocking=True, timeout=None):
+
+        self.connect()
+
         self._paho_client.loop_start()
 
         if blocking:
@@ -64,6 +405,7 @@ class MqttClient:
                 timeout=timeout,
                 log=self.log,
                 reason="Waiting for conenction",
+                notifier=self._connection_notifier,
             )
 
         # timeout_time = None if timeout is None else time.time() + timeout
@@ -85,14 +427,105 @@ class MqttClient:
         self._paho_client.disconnect()
         self._paho_client.loop_stop()
 
+        if self.offline_queue is not None:
+            self.offline_queue.close()
+        if self.flow_control is not None:
+            self.flow_control.close()
+
     def publish(
-        self, topic: str, payload: bytes, qos: int = 1, retain: bool = False
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 1,
+        retain: bool = False,
+        serializer: Union[str, MqttSerializer] = None,
+        listener: MqttPublishListener = None,
     ) -> MqttMessage:
-
-        paho_message_info = self._paho_client.publish(
-            topic, payload=payload, qos=qos, retain=retain
+        """publish Publish a payload, serialized by serializer or the serializer of the topic
+
+        Args:
+            topic (str): Topic to publish to
+            payload (Any): bytes-like payloads are sent as they are unless serializer is given,
+                other values go through the serializer, or are utf-8 encoded from str(payload) without one
+            qos (int, optional): QoS. Defaults to 1.
+            retain (bool, optional): Retain flag. Defaults to False.
+            serializer (Union[str, MqttSerializer], optional): Registered name or serializer. Defaults to None, the one MqttConfig.serializers gives the topic
+            listener (MqttPublishListener, optional): Told when the message is acknowledged or failed. Defaults to None.
+
+        Returns:
+            MqttMessage: Sent message, its payload is the serialized bytes
+        """
+        return self._publish(
+            topic, payload, qos, retain, listener=listener, serializer=serializer
         )
 
+    def publish_many(
+        self,
+        messages: Iterable[Tuple[str, bytes]],
+        qos: int = 1,
+        retain: bool = False,
+        timeout: int = None,
+        serializer: Union[str, MqttSerializer] = None,
+    ) -> MqttPublishBatch:
+        """publish_many Publish (topic, payload) pairs without waiting for each PUBACK
+
+        Keeps at most inflight_window QoS 1/2 messages of the batch outstanding,
+        so the batch is pipelined without growing paho's queue without bound.
+        Must not be called from a paho callback, the window is freed by that same thread.
+
+        Args:
+            messages (Iterable[Tuple[str, bytes]]): (topic, payload) pairs
+            qos (int, optional): QoS for every message. Defaults to 1.
+            retain (bool, optional): Retain flag for every message. Defaults to False.
+            timeout (int, optional): Max seconds to wait for room in the window per message. Defaults to None, blocking forever
+            serializer (Union[str, MqttSerializer], optional): Serializer for every payload, see publish. Defaults to None.
+
+        Returns:
+            MqttPublishBatch: Handle to wait on and inspect the batch
+        """
+        batch = MqttPublishBatch(self.userdata)
+        window = self.inflight_window if qos > 0 else 0
+
+        for topic, payload in messages:
+            if not batch.wait_for_window(window, timeout):
+                self.log.warning(f"Batch window did not free up, stopping: '{batch=}'")
+                break
+
+            self._publish(topic, payload, qos, retain, listener=batch, serializer=serializer)
+
+        return batch
+
+    def _publish(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int,
+        retain: bool,
+        listener: MqttPublishListener = None,
+        serializer: Union[str, MqttSerializer] = None,
+    ) -> MqttMessage:
+        if serializer is not None or self.serializers:
+            payload = self.serializers.dumps(topic, payload, serializer)
+
+        # bytes, bytearray and memoryview are passed on without copying
+        payload = to_payload(payload)
+
+        queue = self.offline_queue
+        if queue is not None:
+            with queue.lock:
+                if queue.is_capturing(self.is_connected()):
+                    return self._publish_offline(topic, payload, qos, retain, listener)
+
+        flow_control = self.flow_control
+        if flow_control is not None and not flow_control.acquire(topic):
+            # Over quota, rejected or queued for later
+            return self._publish_throttled(topic, payload, qos, retain, listener)
+
+        paho_payload, properties = self._encode_payload(topic, payload)
+
+        timestamp_ns = time_ns()
+        paho_message_info = self._paho_publish(topic, paho_payload, qos, retain, properties)
+
         message = MqttMessage(
             userdata=self.userdata,
             mid=paho_message_info.mid,
@@ -101,20 +534,303 @@ class MqttClient:
             qos=qos,
             retain=retain,
             paho_message_info=paho_message_info,
+            listener=listener,
         )
+        # Latency is measured from before paho got the message
+        message._timestamp_ns = timestamp_ns
+
+        if message.is_failed():
+            self._dropped_messages.inc()
+        else:
+            self._published_messages.inc()
+            self._published_bytes.inc(len(paho_payload))
 
         return message
 
+    def _publish_offline(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int,
+        retain: bool,
+        listener: MqttPublishListener = None,
+    ) -> MqttMessage:
+        message = MqttMessage(
+            userdata=self.userdata,
+            mid=0,
+            topic=topic,
+            payload=payload,
+            qos=qos,
+            retain=retain,
+            listener=listener,
+            queued=True,
+        )
+
+        if not self.offline_queue.put(message):
+            message._queued_dropped()
+            self._dropped_messages.inc()
+
+        return message
+
+    def _publish_throttled(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int,
+        retain: bool,
+        listener: MqttPublishListener = None,
+    ) -> MqttMessage:
+        message = MqttMessage(
+            userdata=self.userdata,
+            mid=0,
+            topic=topic,
+            payload=payload,
+            qos=qos,
+            retain=retain,
+            listener=listener,
+            queued=True,
+        )
+
+        if not self.flow_control.put(message):
+            message._queued_dropped()
+            self._dropped_messages.inc()
+
+        return message
+
+    def _replay_offline(self):
+        """_replay_offline Publish queued messages in order while connected
+
+        Runs on its own thread, started by _on_connect. Keeps at most inflight_window
+        replayed messages waiting for PUBACK/PUBCOMP, paced by the replay_rate of the queue.
+        """
+        queue = self.offline_queue
+        while True:
+            self._replay_offline_connected()
+            queue.stop_replay()
+
+            # A reconnect while stopping found the replay still running and left it to this thread
+            if not (self.is_connected() and queue.start_replay()):
+                return
+
+    def _replay_offline_connected(self):
+        queue = self.offline_queue
+        window = self.inflight_window
+        rate = queue.policy.replay_rate
+        interval = 1 / rate if rate else 0
+        next_send = time.monotonic()
+
+        self.log.info("Replaying %d queued messages", len(queue))
+
+        while self.is_connected():
+            queue.complete()
+
+            if not queue.pending_count or (window and queue.in_flight_count >= window):
+                if not queue.in_flight_count:
+                    if queue.finish_replay():
+                        self.log.info("Offline queue replayed: '%r'", queue)
+                        return
+                    continue
+
+                wait(
+                    condition=lambda: queue.has_completed() or not self.is_connected(),
+                    timeout=1,
+                    notifier=self.userdata.notifier,
+                )
+                continue
+
+            if interval:
+                now = time.monotonic()
+                if next_send > now:
+                    time.sleep(next_send - now)
+                next_send = max(next_send, now) + interval
+
+            record = queue.get()
+            if record is not None:
+                self._send_offline(record)
+
+    def _send_offline(self, record: MqttOfflineRecord):
+        # Complete the message publish returned, it is gone after a restart
+        message = record.message() if record.message else None
+        if message is None:
+            message = MqttMessage(
+                userdata=self.userdata,
+                mid=0,
+                topic=record.topic,
+                payload=record.payload,
+                qos=record.qos,
+                retain=record.retain,
+                queued=True,
+            )
+
+        # Replay is not exempt from rate limits, whatever the mode it waits for tokens
+        if self.flow_control is not None:
+            self.flow_control.wait_for_tokens(record.topic)
+
+        self._send_queued(message)
+        record.sent = message
+
+    def _send_queued(self, message: MqttMessage):
+        """_send_queued Hand a message held by the offline queue or flow control to paho"""
+        paho_payload, properties = self._encode_payload(message.topic, message.payload)
+
+        message._timestamp_ns = time_ns()
+        paho_message_info = self._paho_publish(
+            message.topic, paho_payload, message.qos, message.retain, properties
+        )
+        message._queued_sent(paho_message_info)
+
+        if message.is_failed():
+            self._dropped_messages.inc()
+        else:
+            self._published_messages.inc()
+            self._published_bytes.inc(len(paho_payload))
+            self.userdata.track_sent_message(message)
+
+        # Wakes up wait_for_communication of the queued message
+        self.userdata.notifier.notify()
+
+    def _encode_payload(self, topic: str, payload: bytes) -> Tuple[bytes, Properties]:
+        """_encode_payload Compress a payload as the compression policies say
+
+        Returns:
+            Tuple[bytes, Properties]: Payload for paho and the PUBLISH properties naming its codec, None for none
+        """
+        compression = self.compression
+        if not compression.policies:
+            return to_paho_payload(payload), None
+
+        payload, encoding = compression.encode(topic, payload)
+
+        properties = None
+        if encoding is not None and not compression.framed:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.UserProperty = (CONTENT_ENCODING, encoding)
+
+        return to_paho_payload(payload), properties
+
+    def _paho_publish(
+        self,
+        topic: str,
+        paho_payload: bytes,
+        qos: int,
+        retain: bool,
+        properties: Properties = None,
+    ) -> PahoClient.MQTTMessageInfo:
+        """_paho_publish Publish through paho, with a topic alias when the connection allows it"""
+        aliases = self.topic_aliases
+        if not aliases.maximum:
+            return self._paho_client.publish(
+                topic, payload=paho_payload, qos=qos, retain=retain, properties=properties
+            )
+
+        paho_client = self._paho_client
+        window = self.inflight_window
+
+        # Held until paho queued the packet, so aliases reach the broker in the order they were set up
+        with aliases.lock:
+            # paho holds back QoS 1/2 messages over the inflight window and sends them later,
+            #   after packets published meanwhile, those go without alias
+            if qos and window and len(paho_client._out_messages) >= window:
+                return paho_client.publish(
+                    topic, payload=paho_payload, qos=qos, retain=retain, properties=properties
+                )
+
+            topic_bytes = topic.encode("utf-8")
+            wire_topic, alias = aliases.alias(topic, len(topic_bytes))
+            if not alias:
+                return paho_client.publish(
+                    topic, payload=paho_payload, qos=qos, retain=retain, properties=properties
+                )
+
+            # Shallow copy, the properties without alias are kept for a resend
+            alias_properties = copy.copy(properties) or Properties(PacketTypes.PUBLISH)
+            alias_properties.TopicAlias = alias
+            paho_message_info = paho_client.publish(
+                wire_topic,
+                payload=paho_payload,
+                qos=qos,
+                retain=retain,
+                properties=alias_properties,
+            )
+
+            # paho resends from its copy after a reconnect, when the aliases are gone.
+            #   Done under the lock: _on_connect resets the aliases under it too, and paho
+            #   only resends after _on_connect returned, so a resend never sees the alias.
+            # Relies on paho-mqtt 1.6.1 internals, _out_messages and MQTTMessage.topic being
+            #   bytes, check this when the paho pin in setup.py changes
+            if qos:
+                paho_message = paho_client._out_messages.get(paho_message_info.mid)
+                if paho_message is not None:
+                    paho_message.topic = topic_bytes
+                    paho_message.properties = properties
+
+        return paho_message_info
+
+    def get_executor(self, executor: str) -> Executor:
+        """get_executor Get the shared thread or process pool used by subscription handlers
+
+        Args:
+            executor (str): thread or process
+
+        Returns:
+            Executor: Shared pool, created on first use
+        """
+        with self._executors_lock:
+            pool = self._executors.get(executor)
+            if pool is None:
+                if executor == "thread":
+                    pool = ThreadPoolExecutor(
+                        max_workers=self.config.handler_threads,
+                        thread_name_prefix=f"Handler.{self.config.client_id}",
+                    )
+                elif executor == "process":
+                    # Forking while paho and handler threads run can copy held locks into the child
+                    method = (
+                        "forkserver"
+                        if "forkserver" in multiprocessing.get_all_start_methods()
+                        else "spawn"
+                    )
+                    pool = ProcessPoolExecutor(
+                        max_workers=self.config.handler_processes,
+                        mp_context=multiprocessing.get_context(method),
+                    )
+                else:
+                    raise ValueError(f"Invalid executor '{executor}'")
+                self._executors[executor] = pool
+
+        return pool
+
+    def shutdown_executors(self, wait: bool = True):
+        """shutdown_executors Shut down handler pools, handlers added after this create new ones"""
+        with self._executors_lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+
+        for pool in executors:
+            pool.shutdown(wait=wait)
+
     def get_paho(self) -> PahoClient.Client:
         return self._paho_client
 
     def is_connected(self):
         return self._paho_client.is_connected()
 
+    @property
+    def topic_alias_maximum(self) -> int:
+        """topic_alias_maximum Topic aliases the broker accepts from us, from its MQTTv5 CONNACK, 0 when none"""
+        return getattr(self.connack_properties, "TopicAliasMaximum", 0)
+
+    @property
+    def maximum_packet_size(self) -> int:
+        """maximum_packet_size Largest packet the broker accepts, from its MQTTv5 CONNACK, None when not limited"""
+        return getattr(self.connack_properties, "MaximumPacketSize", None)
+
     def _on_connect(self, paho_client, userdata, flags, rc, properties=None):
         self.log.info(f"Connection code: {rc}")
 
         self._paho_rc = rc
+        self.connack_properties = properties
+        self._connection_notifier.notify()
 
         if self._paho_rc != PahoClient.MQTT_ERR_SUCCESS:
             self.log.error(
@@ -122,60 +838,173 @@ class MqttClient:
             )
             return
 
-        for subscription in userdata.subscriptions:
-            subscription.wait_for_active()
+        self._reconnect_backoff.reset()
+        self._apply_connack_limits(properties)
+
+        self.topic_aliases.reset(self.topic_alias_maximum if self.config.topic_aliases else 0)
+        self.received_topic_aliases.reset()
+
+        # Only send SUBSCRIBE, SUBACK is handled by this thread so it can not be waited for here
+        mids = userdata.activate_subscriptions(list(userdata.subscriptions))
+
+        # Replay waits for PUBACKs, which this thread delivers
+        self._start_offline_replay()
+
+        if self._disconnected_ns is None:
+            return
+
+        self._reconnects.inc()
+        self._reconnect_time.record(time_ns() - self._disconnected_ns)
+
+        self._restore_mids = set(mids)
+        if not self._restore_mids:
+            self._subscriptions_restored()
+
+    def _start_offline_replay(self):
+        if self.offline_queue is None or not self.offline_queue.start_replay():
+            return
+
+        threading.Thread(
+            target=self._replay_offline,
+            name=f"OfflineReplay.{self.config.client_id}",
+            daemon=True,
+        ).start()
+
+    def _apply_connack_limits(self, properties):
+        """_apply_connack_limits Stay within the MQTTv5 Receive Maximum the broker gave in CONNACK
+
+        Topic Alias Maximum is applied to topic_aliases by _on_connect.
+        """
+        window = self.config.max_inflight_messages
+        receive_maximum = getattr(properties, "ReceiveMaximum", None)
+        if receive_maximum and (not window or receive_maximum < window):
+            self.log.info("Broker Receive Maximum %d, limiting inflight messages", receive_maximum)
+            window = receive_maximum
+
+        self.inflight_window = window
+        self._paho_client.max_inflight_messages_set(window)
+
+    def _on_connect_fail(self, paho_client, userdata):
+        self._connect_failures.inc()
+        delay = self._schedule_reconnect()
+        self.log.warning("Reconnect failed, retrying in %.2f seconds", delay)
+
+    def _schedule_reconnect(self) -> float:
+        """_schedule_reconnect Set the wait before paho's next reconnect attempt
+
+        Paho doubles its delay without jitter, giving it the same min and max makes it use ours.
+
+        Returns:
+            float: Seconds until the next attempt
+        """
+        delay = self._reconnect_backoff.next_delay()
+        self._paho_client.reconnect_delay_set(min_delay=delay, max_delay=delay)
+        return delay
+
+    def _subscriptions_restored(self):
+        self._outage_time.record(time_ns() - self._disconnected_ns)
+        self._disconnected_ns = None
 
     def _on_disconnect(self, paho_client, userdata, rc, properties=None):
 
         self.log.info(f"Disconnected code: {rc}")
 
         self._paho_rc = rc
+        self._connection_notifier.notify()
+
+        # Publishes until the next CONNACK go without alias
+        self.topic_aliases.reset(0)
 
-        for subscription in userdata.subscriptions:
-            subscription.deactivate(self._paho_rc)
+        userdata.connection_lost(self._paho_rc)
+        self._restore_mids = set()
+        if self.offline_queue is not None:
+            self.offline_queue.connection_lost()
 
         if self._paho_rc != PahoClient.MQTT_ERR_SUCCESS:
+            # Outage counts from the first loss, not from a failed reconnect
+            if self._disconnected_ns is None:
+                self._disconnected_ns = time_ns()
+
+            delay = self._schedule_reconnect()
             self.log.error(
-                f"Disconnection ERROR (Unexpected) [{self._paho_rc}]: {PahoClient.connack_string(self._paho_rc)}"
+                f"Disconnection ERROR (Unexpected) [{self._paho_rc}]: {PahoClient.connack_string(self._paho_rc)}, reconnecting in {delay:.2f} seconds"
             )
+        else:
+            self._disconnected_ns = None
 
         return
 
     def _on_subscribe(self, paho_client, userdata, mid, granted_qos, properties=None):
         self.log.info(f"Subscribed: {mid=}")
 
-        # Avoid race condition where callback triggers before subscribe call gets an RC.
-        #   This is fairly rare, seem to be around every 1/1000 time or so on local computer network
-        wait(
-            condition=lambda: userdata.get_subscription(mid=mid) is not None,
-            timeout=3,
-            log=self.log,
-            reason="Waiting for subscription",
-            resolution=100,
-        )
-
-        subscription = userdata.get_subscription(mid=mid)
+        # Callback can trigger before subscribe call gets an RC,
+        #   userdata keeps the SUBACK until the mid is registered in that case
+        userdata.subscribe_callback(mid, granted_qos)
 
-        subscription.subscribe_callback(granted_qos)
-        paho_client.message_callback_add(
-            subscription.topic, subscription.message_callback
-        )
+        if mid in self._restore_mids:
+            self._restore_mids.discard(mid)
+            if not self._restore_mids:
+                self._subscriptions_restored()
 
-    def _on_unsubscribe(self, paho_client, userdata, mid):
-        self.log.info("Unsubscribed")
-        subscription = userdata.subscription(mid)
-        paho_client.message_callback_remove(subscription.topic)
-        subscription.unsubscribed()
-        userdata.remove_subscription(subscription)
+    def _on_unsubscribe(self, paho_client, userdata, mid, properties=None, reasoncodes=None):
+        self.log.info(f"Unsubscribed: {mid=}")
+        userdata.unsubscribe_callback(mid)
 
-    # ? Dont think this is needed as we use MqttMessageInfo object instead
-    # def _on_publish(self, paho_client, userdata, mid):
-    #     sent_message = userdata.get_sent_message(mid)
-    #     sent_message.published()
+    def _on_publish(self, paho_client, userdata, mid):
+        # MqttMessageInfo tracks completion per message, this wakes up anyone waiting on several
+        userdata.published_callback(mid)
 
     def _on_message(self, paho_client, userdata, message):
-        self.log.error(
-            "Uncaught message. topic '{}', qos '{}', retain '{}', payload '{}'".format(
-                message.topic, message.qos, message.retain, str(message.payload)
-            )
-        )
+        # Dispatch is done here instead of paho message_callback_add, paho matches every filter linearly
+        start_ns = perf_counter_ns()
+        self._received_messages.inc()
+        self._received_bytes.inc(len(message.payload))
+
+        if self.config.topic_alias_receive_maximum:
+            self._resolve_topic_alias(message)
+
+        topic = message.topic
+
+        if self._decode_payloads:
+            self._decode_payload(topic, message)
+        subscriptions = userdata.match_subscriptions(topic)
+
+        if not subscriptions:
+            self._dropped_messages.inc()
+            if not self.config.quiet_hot_path:
+                self.log.error(
+                    "Uncaught message. topic '%s', qos '%s', retain '%s', payload '%s'",
+                    topic,
+                    message.qos,
+                    message.retain,
+                    message.payload,
+                )
+            return
+
+        for subscription in subscriptions:
+            subscription.message_callback(paho_client, userdata, message)
+
+        self._message_callback_time.record(perf_counter_ns() - start_ns)
+
+    def _resolve_topic_alias(self, message: PahoClient.MQTTMessage):
+        alias = getattr(getattr(message, "properties", None), "TopicAlias", None)
+        if not alias:
+            return
+
+        topic = self.received_topic_aliases.resolve(message._topic, alias)
+        if topic is None:
+            self.log.error("Received unknown topic alias %d, mid %d", alias, message.mid)
+            return
+        message.topic = topic
+
+    def _decode_payload(self, topic: str, message: PahoClient.MQTTMessage):
+        compression = self.compression
+        encoding = None
+        if not compression.framed:
+            for name, value in getattr(message.properties, "UserProperty", ()):
+                if name == CONTENT_ENCODING:
+                    encoding = value
+            if encoding is None:
+                return
+
+        message.payload = compression.decode(topic, message.payload, encoding)
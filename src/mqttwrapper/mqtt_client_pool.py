@@ -0,0 +1,265 @@
+import itertools
+import logging
+import threading
+import time
+import zlib
+
+from .mqtt_config import MqttConfig
+from .mqtt_client import MqttClient
+from .mqtt_message import MqttMessage, MqttReceivedMessage
+from .mqtt_subscription import MqttSubscription
+from .mqtt_serializer import MqttSerializer
+from .mqtt_stream import MqttMessageStream, DROP_OLDEST
+from .mqtt_handler import MqttHandler, INLINE
+from .mqtt_metrics import format_prometheus
+from .helper import wait, Notifier
+
+from typing import Any, Callable, List, Union
+
+TOPIC_HASH = "topic"
+ROUND_ROBIN = "round_robin"
+
+SHARDING_MODES = [TOPIC_HASH, ROUND_ROBIN]
+
+
+class MqttSubscriptionGroup:
+    """MqttSubscriptionGroup One topic subscribed on one or more clients of an MqttClientPool
+
+    Gives the same waiting, counting and consuming surface as a single MqttSubscription.
+    """
+
+    def __init__(self, topic: str, subscriptions: List[MqttSubscription]):
+        self.topic = topic
+        self.subscriptions = subscriptions
+
+        self._notifier = Notifier()
+        for subscription in subscriptions:
+            subscription.add_listener(self._message_listener)
+
+    def _message_listener(self, message: MqttReceivedMessage):
+        self._notifier.notify()
+
+    @property
+    def total_message_count(self) -> int:
+        return sum(subscription.total_message_count for subscription in self.subscriptions)
+
+    @property
+    def messages(self) -> List[MqttReceivedMessage]:
+        """messages Retained messages of every subscription, oldest first"""
+        messages = [
+            message
+            for subscription in self.subscriptions
+            for message in subscription.messages
+        ]
+        messages.sort(key=lambda message: message.timestamp_ns)
+        return messages
+
+    def is_active(self) -> bool:
+        return all(subscription.is_active() for subscription in self.subscriptions)
+
+    def wait_for_active(self, timeout: int = None) -> bool:
+        """wait_for_active Block until every subscription got its SUBACK or timeout
+
+        Returns:
+            bool: True if all subscriptions are active
+        """
+        timeout_time = None if timeout is None else time.time() + timeout
+
+        for subscription in self.subscriptions:
+            remaining = None if timeout is None else max(0, timeout_time - time.time())
+            subscription.wait_for_active(remaining)
+
+        return self.is_active()
+
+    def wait_for_message(self, timeout: int = None) -> bool:
+        """wait_for_message Block until a message arrive on any subscription or timeout
+
+        Returns:
+            bool: True if a message arrived before timeout
+        """
+        total_message_count = self.total_message_count
+
+        return wait(
+            condition=lambda: total_message_count != self.total_message_count,
+            timeout=timeout,
+            reason="Waiting for message",
+            notifier=self._notifier,
+        )
+
+    def add_listener(self, listener: Callable[[MqttReceivedMessage], None]):
+        for subscription in self.subscriptions:
+            subscription.add_listener(listener)
+
+    def remove_listener(self, listener: Callable[[MqttReceivedMessage], None]):
+        for subscription in self.subscriptions:
+            subscription.remove_listener(listener)
+
+    def add_handler(
+        self,
+        function: Callable[[MqttReceivedMessage], None],
+        executor: str = INLINE,
+        ordered: bool = False,
+    ) -> List[MqttHandler]:
+        """add_handler Add function as a handler on every subscription, see MqttSubscription.add_handler
+
+        Returns:
+            List[MqttHandler]: One handler per subscription
+        """
+        return [
+            subscription.add_handler(function, executor=executor, ordered=ordered)
+            for subscription in self.subscriptions
+        ]
+
+    def stream(
+        self, timeout: float = None, maxsize: int = 1000, policy: str = DROP_OLDEST
+    ) -> MqttMessageStream:
+        """stream Iterate over new messages from every subscription, see MqttSubscription.stream"""
+        return MqttMessageStream(self, timeout=timeout, maxsize=maxsize, policy=policy)
+
+    def __repr__(self) -> str:
+        return "{}(topic={!r}, subscriptions={})".format(
+            type(self).__name__, self.topic, len(self.subscriptions)
+        )
+
+
+class MqttClientPool:
+    """MqttClientPool Spread publish and subscribe over several connections
+
+    Creates size clients from one config template, with client_id '<client_id>-<n>'.
+
+    sharding decides which client publishes a message:
+
+    * topic: hash of the topic, every message on a topic goes through the same connection and keeps its order
+    * round_robin: clients take turns, no ordering between messages
+
+    Subscriptions go to one client picked by topic hash, or with share_group to every client
+    as '$share/<share_group>/<topic>' so the broker spreads the messages over the connections.
+    """
+
+    def __init__(
+        self,
+        config: MqttConfig,
+        size: int = 4,
+        sharding: str = TOPIC_HASH,
+        log: logging.Logger = None,
+    ):
+        if sharding not in SHARDING_MODES:
+            raise ValueError(
+                f"Invalid sharding '{sharding}', valid values are: {SHARDING_MODES}"
+            )
+        if size < 1:
+            raise ValueError(f"size must be at least 1, got '{size}'")
+
+        self.config = config
+        self.sharding = sharding
+        self.log = log if log else logging.getLogger(f"Pool.{config.client_id}")
+
+        self.clients = [
+            MqttClient(
+                config.copy(client_id=f"{config.client_id}-{index}"),
+                log=self.log.getChild(f"Client.{index}"),
+            )
+            for index in range(size)
+        ]
+
+        self._round_robin = itertools.cycle(self.clients)
+        self._round_robin_lock = threading.Lock()
+        self._subscription_groups = {}
+
+    def start(self, blocking=True, timeout=None) -> bool:
+        """start Connect every client, connections are opened in parallel
+
+        Returns:
+            bool: True if every client is connected
+        """
+        for client in self.clients:
+            client.start(blocking=False)
+
+        if blocking:
+            timeout_time = None if timeout is None else time.time() + timeout
+            for client in self.clients:
+                remaining = (
+                    None if timeout is None else max(0, timeout_time - time.time())
+                )
+                wait(
+                    condition=client.is_connected,
+                    timeout=remaining,
+                    log=self.log,
+                    reason="Waiting for conenction",
+                    notifier=client._connection_notifier,
+                )
+
+        return self.is_connected()
+
+    def stop(self):
+        for client in self.clients:
+            client.stop()
+
+    def is_connected(self) -> bool:
+        return all(client.is_connected() for client in self.clients)
+
+    @property
+    def connected_count(self) -> int:
+        return sum(1 for client in self.clients if client.is_connected())
+
+    def to_prometheus(self) -> str:
+        """to_prometheus Metrics of every client, told apart by the client_id label"""
+        return format_prometheus(client.metrics for client in self.clients)
+
+    def client_for_topic(self, topic: str) -> MqttClient:
+        return self.clients[zlib.crc32(topic.encode("utf-8")) % len(self.clients)]
+
+    def _publishing_client(self, topic: str) -> MqttClient:
+        if self.sharding == TOPIC_HASH:
+            return self.client_for_topic(topic)
+
+        with self._round_robin_lock:
+            return next(self._round_robin)
+
+    def publish(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 1,
+        retain: bool = False,
+        serializer: Union[str, MqttSerializer] = None,
+    ) -> MqttMessage:
+        return self._publishing_client(topic).publish(
+            topic, payload, qos=qos, retain=retain, serializer=serializer
+        )
+
+    def subscribe(
+        self, topic: str, qos: int = 1, share_group: str = None
+    ) -> MqttSubscriptionGroup:
+        """subscribe Subscribe on one client, or on every client through a shared subscription
+
+        Args:
+            topic (str): Topic filter
+            qos (int, optional): Requested QoS. Defaults to 1.
+            share_group (str, optional): Subscribe '$share/<share_group>/<topic>' on every client. Defaults to None.
+
+        Returns:
+            MqttSubscriptionGroup: Subscriptions made for topic
+        """
+        if share_group:
+            shared_topic = f"$share/{share_group}/{topic}"
+            subscriptions = [
+                client.subscribe(shared_topic, qos) for client in self.clients
+            ]
+        else:
+            subscriptions = [self.client_for_topic(topic).subscribe(topic, qos)]
+
+        group = MqttSubscriptionGroup(topic, subscriptions)
+        self._subscription_groups[topic] = group
+        return group
+
+    def unsubscribe(self, topic: str) -> MqttSubscriptionGroup:
+        group = self._subscription_groups.pop(topic, None)
+        if group is None:
+            self.log.warning(f"Not subscribed to topic: '{topic=}'")
+            return None
+
+        for subscription in group.subscriptions:
+            subscription.userdata.client.unsubscribe(subscription.topic)
+
+        return group
@@ -0,0 +1,377 @@
+from time import time_ns
+
+from .mqtt_message import MqttReceivedMessage
+from .mqtt_message_store import MqttMessageStore, MqttRetentionPolicy
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, Dict, Iterator, List
+
+if TYPE_CHECKING:
+    from .mqtt_subscription import MqttSubscription
+    from .mqtt_serializer import MqttStructSerializer
+
+# Optional, only needed by MqttColumnarMessageStore
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Rows and payload bytes preallocated when the policy gives no max_count
+INITIAL_ROWS = 1024
+INITIAL_PAYLOAD_BYTES = 64 * 1024
+
+# Column name to numpy type, one entry per message
+_COLUMNS = {
+    "timestamp_ns": "i8",
+    "qos": "u1",
+    "retain": "?",
+    "length": "u4",
+    "mid": "i4",
+    "topic_id": "i4",
+}
+
+
+class MqttColumnarMessageStore(MqttMessageStore):
+    """MqttColumnarMessageStore Received messages kept column-wise in numpy arrays
+
+    Same retention and list-like access as MqttMessageStore, but a message is not kept as an
+    object: timestamp, qos, retain, length, mid and topic go into preallocated arrays and the
+    payload into one contiguous arena, found by offset. Indexing builds an MqttReceivedMessage
+    on demand. Exports and queries work on the arrays, without per-message Python objects.
+
+    Live rows are [start, end) of the arrays, eviction moves start and appending moves end.
+    When the arrays are full they are compacted, or doubled when more than half is live.
+    Needs numpy, to_arrow() also needs pyarrow.
+    """
+
+    def __init__(
+        self,
+        policy: MqttRetentionPolicy = None,
+        subscription: "MqttSubscription" = None,
+    ):
+        if numpy is None:
+            raise ImportError("numpy is needed for MqttColumnarMessageStore")
+
+        super().__init__(policy)
+        self.subscription = subscription
+
+        # Twice max_count, so a full store is compacted instead of grown
+        rows = 2 * (self.policy.max_count + 1) if self.policy.max_count else INITIAL_ROWS
+        self._columns: Dict[str, "numpy.ndarray"] = {
+            name: numpy.zeros(rows, dtype=dtype) for name, dtype in _COLUMNS.items()
+        }
+        # Arena offset of each payload, offsets[end] is where the next one goes
+        self._offsets = numpy.zeros(rows + 1, dtype="i8")
+        self._arena = numpy.zeros(INITIAL_PAYLOAD_BYTES, dtype="u1")
+
+        self._start = 0
+        self._end = 0
+
+        self._topics: List[str] = []
+        self._topic_ids: Dict[str, int] = {}
+
+    def append(self, message: MqttReceivedMessage):
+        with self._lock:
+            self._total_count += 1
+
+            if not self.policy.keep_messages:
+                self._evicted_count += 1
+                return
+
+            payload = message.payload
+            length = len(payload)
+            self._make_room(length)
+
+            row = self._end
+            offset = self._offsets[row]
+            if length:
+                self._arena[offset : offset + length] = numpy.frombuffer(payload, dtype="u1")
+            self._offsets[row + 1] = offset + length
+
+            topic_id = self._topic_ids.get(message.topic)
+            if topic_id is None:
+                topic_id = self._topic_ids[message.topic] = len(self._topics)
+                self._topics.append(message.topic)
+
+            columns = self._columns
+            columns["timestamp_ns"][row] = message.timestamp_ns
+            columns["qos"][row] = message.qos
+            columns["retain"][row] = message.retain
+            columns["length"][row] = length
+            columns["mid"][row] = message.mid if message.mid is not None else -1
+            columns["topic_id"][row] = topic_id
+
+            self._end = row + 1
+            self._byte_count += length
+
+            self._evict()
+
+    def _make_room(self, length: int):
+        """_make_room Make sure one more row and length payload bytes fit, lock must be held"""
+        rows = len(self._columns["qos"])
+        arena_size = len(self._arena)
+        used = self._offsets[self._end]
+        if self._end < rows and used + length <= arena_size:
+            return
+
+        live = self._end - self._start
+        base = self._offsets[self._start]
+        live_bytes = used - base
+
+        if live + 1 > rows // 2:
+            rows *= 2
+        while live_bytes + length > arena_size // 2:
+            arena_size *= 2
+
+        for name, column in self._columns.items():
+            moved = numpy.zeros(rows, dtype=column.dtype)
+            moved[:live] = column[self._start : self._end]
+            self._columns[name] = moved
+
+        offsets = numpy.zeros(rows + 1, dtype="i8")
+        offsets[: live + 1] = self._offsets[self._start : self._end + 1] - base
+        self._offsets = offsets
+
+        arena = numpy.zeros(arena_size, dtype="u1")
+        arena[:live_bytes] = self._arena[base:used]
+        self._arena = arena
+
+        self._start = 0
+        self._end = live
+
+    def clear(self):
+        with self._lock:
+            self._evicted_count += self._end - self._start
+            self._start = self._end
+            self._byte_count = 0
+
+    def _evict(self):
+        """_evict Move start past evicted rows until every limit is satisfied, lock must be held"""
+        policy = self.policy
+        start = self._start
+        end = self._end
+
+        if policy.max_count is not None:
+            start = max(start, end - policy.max_count)
+
+        if policy.max_bytes is not None:
+            # Offsets only go up, the first row whose payloads from there on fit the budget
+            lowest_offset = self._offsets[end] - policy.max_bytes
+            start += int(numpy.searchsorted(self._offsets[start:end], lowest_offset))
+
+        if policy.max_age is not None:
+            oldest_allowed_ns = time_ns() - int(policy.max_age * 1e9)
+            start += int(
+                numpy.searchsorted(
+                    self._columns["timestamp_ns"][start:end], oldest_allowed_ns
+                )
+            )
+
+        if start != self._start:
+            self._evicted_count += start - self._start
+            self._start = start
+            self._byte_count = int(self._offsets[end] - self._offsets[start])
+
+    def _expire(self):
+        if self.policy.max_age is not None:
+            self._evict()
+
+    def _message(self, row: int) -> MqttReceivedMessage:
+        columns = self._columns
+        offset = self._offsets[row]
+        mid = int(columns["mid"][row])
+
+        message = MqttReceivedMessage.__new__(MqttReceivedMessage)
+        message.topic = self._topics[columns["topic_id"][row]]
+        message.payload = self._arena[offset : self._offsets[row + 1]].tobytes()
+        message.qos = int(columns["qos"][row])
+        message.retain = bool(columns["retain"][row])
+        message.mid = mid if mid >= 0 else None
+        message.subscription = self.subscription
+        message._timestamp_ns = int(columns["timestamp_ns"][row])
+        return message
+
+    def _snapshot(self) -> List[MqttReceivedMessage]:
+        with self._lock:
+            self._expire()
+            return [self._message(row) for row in range(self._start, self._end)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return self._end - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._snapshot()[index]
+
+        with self._lock:
+            self._expire()
+            count = self._end - self._start
+            if index < 0:
+                index += count
+            if not 0 <= index < count:
+                raise IndexError("message index out of range")
+            return self._message(self._start + index)
+
+    def __iter__(self) -> Iterator[MqttReceivedMessage]:
+        return iter(self._snapshot())
+
+    def to_numpy(self) -> Dict[str, "numpy.ndarray"]:
+        """to_numpy Copy of the retained messages as columns
+
+        Returns:
+            Dict[str, numpy.ndarray]: timestamp_ns, qos, retain, length, mid (-1 for none) and
+                topic_id per message, topics indexed by topic_id, payloads as one uint8 array
+                and offsets into it, len(messages) + 1 of them
+        """
+        with self._lock:
+            self._expire()
+            start, end = self._start, self._end
+            base = self._offsets[start]
+
+            columns = {name: column[start:end].copy() for name, column in self._columns.items()}
+            columns["topics"] = numpy.array(self._topics, dtype=object)
+            columns["payloads"] = self._arena[base : self._offsets[end]].copy()
+            columns["offsets"] = self._offsets[start : end + 1] - base
+            return columns
+
+    def to_arrow(self) -> "pyarrow.Table":
+        """to_arrow Copy of the retained messages as an Arrow table, needs pyarrow
+
+        Returns:
+            pyarrow.Table: timestamp_ns, topic (dictionary encoded), qos, retain, mid and payload (binary) columns
+        """
+        if pyarrow is None:
+            raise ImportError("pyarrow is needed for MqttColumnarMessageStore.to_arrow")
+
+        columns = self.to_numpy()
+        count = len(columns["qos"])
+
+        payloads = pyarrow.Array.from_buffers(
+            pyarrow.large_binary(),
+            count,
+            [
+                None,
+                pyarrow.py_buffer(columns["offsets"]),
+                pyarrow.py_buffer(columns["payloads"]),
+            ],
+        )
+        mids = columns["mid"]
+        return pyarrow.table(
+            {
+                "timestamp_ns": columns["timestamp_ns"],
+                "topic": pyarrow.DictionaryArray.from_arrays(
+                    columns["topic_id"], pyarrow.array(columns["topics"].tolist(), pyarrow.string())
+                ),
+                "qos": columns["qos"],
+                "retain": columns["retain"],
+                "mid": pyarrow.array(mids, mask=mids < 0),
+                "payload": payloads,
+            }
+        )
+
+    def to_records(self, serializer: "MqttStructSerializer") -> "numpy.ndarray":
+        """to_records Payloads decoded as one structured array, every payload must match the schema
+
+        The payloads are already contiguous, so nothing is joined or decoded one by one.
+
+        Args:
+            serializer (MqttStructSerializer): Schema of the payloads
+
+        Returns:
+            numpy.ndarray: One record per message, copied out of the store
+        """
+        dtype = serializer.dtype
+        with self._lock:
+            self._expire()
+            start, end = self._start, self._end
+            lengths = self._columns["length"][start:end]
+            if (lengths != dtype.itemsize).any():
+                raise ValueError(
+                    f"Payloads do not match schema '{serializer.name}' of {dtype.itemsize} bytes"
+                )
+            data = self._arena[self._offsets[start] : self._offsets[end]]
+            return data.view(dtype).copy()
+
+    def _window(self, window: float, now_ns: int = None) -> slice:
+        """_window Rows received in the last window seconds, lock must be held"""
+        now_ns = time_ns() if now_ns is None else now_ns
+        timestamps = self._columns["timestamp_ns"][self._start : self._end]
+        first = int(numpy.searchsorted(timestamps, now_ns - int(window * 1e9)))
+        return slice(self._start + first, self._end)
+
+    def rate(self, window: float, now_ns: int = None) -> float:
+        """rate Messages per second received in the last window seconds
+
+        Args:
+            window (float): Seconds to look back
+            now_ns (int, optional): End of the window. Defaults to None, time_ns()
+
+        Returns:
+            float: Messages per second
+        """
+        with self._lock:
+            self._expire()
+            rows = self._window(window, now_ns)
+            return (rows.stop - rows.start) / window
+
+    def byte_rate(self, window: float, now_ns: int = None) -> float:
+        """byte_rate Payload bytes per second received in the last window seconds"""
+        with self._lock:
+            self._expire()
+            rows = self._window(window, now_ns)
+            return float(self._offsets[rows.stop] - self._offsets[rows.start]) / window
+
+    def rates(self, bucket: float) -> "numpy.ndarray":
+        """rates Messages per second in consecutive buckets of bucket seconds, oldest first
+
+        Buckets start at the oldest retained message, empty ones are 0.
+        """
+        with self._lock:
+            self._expire()
+            timestamps = self._columns["timestamp_ns"][self._start : self._end]
+            if not len(timestamps):
+                return numpy.zeros(0)
+            buckets = (timestamps - timestamps[0]) // int(bucket * 1e9)
+            return numpy.bincount(buckets) / bucket
+
+    def inter_arrival_stats(self) -> Dict[str, float]:
+        """inter_arrival_stats Seconds between consecutive retained messages
+
+        Returns:
+            Dict[str, float]: count, mean, std, min, p50, p99 and max, only count when there are less than 2 messages
+        """
+        with self._lock:
+            self._expire()
+            timestamps = self._columns["timestamp_ns"][self._start : self._end]
+            gaps = numpy.diff(timestamps) / 1e9
+
+        if not len(gaps):
+            return {"count": 0}
+
+        p50, p99 = numpy.percentile(gaps, [50, 99])
+        return {
+            "count": len(gaps),
+            "mean": float(gaps.mean()),
+            "std": float(gaps.std()),
+            "min": float(gaps.min()),
+            "p50": float(p50),
+            "p99": float(p99),
+            "max": float(gaps.max()),
+        }
+
+    def __repr__(self) -> str:
+        return "{}(retained={}, total_count={}, evicted_count={}, topics={}, policy={})".format(
+            type(self).__name__,
+            self._end - self._start,
+            self._total_count,
+            self._evicted_count,
+            len(self._topics),
+            self.policy,
+        )
@@ -0,0 +1,408 @@
+from dataclasses import dataclass
+import gzip
+import logging
+import lzma
+import threading
+from time import thread_time_ns
+import zlib
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Optional codecs, registered only when their package is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+IDENTITY = "identity"
+ZLIB = "zlib"
+GZIP = "gzip"
+LZMA = "lzma"
+ZSTD = "zstd"
+LZ4 = "lz4"
+
+# MQTTv5 user property naming the codec of a compressed payload
+CONTENT_ENCODING = "content-encoding"
+
+# Default limit on the size of a decompressed payload, see MqttConfig.max_decompressed_size
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+
+class MqttDecompressedSizeError(ValueError):
+    """MqttDecompressedSizeError A payload decompresses to more than the allowed size"""
+
+
+@dataclass
+class MqttCodec:
+    """Compression codec usable by MqttCompression
+
+    name: str
+        sent in the content-encoding user property on MQTTv5
+    id: int
+        first payload byte on MQTT 3.1 / 3.1.1, 0 is reserved for uncompressed payloads
+    compress: Callable[[bytes, int], bytes]
+        called with the payload and the level, None for the codec default
+    decompress: Callable[[bytes, int], bytes]
+        called with the payload and the max decompressed size, None for no limit.
+        Must stop and raise MqttDecompressedSizeError once the output grows over it,
+        not decompress everything and check afterwards
+    """
+
+    name: str
+    id: int
+    compress: Callable[[bytes, int], bytes]
+    decompress: Callable[[bytes, int], bytes]
+
+
+CODECS: Dict[str, MqttCodec] = {}
+_CODECS_BY_ID: Dict[int, MqttCodec] = {}
+
+
+def register_codec(codec: MqttCodec):
+    """register_codec Make a codec available to MqttCompressionPolicy by name
+
+    Args:
+        codec (MqttCodec): Codec with a name and id not used by another codec
+    """
+    if not 1 <= codec.id <= 255:
+        raise ValueError(f"Invalid codec id '{codec.id}', valid values are 1 to 255")
+    existing = _CODECS_BY_ID.get(codec.id)
+    if existing is not None and existing.name != codec.name:
+        raise ValueError(f"Codec id '{codec.id}' is used by '{existing.name}'")
+
+    CODECS[codec.name] = codec
+    _CODECS_BY_ID[codec.id] = codec
+
+
+def get_codec(name: str) -> MqttCodec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Invalid codec '{name}', valid values are: {list(CODECS)}")
+    return codec
+
+
+def _level(level: int, default: int) -> int:
+    return default if level is None else level
+
+
+def _too_large(max_size: int):
+    raise MqttDecompressedSizeError(f"Decompressed payload is over {max_size} bytes")
+
+
+def _zlib_decompress(wbits: int) -> Callable[[bytes, int], bytes]:
+    def decompress(data: bytes, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj(wbits)
+        # One byte over the limit tells a payload of exactly max_size from a bigger one
+        decompressed = decompressor.decompress(data, max_size + 1 if max_size else 0)
+        if max_size and len(decompressed) > max_size:
+            _too_large(max_size)
+        if not decompressor.eof:
+            raise zlib.error("Incomplete or truncated stream")
+        return decompressed
+
+    return decompress
+
+
+def _lzma_decompress(data: bytes, max_size: int) -> bytes:
+    decompressor = lzma.LZMADecompressor()
+    decompressed = decompressor.decompress(data, max_size + 1 if max_size else -1)
+    if max_size and len(decompressed) > max_size:
+        _too_large(max_size)
+    if not decompressor.eof:
+        raise lzma.LZMAError("Compressed data ended before the end-of-stream marker was reached")
+    return decompressed
+
+
+def _zstd_decompress(data: bytes, max_size: int) -> bytes:
+    # The content size in the frame header can not be trusted, read up to the limit instead
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        if not max_size:
+            return reader.readall()
+        chunks = []
+        size = 0
+        while size <= max_size:
+            chunk = reader.read(max_size + 1 - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+    if size > max_size:
+        _too_large(max_size)
+    return b"".join(chunks)
+
+
+def _lz4_decompress(data: bytes, max_size: int) -> bytes:
+    decompressor = lz4_frame.LZ4FrameDecompressor()
+    decompressed = decompressor.decompress(data, max_length=max_size + 1 if max_size else -1)
+    if max_size and len(decompressed) > max_size:
+        _too_large(max_size)
+    if not decompressor.eof:
+        raise RuntimeError("Incomplete or truncated LZ4 frame")
+    return decompressed
+
+
+register_codec(
+    MqttCodec(
+        ZLIB,
+        1,
+        lambda data, level: zlib.compress(data, _level(level, zlib.Z_DEFAULT_COMPRESSION)),
+        _zlib_decompress(zlib.MAX_WBITS),
+    )
+)
+register_codec(
+    MqttCodec(
+        GZIP,
+        2,
+        # mtime=0 so the same payload always compresses to the same bytes
+        lambda data, level: gzip.compress(data, _level(level, 9), mtime=0),
+        # One gzip member, what gzip.compress writes
+        _zlib_decompress(16 + zlib.MAX_WBITS),
+    )
+)
+register_codec(
+    MqttCodec(
+        LZMA,
+        3,
+        lambda data, level: lzma.compress(data, preset=level),
+        _lzma_decompress,
+    )
+)
+if zstandard is not None:
+    register_codec(
+        MqttCodec(
+            ZSTD,
+            4,
+            lambda data, level: zstandard.ZstdCompressor(level=_level(level, 3)).compress(data),
+            _zstd_decompress,
+        )
+    )
+if lz4_frame is not None:
+    register_codec(
+        MqttCodec(
+            LZ4,
+            5,
+            lambda data, level: lz4_frame.compress(data, compression_level=_level(level, 0)),
+            _lz4_decompress,
+        )
+    )
+
+
+@dataclass
+class MqttCompressionPolicy:
+    """Compression of publishes to some topics
+
+    codec: str = "zlib"
+        zlib, gzip and lzma are always available, zstd and lz4 when zstandard and lz4 are installed
+    level: int = None
+        passed on to the codec, None for its default
+    min_size: int = 256
+        payloads smaller than this are sent as they are
+    topic_prefix: str = ""
+        only publishes to topics starting with this are compressed, "" is every publish
+
+    Returns:
+        MqttCompressionPolicy: policy ment to be used in MqttConfig.compression
+    """
+
+    codec: str = ZLIB
+    level: int = None
+    min_size: int = 256
+    topic_prefix: str = ""
+
+
+class MqttCompressionStats:
+    """MqttCompressionStats Counters for payloads going through MqttCompression
+
+    Time is CPU time of the thread compressing or decompressing, thread_time_ns().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.compressed_count = 0
+        self.skipped_count = 0
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time_ns = 0
+
+        self.decompressed_count = 0
+        self.decompress_time_ns = 0
+        self.failed_count = 0
+
+    @property
+    def ratio(self) -> float:
+        """ratio Compressed size over original size of compressed payloads, 1.0 before any"""
+        if not self.uncompressed_bytes:
+            return 1.0
+        return self.compressed_bytes / self.uncompressed_bytes
+
+    def compressed(self, size: int, compressed_size: int, time_ns: int):
+        with self._lock:
+            self.compressed_count += 1
+            self.uncompressed_bytes += size
+            self.compressed_bytes += compressed_size
+            self.compress_time_ns += time_ns
+
+    def skipped(self, time_ns: int = 0):
+        with self._lock:
+            self.skipped_count += 1
+            self.compress_time_ns += time_ns
+
+    def decompressed(self, time_ns: int):
+        # Only called from the paho network thread
+        self.decompressed_count += 1
+        self.decompress_time_ns += time_ns
+
+    def failed(self, time_ns: int = 0):
+        self.failed_count += 1
+        self.decompress_time_ns += time_ns
+
+    def __repr__(self) -> str:
+        return "{}(compressed={}, skipped={}, ratio={:.3f}, compress_time_ns={}, decompressed={}, decompress_time_ns={}, failed={})".format(
+            type(self).__name__,
+            self.compressed_count,
+            self.skipped_count,
+            self.ratio,
+            self.compress_time_ns,
+            self.decompressed_count,
+            self.decompress_time_ns,
+            self.failed_count,
+        )
+
+
+class MqttCompression:
+    """MqttCompression Compresses publishes and decompresses received messages of a client
+
+    A publish is compressed with the first policy whose topic_prefix matches its topic, unless
+    it is under min_size or does not get smaller. How the codec is made known to subscribers
+    depends on the protocol:
+
+    * MQTTv5: compressed payloads carry a content-encoding user property naming the codec,
+      received messages with one are decompressed whatever the policies
+    * MQTT 3.1 / 3.1.1 (framed): payloads on topics matching a policy start with the codec id,
+      0 for uncompressed, subscribers need policies covering the same topics
+
+    Payloads decompressing to more than max_decompressed_size bytes are not decompressed
+    further, they count as failed and are delivered as received.
+    """
+
+    def __init__(
+        self,
+        policies: Iterable[MqttCompressionPolicy],
+        framed: bool = False,
+        log: logging.Logger = None,
+        max_decompressed_size: int = MAX_DECOMPRESSED_SIZE,
+    ):
+        self.policies: List[MqttCompressionPolicy] = list(policies)
+        self.framed = framed
+        self.max_decompressed_size = max_decompressed_size
+        self.log = log if log else logging.getLogger("Compression")
+        self.stats = MqttCompressionStats()
+
+        self._codecs: List[Tuple[str, MqttCodec, MqttCompressionPolicy]] = [
+            (policy.topic_prefix, get_codec(policy.codec), policy) for policy in self.policies
+        ]
+
+    def _match(self, topic: str) -> Tuple[MqttCodec, MqttCompressionPolicy]:
+        for prefix, codec, policy in self._codecs:
+            if topic.startswith(prefix):
+                return codec, policy
+        return None, None
+
+    def encode(self, topic: str, payload: bytes) -> Tuple[bytes, str]:
+        """encode Compress a payload published to topic if a policy says so
+
+        Args:
+            topic (str): Topic of the publish
+            payload (bytes): bytes-like payload
+
+        Returns:
+            Tuple[bytes, str]: Payload to send and the codec name, None when it is not compressed
+        """
+        codec, policy = self._match(topic)
+        if codec is None:
+            return payload, None
+
+        size = len(payload)
+        if size < policy.min_size:
+            self.stats.skipped()
+            return self._frame(0, payload), None
+
+        start_ns = thread_time_ns()
+        compressed = codec.compress(payload, policy.level)
+        time_ns = thread_time_ns() - start_ns
+
+        if len(compressed) >= size:
+            self.stats.skipped(time_ns)
+            return self._frame(0, payload), None
+
+        self.stats.compressed(size, len(compressed), time_ns)
+        return self._frame(codec.id, compressed), codec.name
+
+    def _frame(self, codec_id: int, payload: bytes) -> bytes:
+        if not self.framed:
+            return payload
+        return bytes((codec_id,)) + payload
+
+    def decode(self, topic: str, payload: bytes, encoding: str = None) -> bytes:
+        """decode Decompress a received payload
+
+        Payloads that can not be decompressed are logged and returned as they are.
+
+        Args:
+            topic (str): Topic of the message
+            payload (bytes): Payload as received
+            encoding (str, optional): MQTTv5 content-encoding of the message. Defaults to None.
+
+        Returns:
+            bytes: The original payload
+        """
+        if self.framed:
+            if not payload or self._match(topic)[0] is None:
+                return payload
+            codec = _CODECS_BY_ID.get(payload[0])
+            if codec is None:
+                if payload[0]:
+                    self.stats.failed()
+                    self.log.error("Unknown codec id %d on topic '%s'", payload[0], topic)
+                    return payload
+                return payload[1:]
+            data = memoryview(payload)[1:]
+        else:
+            if encoding is None or encoding == IDENTITY:
+                return payload
+            codec = CODECS.get(encoding)
+            if codec is None:
+                self.stats.failed()
+                self.log.error("Unknown content-encoding '%s' on topic '%s'", encoding, topic)
+                return payload
+            data = payload
+
+        start_ns = thread_time_ns()
+        try:
+            decompressed = codec.decompress(data, self.max_decompressed_size)
+        except MqttDecompressedSizeError as error:
+            self.stats.failed(thread_time_ns() - start_ns)
+            self.log.error("Not decompressing '%s' payload on topic '%s': %s", codec.name, topic, error)
+            return payload
+        except Exception:
+            self.stats.failed(thread_time_ns() - start_ns)
+            self.log.exception("Decompressing '%s' payload on topic '%s' failed", codec.name, topic)
+            return payload
+
+        self.stats.decompressed(thread_time_ns() - start_ns)
+        return decompressed
+
+    def __repr__(self) -> str:
+        return "{}(framed={}, max_decompressed_size={}, policies={}, stats={})".format(
+            type(self).__name__,
+            self.framed,
+            self.max_decompressed_size,
+            [(policy.topic_prefix, policy.codec, policy.min_size) for policy in self.policies],
+            self.stats,
+        )
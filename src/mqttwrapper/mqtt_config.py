@@ -2,14 +2,21 @@ import logging
 import random
 import string
 from typing import Tuple
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 import ssl
 
 import paho.mqtt.client as PahoClient
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from .mqtt_userdata import MqttUserdata
+from .mqtt_message_store import MqttRetentionPolicy
+from .mqtt_offline_queue import MqttOfflineQueuePolicy
+from .mqtt_flow_control import MqttRateLimit, BLOCK, FLOW_CONTROL_MODES
+from .mqtt_compression import MqttCompressionPolicy, get_codec, MAX_DECOMPRESSED_SIZE
+from .mqtt_serializer import MqttSerializer, get_serializer
 
 # Help out with cyclic import
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Dict, List, Union
 
 if TYPE_CHECKING:
     from .mqtt_client import MqttClient
@@ -68,6 +75,52 @@ class MqttConfig:
 
     log: logging.Logger = logging.getLogger("Config.INITIALIZING")
     save_sent_messages: bool = False
+        when False sent messages are only counted, not kept
+    sent_retention: MqttRetentionPolicy = None
+        retention of sent messages when save_sent_messages is True, None keeps all of them
+    retention: MqttRetentionPolicy = None
+        retention of received messages per subscription, None keeps all of them
+    max_inflight_messages: int = 20
+        max QoS 1/2 messages waiting for PUBACK/PUBCOMP before paho queues them, 0 means no limit
+    handler_threads: int = None
+        workers in the shared thread pool for subscription handlers, None uses the executor default
+    handler_processes: int = None
+        workers in the shared process pool for subscription handlers, None uses the executor default
+    quiet_hot_path: bool = False
+        skip per-message and per-poll logging entirely, and paho's per-packet logging (decided when the client is created)
+    reconnect_min_delay: float = 1
+        seconds before the first reconnect attempt after the connection is lost, doubled every failed attempt
+    reconnect_max_delay: float = 120
+        max seconds between reconnect attempts
+    reconnect_jitter: float = 0.5
+        fraction of each reconnect delay taken away at random, 0 to 1
+    subscribe_batch_size: int = 100
+        max topics per SUBSCRIBE when several subscriptions are activated at once, like after a reconnect
+    offline_queue: MqttOfflineQueuePolicy = None
+        capture publishes while disconnected and replay them on reconnect, None leaves them to paho's in-memory queue
+    rate_limits: List[MqttRateLimit] = None
+        token bucket limits on publishes, for the whole client or per topic prefix, None means no limit
+    flow_control: str = "block"
+        block, reject or queue a publish over a rate limit, see MqttFlowControl
+    flow_control_queue_size: int = 1000
+        max messages waiting for tokens in queue mode, more are rejected
+    topic_aliases: bool = True
+        MQTTv5 only, publish repeated topics as topic aliases, up to the Topic Alias Maximum of the broker
+    topic_alias_receive_maximum: int = 0
+        MQTTv5 only, topic aliases the broker may use for messages it sends us, 0 to 65535
+    compression: List[MqttCompressionPolicy] = None
+        compress publishes per topic prefix, the first matching policy is used, see MqttCompression.
+        On MQTT 3.1 / 3.1.1 subscribers need the same policies to decompress, on MQTTv5 any policy
+        or decompress_received will do
+    decompress_received: bool = False
+        MQTTv5 only, decompress received messages naming a codec in their content-encoding without
+        having compression policies. Without either nothing received is decompressed
+    max_decompressed_size: int = 16777216
+        16 MiB, received payloads decompressing to more bytes are delivered as received and count
+        as failed, a guard against decompression bombs. None for no limit
+    serializers: Dict[str, Union[str, MqttSerializer]] = None
+        topic filter to serializer name or object, for publishes of values that are not bytes-like and
+        for decode() of messages, the first matching filter is used
 
     Returns:
         MqttConfig: configuration object ment to be used by MqttClient
@@ -98,6 +151,26 @@ class MqttConfig:
 
     log: logging.Logger = logging.getLogger("Config.INITIALIZING")
     save_sent_messages: bool = False
+    sent_retention: MqttRetentionPolicy = None
+    retention: MqttRetentionPolicy = None
+    max_inflight_messages: int = 20
+    handler_threads: int = None
+    handler_processes: int = None
+    quiet_hot_path: bool = False
+    reconnect_min_delay: float = 1
+    reconnect_max_delay: float = 120
+    reconnect_jitter: float = 0.5
+    subscribe_batch_size: int = 100
+    offline_queue: MqttOfflineQueuePolicy = None
+    rate_limits: List[MqttRateLimit] = None
+    flow_control: str = BLOCK
+    flow_control_queue_size: int = 1000
+    topic_aliases: bool = True
+    topic_alias_receive_maximum: int = 0
+    compression: List[MqttCompressionPolicy] = None
+    decompress_received: bool = False
+    max_decompressed_size: int = MAX_DECOMPRESSED_SIZE
+    serializers: Dict[str, Union[str, MqttSerializer]] = None
 
     __paho_need_reinitialize: bool = True
     __paho_need_reinitialize_slots: str = "protocol transport client_id clean_session"
@@ -125,15 +198,64 @@ class MqttConfig:
             )
             self.clean_session = None
 
+        if not 0 <= self.reconnect_jitter <= 1:
+            raise ValueError(
+                f"Invalid reconnect_jitter '{self.reconnect_jitter}', valid values are 0 to 1"
+            )
+        if self.subscribe_batch_size < 1:
+            raise ValueError(
+                f"Invalid subscribe_batch_size '{self.subscribe_batch_size}', valid values are 1 or more"
+            )
+        if self.flow_control not in FLOW_CONTROL_MODES:
+            raise ValueError(
+                f"Invalid flow_control '{self.flow_control}', valid values are: {FLOW_CONTROL_MODES}"
+            )
+        if not 0 <= self.topic_alias_receive_maximum <= 65535:
+            raise ValueError(
+                f"Invalid topic_alias_receive_maximum '{self.topic_alias_receive_maximum}', valid values are 0 to 65535"
+            )
+        for policy in self.compression or []:
+            get_codec(policy.codec)
+        if self.max_decompressed_size is not None and self.max_decompressed_size < 1:
+            raise ValueError(
+                f"Invalid max_decompressed_size '{self.max_decompressed_size}', valid values are 1 or more, or None"
+            )
+        for serializer in (self.serializers or {}).values():
+            get_serializer(serializer)
+        if self.sent_retention is not None and self.sent_retention.columnar:
+            raise ValueError("Invalid sent_retention, columnar is only supported for received messages")
+
+    def copy(self, **changes) -> "MqttConfig":
+        """copy Create a new config from this one, not bound to any client
+
+        Args:
+            **changes: Fields to change, like client_id
+
+        Returns:
+            MqttConfig: New configuration object
+        """
+        if "log" not in changes:
+            client_id = changes.get("client_id", self.client_id)
+            changes["log"] = logging.getLogger(f"Config.{client_id}")
+
+        config = replace(self, **changes)
+        config.__paho_need_reinitialize = True
+        config.__paho_need_reconnect = True
+
+        return config
+
+    # Getters run often, only format the debug line when it is logged
+
     @property
     def client_id(self) -> str:
         client_id = self._client_id
-        self.log.debug(f"client_id.getter() {client_id=}")
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("client_id.getter() client_id=%r", client_id)
         return client_id
 
     @client_id.setter
     def client_id(self, client_id: str):
-        self.log.debug(f"client_id.setter() {client_id=}")
+        self.log.debug("client_id.setter() client_id=%r", client_id)
 
         if not isinstance(client_id, str):
             self.log.debug(
@@ -152,12 +274,13 @@ class MqttConfig:
 
     @property
     def protocol(self) -> str:
-        self.log.debug(f"protocol.getter() {self._protocol=}")
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("protocol.getter() self._protocol=%r", self._protocol)
         return self._protocol
 
     @protocol.setter
     def protocol(self, protocol: str):
-        self.log.debug(f"protocol.setter() {protocol=}")
+        self.log.debug("protocol.setter() protocol=%r", protocol)
 
         if type(protocol) is property:
             self.log.debug(
@@ -190,6 +313,7 @@ class MqttConfig:
             paho_client = client._paho_client
 
         paho_client.user_data_set(client.userdata)
+        paho_client.max_inflight_messages_set(self.max_inflight_messages)
 
         if self.tls_enable:
             self.log.info(f"Enabling TLS")
@@ -228,9 +352,18 @@ class MqttConfig:
             paho_client.username_pw_set(username=self.username, password=self.password)
 
         if self._phao_need_reconnect:
+            properties = None
+            if (
+                map_to_paho_protocol(self.protocol) == PahoClient.MQTTv5
+                and self.topic_alias_receive_maximum
+            ):
+                properties = Properties(PacketTypes.CONNECT)
+                properties.TopicAliasMaximum = self.topic_alias_receive_maximum
+
             paho_client.connect(
                 host=self.host,
                 port=self.port,
                 keepalive=self.keepalive,
                 bind_address=self.bind_address,
+                properties=properties,
             )
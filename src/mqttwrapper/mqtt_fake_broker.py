@@ -0,0 +1,924 @@
+from dataclasses import dataclass
+import base64
+import hashlib
+import heapq
+import itertools
+import logging
+import random
+import socket
+import ssl
+import struct
+import threading
+import time
+
+from .mqtt_topic_trie import MqttTopicTrie, SHARED_PREFIX
+
+from typing import Dict, List, Optional, Tuple, Union
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# MQTT 5 properties used by the broker
+PROPERTY_RECEIVE_MAXIMUM = 0x21
+PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+PROPERTY_TOPIC_ALIAS = 0x23
+PROPERTY_ASSIGNED_CLIENT_ID = 0x12
+
+# MQTT 5 property id to value type, needed to skip the ones we do not use
+_PROPERTY_TYPES = {
+    **dict.fromkeys((0x01, 0x17, 0x19, 0x24, 0x25, 0x28, 0x29, 0x2A), "byte"),
+    **dict.fromkeys((0x13, 0x21, 0x22, 0x23), "uint16"),
+    **dict.fromkeys((0x02, 0x11, 0x18, 0x27), "uint32"),
+    0x0B: "varint",
+    **dict.fromkeys((0x03, 0x08, 0x12, 0x15, 0x1A, 0x1C, 0x1F), "string"),
+    **dict.fromkeys((0x09, 0x16), "binary"),
+    0x26: "pair",
+}
+
+_WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class MqttProtocolError(Exception):
+    pass
+
+
+@dataclass
+class MqttFakeBrokerListener:
+    """MqttFakeBrokerListener Port the fake broker accepts connections on
+
+    port: int = 0
+        0 picks a free port, read it back from the listener after start
+    transport: str = "tcp"
+        tcp or websockets, same values as MqttConfig.transport
+    tls: bool = False
+        needs certfile on the broker
+    """
+
+    port: int = 0
+    transport: str = "tcp"
+    tls: bool = False
+
+
+def _encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        value, byte = divmod(value, 128)
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _encode_string(value: bytes) -> bytes:
+    return struct.pack("!H", len(value)) + value
+
+
+def _encode_properties(
+    properties: Union[Dict[int, object], List[Tuple[int, object]]]
+) -> bytes:
+    encoded = bytearray()
+    items = properties.items() if isinstance(properties, dict) else properties
+    for identifier, value in items:
+        encoded.append(identifier)
+        kind = _PROPERTY_TYPES[identifier]
+        if kind == "byte":
+            encoded.append(value)
+        elif kind == "uint16":
+            encoded += struct.pack("!H", value)
+        elif kind == "uint32":
+            encoded += struct.pack("!I", value)
+        elif kind == "varint":
+            encoded += _encode_varint(value)
+        elif kind == "pair":
+            encoded += b"".join(
+                _encode_string(part.encode("utf-8") if isinstance(part, str) else part)
+                for part in value
+            )
+        else:
+            encoded += _encode_string(
+                value.encode("utf-8") if isinstance(value, str) else value
+            )
+    return _encode_varint(len(encoded)) + bytes(encoded)
+
+
+def _packet(packet_type: int, body: bytes = b"", flags: int = 0) -> bytes:
+    return bytes([packet_type << 4 | flags]) + _encode_varint(len(body)) + body
+
+
+class _Reader:
+    """_Reader Cursor over the variable header and payload of one packet"""
+
+    __slots__ = ("data", "offset")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def remaining(self) -> int:
+        return len(self.data) - self.offset
+
+    def take(self, length: int) -> bytes:
+        if length > self.remaining():
+            raise MqttProtocolError("Packet shorter than its content")
+        value = self.data[self.offset : self.offset + length]
+        self.offset += length
+        return value
+
+    def byte(self) -> int:
+        return self.take(1)[0]
+
+    def uint16(self) -> int:
+        return struct.unpack("!H", self.take(2))[0]
+
+    def uint32(self) -> int:
+        return struct.unpack("!I", self.take(4))[0]
+
+    def varint(self) -> int:
+        value = 0
+        for shift in range(0, 28, 7):
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+        raise MqttProtocolError("Malformed variable byte integer")
+
+    def string(self) -> bytes:
+        return self.take(self.uint16())
+
+    def properties(self) -> Dict[int, object]:
+        return dict(self.property_list())
+
+    def property_list(self) -> List[Tuple[int, object]]:
+        """property_list Properties in packet order, user properties can be there several times"""
+        end = self.varint() + self.offset
+        properties = []
+        while self.offset < end:
+            identifier = self.byte()
+            kind = _PROPERTY_TYPES.get(identifier)
+            if kind is None:
+                raise MqttProtocolError(f"Unknown property 0x{identifier:02x}")
+            if kind == "pair":
+                value = (self.string(), self.string())
+            else:
+                value = getattr(self, kind if kind != "binary" else "string")()
+            properties.append((identifier, value))
+        return properties
+
+    def rest(self) -> bytes:
+        return self.take(self.remaining())
+
+
+class _Stream:
+    """_Stream Blocking byte stream over a socket"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._buffer = bytearray()
+
+    def _recv(self) -> bytes:
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("Connection closed by client")
+        return data
+
+    def read(self, length: int) -> bytes:
+        while len(self._buffer) < length:
+            self._buffer += self._recv()
+        data = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return data
+
+    def write(self, data: bytes):
+        self.sock.sendall(data)
+
+
+class _WebsocketStream(_Stream):
+    """_WebsocketStream MQTT over binary websocket frames, after the HTTP upgrade"""
+
+    def __init__(self, sock: socket.socket):
+        super().__init__(sock)
+        self._raw = _Stream(sock)
+        self._handshake()
+
+    def _handshake(self):
+        request = bytearray()
+        while b"\r\n\r\n" not in request:
+            if len(request) > 65536:
+                raise MqttProtocolError("Websocket upgrade request too large")
+            request += self._raw._recv()
+
+        head, _, rest = bytes(request).partition(b"\r\n\r\n")
+        self._raw._buffer += rest
+
+        headers = {}
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get(b"sec-websocket-key")
+        if not key:
+            raise MqttProtocolError("Not a websocket upgrade request")
+
+        accept = base64.b64encode(hashlib.sha1(key + _WEBSOCKET_GUID).digest())
+        response = (
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n"
+        )
+        if b"sec-websocket-protocol" in headers:
+            response += b"Sec-WebSocket-Protocol: mqtt\r\n"
+        self._raw.write(response + b"\r\n")
+
+    def _recv(self) -> bytes:
+        while True:
+            first, second = self._raw.read(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self._raw.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self._raw.read(8))[0]
+            mask = self._raw.read(4) if second & 0x80 else None
+            data = self._raw.read(length)
+
+            if mask and length:
+                mask = (mask * (length // 4 + 1))[:length]
+                data = (
+                    int.from_bytes(data, "big") ^ int.from_bytes(mask, "big")
+                ).to_bytes(length, "big")
+
+            if opcode == 0x8:
+                raise ConnectionError("Websocket closed by client")
+            if opcode == 0x9:
+                self._write_frame(0xA, data)
+            elif opcode in (0x0, 0x1, 0x2) and data:
+                return data
+
+    def _write_frame(self, opcode: int, data: bytes):
+        length = len(data)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        self._raw.write(header + data)
+
+    def write(self, data: bytes):
+        self._write_frame(0x2, data)
+
+
+@dataclass(eq=False)
+class _Subscription:
+    connection: "_Connection"
+    topic_filter: str
+    qos: int
+    share_group: Optional[str] = None
+
+
+class _Connection:
+    """_Connection One client connection, read on its own thread"""
+
+    def __init__(
+        self,
+        broker: "MqttFakeBroker",
+        sock: socket.socket,
+        listener: MqttFakeBrokerListener,
+    ):
+        self.broker = broker
+        self.sock = sock
+        self.listener = listener
+        self.log = broker.log
+
+        self.client_id: str = None
+        self.protocol_level = 4
+        self.subscriptions: Dict[str, _Subscription] = {}
+        self.will: Tuple[str, bytes, int, bool] = None
+        self.closed = False
+
+        self._stream: _Stream = None
+        self._write_lock = threading.Lock()
+        self._packet_ids = itertools.cycle(range(1, 65536))
+        self._topic_aliases: Dict[int, str] = {}
+        # Aliases for delivering to the client, up to the Topic Alias Maximum in its CONNECT
+        self._delivery_aliases: Dict[str, int] = {}
+        self._delivery_alias_maximum = 0
+        self._delivery_lock = threading.Lock()
+        self._awaiting_pubrel = set()
+        # Delayed packets must still leave in order
+        self._last_due = 0.0
+
+        self.thread = threading.Thread(
+            target=self._run, name=f"FakeBroker.{sock.fileno()}", daemon=True
+        )
+
+    @property
+    def is_v5(self) -> bool:
+        return self.protocol_level == 5
+
+    def _run(self):
+        disconnected = False
+        try:
+            sock = self.sock
+            if self.listener.tls:
+                sock = self.sock = self.broker._ssl_context.wrap_socket(
+                    sock, server_side=True
+                )
+            if self.listener.transport == "websockets":
+                self._stream = _WebsocketStream(sock)
+            else:
+                self._stream = _Stream(sock)
+
+            packet_type, flags, body = self._read_packet()
+            if packet_type != CONNECT:
+                raise MqttProtocolError("First packet was not CONNECT")
+            if not self._handle_connect(body):
+                return
+
+            while True:
+                packet_type, flags, body = self._read_packet()
+                if packet_type == DISCONNECT:
+                    disconnected = True
+                    return
+                self._handle(packet_type, flags, body)
+        except (ConnectionError, OSError, MqttProtocolError) as error:
+            if not self.closed:
+                self.log.debug(f"Connection {self.client_id=} ended: {error}")
+        finally:
+            self.close()
+            self.broker._connection_closed(self, publish_will=not disconnected)
+
+    def _read_packet(self) -> Tuple[int, int, bytes]:
+        header = self._stream.read(1)[0]
+        length = 0
+        for shift in range(0, 28, 7):
+            byte = self._stream.read(1)[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+        else:
+            raise MqttProtocolError("Malformed remaining length")
+
+        return header >> 4, header & 0x0F, self._stream.read(length)
+
+    def _handle_connect(self, body: bytes) -> bool:
+        reader = _Reader(body)
+        protocol_name = reader.string()
+        self.protocol_level = reader.byte()
+        if (protocol_name, self.protocol_level) not in (
+            (b"MQIsdp", 3),
+            (b"MQTT", 4),
+            (b"MQTT", 5),
+        ):
+            raise MqttProtocolError(f"Unsupported protocol {protocol_name!r}")
+
+        flags = reader.byte()
+        keepalive = reader.uint16()
+        if self.is_v5:
+            self._delivery_alias_maximum = reader.properties().get(
+                PROPERTY_TOPIC_ALIAS_MAXIMUM, 0
+            )
+
+        self.client_id = reader.string().decode("utf-8")
+
+        if flags & 0x04:
+            if self.is_v5:
+                reader.properties()
+            will_topic = reader.string().decode("utf-8")
+            will_payload = reader.string()
+            self.will = (will_topic, will_payload, flags >> 3 & 0x03, bool(flags & 0x20))
+
+        username = reader.string().decode("utf-8") if flags & 0x80 else None
+        password = reader.string() if flags & 0x40 else None
+
+        if not self.broker._authenticate(username, password):
+            # Bad user name or password
+            self._send_connack(0x86 if self.is_v5 else 0x04)
+            return False
+
+        properties = {}
+        if not self.client_id:
+            self.client_id = f"fake-{id(self):x}"
+            properties[PROPERTY_ASSIGNED_CLIENT_ID] = self.client_id
+
+        if keepalive:
+            # Allowed one and a half keepalive of silence
+            self.sock.settimeout(keepalive * 1.5)
+
+        self.broker._connection_opened(self)
+        self._send_connack(0x00, properties)
+        return True
+
+    def _send_connack(self, code: int, properties: Dict[int, object] = None):
+        body = bytes([0, code])
+        if self.is_v5:
+            properties = dict(properties or {})
+            if self.broker.topic_alias_maximum:
+                properties[PROPERTY_TOPIC_ALIAS_MAXIMUM] = self.broker.topic_alias_maximum
+            if self.broker.receive_maximum:
+                properties[PROPERTY_RECEIVE_MAXIMUM] = self.broker.receive_maximum
+            body += _encode_properties(properties)
+        self.send(_packet(CONNACK, body))
+
+    def _handle(self, packet_type: int, flags: int, body: bytes):
+        if packet_type == PUBLISH:
+            self._handle_publish(flags, body)
+        elif packet_type == PUBREL:
+            packet_id = _Reader(body).uint16()
+            self._awaiting_pubrel.discard(packet_id)
+            self.send(_packet(PUBCOMP, struct.pack("!H", packet_id)))
+        elif packet_type == PUBREC:
+            # QoS 2 delivery to this client, continue the handshake
+            packet_id = _Reader(body).uint16()
+            self.send(_packet(PUBREL, struct.pack("!H", packet_id), flags=0x02))
+        elif packet_type in (PUBACK, PUBCOMP):
+            # Delivery to this client done, nothing is kept for redelivery
+            pass
+        elif packet_type == SUBSCRIBE:
+            self._handle_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            self._handle_unsubscribe(body)
+        elif packet_type == PINGREQ:
+            self.send(_packet(PINGRESP))
+        else:
+            raise MqttProtocolError(f"Unexpected packet type {packet_type}")
+
+    def _handle_publish(self, flags: int, body: bytes):
+        qos = flags >> 1 & 0x03
+        retain = bool(flags & 0x01)
+
+        reader = _Reader(body)
+        topic = reader.string().decode("utf-8")
+        packet_id = reader.uint16() if qos else None
+
+        properties = []
+        if self.is_v5:
+            properties = reader.property_list()
+            alias = dict(properties).get(PROPERTY_TOPIC_ALIAS)
+            if alias:
+                # Aliases are per connection, everything else is forwarded to subscribers
+                properties = [
+                    (identifier, value)
+                    for identifier, value in properties
+                    if identifier != PROPERTY_TOPIC_ALIAS
+                ]
+                if topic:
+                    self._topic_aliases[alias] = topic
+                else:
+                    topic = self._topic_aliases.get(alias)
+                    if topic is None:
+                        raise MqttProtocolError(f"Unknown topic alias {alias}")
+
+        payload = reader.rest()
+
+        if qos == 2:
+            if packet_id in self._awaiting_pubrel:
+                # Retransmission, already forwarded
+                self.send(_packet(PUBREC, struct.pack("!H", packet_id)))
+                return
+            self._awaiting_pubrel.add(packet_id)
+
+        self.broker.publish(topic, payload, qos, retain, properties)
+
+        if qos == 1:
+            self.send(_packet(PUBACK, struct.pack("!H", packet_id)))
+        elif qos == 2:
+            self.send(_packet(PUBREC, struct.pack("!H", packet_id)))
+
+    def _handle_subscribe(self, body: bytes):
+        reader = _Reader(body)
+        packet_id = reader.uint16()
+        if self.is_v5:
+            reader.properties()
+
+        codes = bytearray()
+        subscriptions = []
+        while reader.remaining():
+            topic_filter = reader.string().decode("utf-8")
+            qos = min(reader.byte() & 0x03, 2)
+            subscription = self.broker._subscribe(self, topic_filter, qos)
+            if subscription is None:
+                codes.append(0x8F if self.is_v5 else 0x80)
+                continue
+            codes.append(qos)
+            subscriptions.append(subscription)
+
+        body = struct.pack("!H", packet_id)
+        if self.is_v5:
+            body += _encode_properties({})
+        self.send(_packet(SUBACK, body + bytes(codes)))
+
+        # Retained messages go out after SUBACK
+        for subscription in subscriptions:
+            self.broker._send_retained(subscription)
+
+    def _handle_unsubscribe(self, body: bytes):
+        reader = _Reader(body)
+        packet_id = reader.uint16()
+        if self.is_v5:
+            reader.properties()
+
+        codes = bytearray()
+        while reader.remaining():
+            found = self.broker._unsubscribe(self, reader.string().decode("utf-8"))
+            codes.append(0x00 if found else 0x11)
+
+        body = struct.pack("!H", packet_id)
+        if self.is_v5:
+            body += _encode_properties({}) + bytes(codes)
+        self.send(_packet(UNSUBACK, body))
+
+    def deliver(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int,
+        retain: bool,
+        properties: List[Tuple[int, object]] = (),
+    ):
+        if not self._delivery_alias_maximum:
+            body = _encode_string(topic.encode("utf-8"))
+            if qos:
+                body += struct.pack("!H", next(self._packet_ids))
+            if self.is_v5:
+                body += _encode_properties(properties)
+            self.send(_packet(PUBLISH, body + payload, flags=qos << 1 | retain))
+            return
+
+        # Aliases are handed out first come first served and kept, the packet
+        #   setting one up must be sent before those using it
+        with self._delivery_lock:
+            properties = list(properties)
+            alias = self._delivery_aliases.get(topic)
+            if alias:
+                properties.append((PROPERTY_TOPIC_ALIAS, alias))
+                topic = ""
+            elif len(self._delivery_aliases) < self._delivery_alias_maximum:
+                alias = self._delivery_aliases[topic] = len(self._delivery_aliases) + 1
+                properties.append((PROPERTY_TOPIC_ALIAS, alias))
+
+            body = _encode_string(topic.encode("utf-8"))
+            if qos:
+                body += struct.pack("!H", next(self._packet_ids))
+            body += _encode_properties(properties)
+            self.send(_packet(PUBLISH, body + payload, flags=qos << 1 | retain))
+
+    def send(self, data: bytes):
+        if self.closed:
+            return
+
+        delay = self.broker._packet_delay()
+        if delay:
+            with self._write_lock:
+                due = max(time.monotonic() + delay, self._last_due)
+                self._last_due = due
+            self.broker._schedule(due, self, data)
+            return
+
+        self.write(data)
+
+    def write(self, data: bytes):
+        try:
+            with self._write_lock:
+                self._stream.write(data)
+        except OSError as error:
+            self.log.debug(f"Write to {self.client_id=} failed: {error}")
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class MqttFakeBroker:
+    """MqttFakeBroker In-process MQTT broker for tests and load simulation
+
+    Speaks MQTT 3.1, 3.1.1 and 5 over TCP and websockets, with or without TLS, so MqttClient
+    connects to it through MqttConfig as to any broker. Supports QoS 0/1/2, retained messages,
+    '+'/'#' wildcards and '$share/<group>/' shared subscriptions.
+    MQTT 5 topic aliases are accepted up to topic_alias_maximum, and used for delivery up to
+    the Topic Alias Maximum a client sends in CONNECT. Other PUBLISH properties, like user
+    properties, are forwarded to MQTT 5 subscribers.
+
+    Faults can be injected:
+
+    * latency: seconds added to every packet the broker sends, plus up to jitter seconds
+    * loss: probability of a PUBLISH to a subscriber being dropped, the sender still gets its ack
+
+    Every session is clean, there is no persistence and no redelivery, so a dropped QoS 1/2
+    message stays lost. Connections are served one thread each.
+    """
+
+    def __init__(
+        self,
+        listeners: List[MqttFakeBrokerListener] = None,
+        host: str = "127.0.0.1",
+        username: str = None,
+        password: str = None,
+        certfile: str = None,
+        keyfile: str = None,
+        latency: float = 0,
+        jitter: float = 0,
+        loss: float = 0,
+        seed: int = None,
+        topic_alias_maximum: int = 10,
+        receive_maximum: int = None,
+        log: logging.Logger = None,
+    ):
+        self.listeners = listeners if listeners else [MqttFakeBrokerListener()]
+        self.host = host
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.topic_alias_maximum = topic_alias_maximum
+        self.receive_maximum = receive_maximum
+        self.log = log if log else logging.getLogger("FakeBroker")
+
+        self._random = random.Random(seed)
+
+        self._ssl_context: ssl.SSLContext = None
+        if any(listener.tls for listener in self.listeners):
+            if not certfile:
+                raise ValueError("certfile is needed for TLS listeners")
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._ssl_context.load_cert_chain(certfile, keyfile)
+
+        self._lock = threading.RLock()
+        self._connections: Dict[str, _Connection] = {}
+        self._trie = MqttTopicTrie()
+        self.retained: Dict[str, Tuple[bytes, int, List[Tuple[int, object]]]] = {}
+        self._share_counters: Dict[Tuple[str, str], itertools.count] = {}
+
+        self.received_count = 0
+        self.delivered_count = 0
+        self.dropped_count = 0
+
+        self._sockets: List[socket.socket] = []
+        self._threads: List[threading.Thread] = []
+        self._running = False
+
+        # Delayed packets, (due, sequence, connection, data)
+        self._schedule_condition = threading.Condition()
+        self._scheduled = []
+        self._schedule_sequence = itertools.count()
+
+    def start(self) -> "MqttFakeBroker":
+        self._running = True
+
+        for listener in self.listeners:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, listener.port))
+            sock.listen(128)
+            listener.port = sock.getsockname()[1]
+            self._sockets.append(sock)
+
+            thread = threading.Thread(
+                target=self._accept,
+                args=(sock, listener),
+                name=f"FakeBroker.{listener.port}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+            self.log.info(
+                f"Listening on {self.host}:{listener.port} transport={listener.transport} tls={listener.tls}"
+            )
+
+        thread = threading.Thread(
+            target=self._send_scheduled, name="FakeBroker.Delay", daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+
+        return self
+
+    def stop(self):
+        self._running = False
+
+        for sock in self._sockets:
+            # close() alone does not wake up a thread blocked in accept()
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self._sockets.clear()
+
+        self.disconnect_clients()
+
+        with self._schedule_condition:
+            self._schedule_condition.notify_all()
+        for thread in self._threads:
+            thread.join(1)
+        self._threads.clear()
+
+    def __enter__(self) -> "MqttFakeBroker":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def client_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._connections)
+
+    def disconnect_clients(self):
+        """disconnect_clients Drop every connection without DISCONNECT, like a broker restart"""
+        with self._lock:
+            connections = list(self._connections.values())
+
+        for connection in connections:
+            connection.close()
+
+    def publish(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int = 0,
+        retain: bool = False,
+        properties: List[Tuple[int, object]] = (),
+    ):
+        """publish Route a message to subscribers, also used for messages from clients
+
+        properties are MQTT 5 PUBLISH properties as (identifier, value) pairs, only sent to MQTT 5 clients.
+        """
+        if retain:
+            with self._lock:
+                if payload:
+                    self.retained[topic] = (payload, qos, properties)
+                else:
+                    self.retained.pop(topic, None)
+
+        with self._lock:
+            self.received_count += 1
+            matches = self._trie.match(topic)
+
+            # One copy per client at the highest matching QoS, one member per share group
+            targets: Dict[_Connection, int] = {}
+            groups: Dict[Tuple[str, str], List[_Subscription]] = {}
+            for subscription in matches:
+                if subscription.share_group is not None:
+                    key = (subscription.share_group, subscription.topic_filter)
+                    groups.setdefault(key, []).append(subscription)
+                    continue
+                connection = subscription.connection
+                targets[connection] = max(targets.get(connection, 0), subscription.qos)
+
+            for key, members in groups.items():
+                counter = self._share_counters.setdefault(key, itertools.count())
+                subscription = members[next(counter) % len(members)]
+                connection = subscription.connection
+                targets[connection] = max(targets.get(connection, 0), subscription.qos)
+
+            if self.loss:
+                for connection in list(targets):
+                    if self._random.random() < self.loss:
+                        del targets[connection]
+                        self.dropped_count += 1
+            self.delivered_count += len(targets)
+
+        for connection, subscription_qos in targets.items():
+            connection.deliver(topic, payload, min(qos, subscription_qos), False, properties)
+
+    def _accept(self, sock: socket.socket, listener: MqttFakeBrokerListener):
+        while self._running:
+            try:
+                client_sock, address = sock.accept()
+            except OSError:
+                return
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _Connection(self, client_sock, listener).thread.start()
+
+    def _authenticate(self, username: str, password: bytes) -> bool:
+        if self.username is None:
+            return True
+        return username == self.username and password == (self.password or "").encode(
+            "utf-8"
+        )
+
+    def _connection_opened(self, connection: _Connection):
+        with self._lock:
+            existing = self._connections.get(connection.client_id)
+            self._connections[connection.client_id] = connection
+
+        if existing:
+            # Client id taken over by a new connection
+            existing.will = None
+            existing.close()
+
+    def _connection_closed(self, connection: _Connection, publish_will: bool):
+        with self._lock:
+            if self._connections.get(connection.client_id) is connection:
+                del self._connections[connection.client_id]
+            for subscription in connection.subscriptions.values():
+                self._trie.remove(subscription.topic_filter, subscription)
+            connection.subscriptions.clear()
+
+        if publish_will and connection.will and self._running:
+            self.publish(*connection.will)
+
+    def _subscribe(
+        self, connection: _Connection, topic_filter: str, qos: int
+    ) -> _Subscription:
+        share_group = None
+        match_filter = topic_filter
+        if topic_filter.startswith(SHARED_PREFIX):
+            share_group, _, match_filter = topic_filter[len(SHARED_PREFIX) :].partition("/")
+            if not share_group or not match_filter:
+                return None
+
+        levels = match_filter.split("/")
+        if any(
+            ("#" in level and (level != "#" or index != len(levels) - 1))
+            or ("+" in level and level != "+")
+            for index, level in enumerate(levels)
+        ):
+            return None
+
+        subscription = _Subscription(connection, match_filter, qos, share_group)
+        with self._lock:
+            existing = connection.subscriptions.get(topic_filter)
+            if existing:
+                self._trie.remove(existing.topic_filter, existing)
+            connection.subscriptions[topic_filter] = subscription
+            self._trie.add(match_filter, subscription)
+
+        return subscription
+
+    def _unsubscribe(self, connection: _Connection, topic_filter: str) -> bool:
+        with self._lock:
+            subscription = connection.subscriptions.pop(topic_filter, None)
+            if subscription is None:
+                return False
+            self._trie.remove(subscription.topic_filter, subscription)
+        return True
+
+    def _send_retained(self, subscription: _Subscription):
+        if subscription.share_group is not None:
+            return
+
+        matcher = MqttTopicTrie()
+        matcher.add(subscription.topic_filter, True)
+        with self._lock:
+            retained = [
+                (topic, payload, qos, properties)
+                for topic, (payload, qos, properties) in self.retained.items()
+                if matcher.match(topic)
+            ]
+
+        for topic, payload, qos, properties in retained:
+            subscription.connection.deliver(
+                topic, payload, min(qos, subscription.qos), True, properties
+            )
+
+    def _packet_delay(self) -> float:
+        if not self.latency and not self.jitter:
+            return 0
+        return self.latency + (self._random.random() * self.jitter if self.jitter else 0)
+
+    def _schedule(self, due: float, connection: _Connection, data: bytes):
+        with self._schedule_condition:
+            heapq.heappush(
+                self._scheduled, (due, next(self._schedule_sequence), connection, data)
+            )
+            self._schedule_condition.notify()
+
+    def _send_scheduled(self):
+        while self._running:
+            with self._schedule_condition:
+                if not self._scheduled:
+                    self._schedule_condition.wait()
+                    continue
+                due = self._scheduled[0][0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._schedule_condition.wait(delay)
+                    continue
+                _, _, connection, data = heapq.heappop(self._scheduled)
+
+            if not connection.closed:
+                connection.write(data)
@@ -0,0 +1,307 @@
+from collections import deque
+from dataclasses import dataclass
+import logging
+import math
+import threading
+import time
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, Callable, Deque, Iterable, List, Tuple
+
+if TYPE_CHECKING:
+    from .mqtt_message import MqttMessage
+
+BLOCK = "block"
+REJECT = "reject"
+QUEUE = "queue"
+
+FLOW_CONTROL_MODES = [BLOCK, REJECT, QUEUE]
+
+# Time constant of the send rate moving average
+SEND_RATE_SECONDS = 1.0
+
+
+@dataclass
+class MqttRateLimit:
+    """Token bucket limit on publishes
+
+    rate: float
+        messages per second
+    burst: float = None
+        messages that can be sent at once after being idle, None is the same as rate
+    topic_prefix: str = ""
+        only publishes to topics starting with this count against the limit, "" is every publish
+
+    Returns:
+        MqttRateLimit: limit ment to be used in MqttConfig.rate_limits
+    """
+
+    rate: float
+    burst: float = None
+    topic_prefix: str = ""
+
+
+class MqttTokenBucket:
+    """MqttTokenBucket Tokens refill at rate per second up to burst
+
+    reserve() takes a token even when there is none, so waiters are served in order
+    and the bucket goes into debt that refilling pays back.
+    """
+
+    def __init__(
+        self, rate: float, burst: float = None, clock: Callable[[], float] = time.monotonic
+    ):
+        if rate <= 0:
+            raise ValueError(f"Invalid rate '{rate}', valid values are above 0")
+
+        self.rate = rate
+        self.burst = burst if burst else rate
+
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, tokens: float = 1) -> float:
+        """delay Seconds until tokens are available, 0 if they are now"""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def take(self, tokens: float = 1):
+        self._refill()
+        self._tokens -= tokens
+
+    def reserve(self, tokens: float = 1) -> float:
+        """reserve Take tokens now and pay for them later
+
+        Returns:
+            float: Seconds to wait before using the tokens
+        """
+        delay = self.delay(tokens)
+        self._tokens -= tokens
+        return delay
+
+
+class MqttFlowControlStats:
+    """MqttFlowControlStats Counters for the publishes going through MqttFlowControl
+
+    throttle_time_ns is the total time publishes were held back, by blocking the caller or in the queue.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+
+        self.sent_count = 0
+        self.throttled_count = 0
+        self.rejected_count = 0
+        self.queued_count = 0
+        self.throttle_time_ns = 0
+
+        # Exponentially decaying count of sends, divided by its time constant it is the rate
+        self._rate_sum = 0.0
+        self._rate_updated = clock()
+
+    @property
+    def send_rate(self) -> float:
+        """send_rate Messages per second, moving average over about SEND_RATE_SECONDS"""
+        with self._lock:
+            elapsed = self._clock() - self._rate_updated
+            return self._rate_sum * math.exp(-elapsed / SEND_RATE_SECONDS) / SEND_RATE_SECONDS
+
+    def sent(self, throttle_ns: int = 0):
+        with self._lock:
+            now = self._clock()
+            self._rate_sum = (
+                self._rate_sum * math.exp(-(now - self._rate_updated) / SEND_RATE_SECONDS) + 1
+            )
+            self._rate_updated = now
+
+            self.sent_count += 1
+            if throttle_ns:
+                self.throttled_count += 1
+                self.throttle_time_ns += throttle_ns
+
+    def rejected(self):
+        with self._lock:
+            self.rejected_count += 1
+
+    def queued(self):
+        with self._lock:
+            self.queued_count += 1
+
+    def __repr__(self) -> str:
+        return "{}(sent={}, throttled={}, rejected={}, queued={}, throttle_time_ns={}, send_rate={:.1f})".format(
+            type(self).__name__,
+            self.sent_count,
+            self.throttled_count,
+            self.rejected_count,
+            self.queued_count,
+            self.throttle_time_ns,
+            self.send_rate,
+        )
+
+
+class MqttFlowControl:
+    """MqttFlowControl Rate limits publishes of a client with token buckets
+
+    A publish takes a token from every limit whose topic_prefix matches its topic.
+    mode decides what happens to a publish over quota:
+
+    * block: publish() sleeps until there are tokens, do not publish from paho callbacks in this mode
+    * reject: publish() returns a failed message right away
+    * queue: the message is queued, up to queue_size, and sent by a background thread when there
+      are tokens. publish() returns a queued message that completes when sent. Over queue_size it is rejected.
+    """
+
+    def __init__(
+        self,
+        limits: Iterable[MqttRateLimit],
+        mode: str = BLOCK,
+        queue_size: int = 1000,
+        send: Callable[["MqttMessage"], None] = None,
+        log: logging.Logger = None,
+    ):
+        if mode not in FLOW_CONTROL_MODES:
+            raise ValueError(
+                f"Invalid flow control mode '{mode}', valid values are: {FLOW_CONTROL_MODES}"
+            )
+        if mode == QUEUE and send is None:
+            raise ValueError("Flow control mode 'queue' needs send")
+
+        self.mode = mode
+        self.queue_size = queue_size
+        self.log = log if log else logging.getLogger("FlowControl")
+        self.stats = MqttFlowControlStats()
+
+        self._limits: List[Tuple[str, MqttTokenBucket]] = [
+            (limit.topic_prefix, MqttTokenBucket(limit.rate, limit.burst)) for limit in limits
+        ]
+        self._send = send
+
+        self._queue: Deque[Tuple["MqttMessage", int]] = deque()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread = None
+        self._closed = False
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _buckets(self, topic: str) -> List[MqttTokenBucket]:
+        return [bucket for prefix, bucket in self._limits if topic.startswith(prefix)]
+
+    def acquire(self, topic: str) -> bool:
+        """acquire Take the tokens for a publish to topic, blocking in block mode
+
+        Returns:
+            bool: True if the publish can be sent now, False if it must be rejected or queued
+        """
+        if self.mode == BLOCK:
+            self.wait_for_tokens(topic)
+            return True
+
+        buckets = self._buckets(topic)
+        with self._condition:
+            # Queued messages go first, new ones line up behind them
+            if self._queue or any(bucket.delay() > 0 for bucket in buckets):
+                return False
+            for bucket in buckets:
+                bucket.take()
+
+        self.stats.sent()
+        return True
+
+    def wait_for_tokens(self, topic: str):
+        """wait_for_tokens Take the tokens for a publish to topic, sleeping until they are available whatever the mode"""
+        with self._condition:
+            delay = max((bucket.reserve() for bucket in self._buckets(topic)), default=0.0)
+
+        if delay:
+            time.sleep(delay)
+        self.stats.sent(int(delay * 1e9))
+
+    def put(self, message: "MqttMessage") -> bool:
+        """put Queue a message acquire() refused, only in queue mode
+
+        Returns:
+            bool: False if it is rejected
+        """
+        if self.mode != QUEUE:
+            self.stats.rejected()
+            return False
+
+        with self._condition:
+            if len(self._queue) >= self.queue_size:
+                self.stats.rejected()
+                return False
+
+            self._queue.append((message, time.monotonic_ns()))
+            self.stats.queued()
+
+            # Also keeps a thread that is closing running
+            self._closed = False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._drain, name=f"{self.log.name}.Queue", daemon=True
+                )
+                self._thread.start()
+
+            self._condition.notify_all()
+
+        return True
+
+    def _drain(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+
+                message, queued_ns = self._queue[0]
+                delay = max(
+                    (bucket.reserve() for bucket in self._buckets(message.topic)),
+                    default=0.0,
+                )
+
+            if delay:
+                time.sleep(delay)
+
+            with self._condition:
+                if self._closed:
+                    return
+                # Dropped by close() while sleeping and queued again by put()
+                if not self._queue or self._queue[0][0] is not message:
+                    continue
+                self._queue.popleft()
+
+            self.stats.sent(time.monotonic_ns() - queued_ns)
+            try:
+                self._send(message)
+            except Exception:
+                self.log.exception("Sending queued message failed: '%r'", message)
+
+    def close(self):
+        """close Stop sending queued messages, they are dropped and fail"""
+        with self._condition:
+            self._closed = True
+            dropped = [message for message, _ in self._queue]
+            self._queue.clear()
+            self._condition.notify_all()
+
+        for message in dropped:
+            self.stats.rejected()
+            message._queued_dropped()
+
+    def __repr__(self) -> str:
+        return "{}(mode={}, limits={}, queue_depth={}, stats={})".format(
+            type(self).__name__,
+            self.mode,
+            [(prefix, bucket.rate, bucket.burst) for prefix, bucket in self._limits],
+            len(self._queue),
+            self.stats,
+        )
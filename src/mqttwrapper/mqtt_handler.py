@@ -0,0 +1,197 @@
+from collections import deque
+from concurrent.futures import Future
+import logging
+import threading
+from time import time_ns
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, Callable, Deque, Dict
+
+if TYPE_CHECKING:
+    from .mqtt_message import MqttReceivedMessage
+    from .mqtt_subscription import MqttSubscription
+
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+
+EXECUTORS = [INLINE, THREAD, PROCESS]
+
+
+class MqttHandlerStats:
+    """MqttHandlerStats Counters for one handler
+
+    Latency is measured from the message being received to the handler returning,
+    so it includes time spent queued for the executor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.submitted_count = 0
+        self.completed_count = 0
+        self.failed_count = 0
+        self.latency_total_ns = 0
+        self.latency_max_ns = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """queue_depth Messages handed to the handler that did not complete yet"""
+        return self.submitted_count - self.completed_count - self.failed_count
+
+    @property
+    def latency_mean_ns(self) -> float:
+        done = self.completed_count + self.failed_count
+        return self.latency_total_ns / done if done else 0.0
+
+    def submitted(self):
+        with self._lock:
+            self.submitted_count += 1
+
+    def done(self, latency_ns: int, failed: bool):
+        with self._lock:
+            if failed:
+                self.failed_count += 1
+            else:
+                self.completed_count += 1
+            self.latency_total_ns += latency_ns
+            if latency_ns > self.latency_max_ns:
+                self.latency_max_ns = latency_ns
+
+    def __repr__(self) -> str:
+        return "{}(submitted={}, completed={}, failed={}, queue_depth={}, latency_mean_ns={:.0f}, latency_max_ns={})".format(
+            type(self).__name__,
+            self.submitted_count,
+            self.completed_count,
+            self.failed_count,
+            self.queue_depth,
+            self.latency_mean_ns,
+            self.latency_max_ns,
+        )
+
+
+class MqttHandler:
+    """MqttHandler Run a function for every message on a subscription, off the paho network thread
+
+    executor selects where function runs:
+
+    * inline: on the paho network thread, a slow function stalls the whole client
+    * thread: on the client's shared thread pool
+    * process: on the client's shared process pool, function and messages must be picklable
+
+    With ordered=True messages on the same topic are handled one at a time in arrival order,
+    messages on different topics still run in parallel. Inline handlers are always ordered.
+    """
+
+    def __init__(
+        self,
+        subscription: "MqttSubscription",
+        function: Callable[["MqttReceivedMessage"], None],
+        executor: str = INLINE,
+        ordered: bool = False,
+        log: logging.Logger = None,
+    ):
+        if executor not in EXECUTORS:
+            raise ValueError(
+                f"Invalid executor '{executor}', valid values are: {EXECUTORS}"
+            )
+
+        self.subscription = subscription
+        self.function = function
+        self.executor = executor
+        self.ordered = ordered
+        self.log = log if log else subscription.log.getChild("Handler")
+
+        self.stats = MqttHandlerStats()
+
+        self._pool = (
+            None
+            if executor == INLINE
+            else subscription.userdata.client.get_executor(executor)
+        )
+
+        # Per topic backlog while a message on that topic is being handled, only when ordered
+        self._lock = threading.Lock()
+        self._backlogs: Dict[str, Deque["MqttReceivedMessage"]] = {}
+
+    def __call__(self, message: "MqttReceivedMessage"):
+        self.stats.submitted()
+
+        if self._pool is None:
+            self._run_inline(message)
+            return
+
+        if self.ordered:
+            with self._lock:
+                backlog = self._backlogs.get(message.topic)
+                if backlog is not None:
+                    backlog.append(message)
+                    return
+                self._backlogs[message.topic] = deque()
+
+        self._submit(message)
+
+    def _run_inline(self, message: "MqttReceivedMessage"):
+        failed = False
+        try:
+            self.function(message)
+        except Exception:
+            failed = True
+            self.log.exception(f"Handler failed on message: '{message=}'")
+
+        self.stats.done(time_ns() - message.timestamp_ns, failed)
+
+    def _submit(self, message: "MqttReceivedMessage"):
+        # A loop, not recursion through _done, the backlog can be long when the executor is gone
+        while message is not None:
+            try:
+                future = self._pool.submit(self.function, message)
+            except RuntimeError:
+                # Executor is shut down
+                self.log.error(f"Handler executor shut down, dropping message: '{message=}'")
+                self.stats.done(time_ns() - message.timestamp_ns, True)
+                message = self._next(message)
+                continue
+
+            future.add_done_callback(
+                lambda future, message=message: self._future_done(message, future)
+            )
+            return
+
+    def _future_done(self, message: "MqttReceivedMessage", future: Future):
+        # exception() raises CancelledError for a cancelled future
+        if future.cancelled():
+            self.log.error(f"Handler cancelled on message: '{message=}'")
+            self._done(message, failed=True)
+            return
+
+        error = future.exception()
+        if error:
+            self.log.error(
+                f"Handler failed on message: '{message=}'", exc_info=error
+            )
+
+        self._done(message, failed=error is not None)
+
+    def _done(self, message: "MqttReceivedMessage", failed: bool):
+        self.stats.done(time_ns() - message.timestamp_ns, failed)
+
+        next_message = self._next(message)
+        if next_message is not None:
+            self._submit(next_message)
+
+    def _next(self, message: "MqttReceivedMessage") -> "MqttReceivedMessage":
+        """_next Next message waiting on the topic of a handled message, None when there is none"""
+        if not self.ordered:
+            return None
+
+        with self._lock:
+            backlog = self._backlogs[message.topic]
+            if not backlog:
+                del self._backlogs[message.topic]
+                return None
+            return backlog.popleft()
+
+    def close(self):
+        """close Stop handing new messages to the handler, already submitted ones still run"""
+        self.subscription.remove_listener(self)
@@ -0,0 +1,207 @@
+import math
+import threading
+
+from typing import Dict, Iterable, List
+
+DEFAULT_PERCENTILES = (50.0, 99.0, 99.9)
+
+
+class MqttLatencyHistogram:
+    """MqttLatencyHistogram HDR-style histogram for latencies in nanoseconds
+
+    Values are counted in log-linear buckets: every power of two range is split into
+    sub buckets fine enough to keep significant_digits decimal digits of precision.
+    Recording is O(1) and memory is fixed by the range, not by the number of values,
+    so it can run for as long as needed.
+
+    Values above highest_value are recorded as highest_value and counted in clamped_count.
+    """
+
+    def __init__(self, highest_value: int = 60 * 10**9, significant_digits: int = 3):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError(
+                f"significant_digits must be between 1 and 5, got '{significant_digits}'"
+            )
+        if highest_value < 2:
+            raise ValueError(f"highest_value must be at least 2, got '{highest_value}'")
+
+        self.highest_value = highest_value
+        self.significant_digits = significant_digits
+
+        sub_bucket_count_magnitude = math.ceil(math.log2(2 * 10**significant_digits))
+        self._sub_bucket_half_count_magnitude = sub_bucket_count_magnitude - 1
+        self._sub_bucket_count = 1 << sub_bucket_count_magnitude
+        self._sub_bucket_half_count = self._sub_bucket_count >> 1
+        self._sub_bucket_mask = self._sub_bucket_count - 1
+
+        self._counts: List[int] = [0] * (self._counts_index(highest_value) + 1)
+        self._lock = threading.Lock()
+
+        self.total_count = 0
+        self.clamped_count = 0
+        self._total = 0
+        self._min = None
+        self._max = None
+
+    def _counts_index(self, value: int) -> int:
+        bucket_index = (value | self._sub_bucket_mask).bit_length() - (
+            self._sub_bucket_half_count_magnitude + 1
+        )
+        sub_bucket_index = value >> bucket_index
+        return ((bucket_index + 1) << self._sub_bucket_half_count_magnitude) + (
+            sub_bucket_index - self._sub_bucket_half_count
+        )
+
+    def _value_from_index(self, index: int) -> int:
+        """_value_from_index Lowest value counted at index"""
+        bucket_index = (index >> self._sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self._sub_bucket_half_count - 1)) + (
+            self._sub_bucket_half_count
+        )
+        if bucket_index < 0:
+            sub_bucket_index -= self._sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << bucket_index
+
+    def record(self, value: int, count: int = 1):
+        """record Count value, negative values are recorded as 0
+
+        Args:
+            value (int): Latency in nanoseconds
+            count (int, optional): Times to count value. Defaults to 1.
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+        clamped = value > self.highest_value
+        if clamped:
+            value = self.highest_value
+
+        index = self._counts_index(value)
+
+        with self._lock:
+            self._counts[index] += count
+            self.total_count += count
+            self._total += value * count
+            if clamped:
+                self.clamped_count += count
+            if self._min is None or value < self._min:
+                self._min = value
+            if self._max is None or value > self._max:
+                self._max = value
+
+    def record_many(self, values: Iterable[int]):
+        for value in values:
+            self.record(value)
+
+    @property
+    def min(self) -> int:
+        return self._min
+
+    @property
+    def max(self) -> int:
+        return self._max
+
+    @property
+    def total(self) -> int:
+        """total Sum of every recorded value"""
+        return self._total
+
+    @property
+    def mean(self) -> float:
+        return self._total / self.total_count if self.total_count else 0.0
+
+    def value_at_percentile(self, percentile: float) -> int:
+        """value_at_percentile Value that percentile percent of the recorded values are at or below
+
+        The value is the highest one sharing a bucket with the recorded values, never above max.
+
+        Args:
+            percentile (float): 0 to 100
+
+        Returns:
+            int: Latency in nanoseconds, None when nothing is recorded
+        """
+        with self._lock:
+            if not self.total_count:
+                return None
+
+            percentile = min(max(percentile, 0.0), 100.0)
+            wanted = max(1, math.ceil(percentile / 100.0 * self.total_count))
+
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= wanted:
+                    highest_equivalent = self._value_from_index(index + 1) - 1
+                    return min(max(highest_equivalent, self._min), self._max)
+
+            return self._max
+
+    def percentiles(
+        self, percentiles: Iterable[float] = DEFAULT_PERCENTILES
+    ) -> Dict[float, int]:
+        """percentiles Several percentiles at once, p50/p99/p999 by default
+
+        Returns:
+            Dict[float, int]: Percentile to latency in nanoseconds
+        """
+        return {
+            percentile: self.value_at_percentile(percentile)
+            for percentile in percentiles
+        }
+
+    def add(self, other: "MqttLatencyHistogram"):
+        """add Merge the counts of other into this histogram, both must have the same precision"""
+        if other.significant_digits != self.significant_digits:
+            raise ValueError(
+                "Histograms with different significant_digits can not be merged"
+            )
+
+        with other._lock:
+            counts = list(other._counts)
+            total_count = other.total_count
+            clamped_count = other.clamped_count
+            total = other._total
+            other_min = other._min
+            other_max = other._max
+
+        if not total_count:
+            return
+
+        with self._lock:
+            for index, count in enumerate(counts):
+                if not count:
+                    continue
+                value = min(other._value_from_index(index), self.highest_value)
+                self._counts[self._counts_index(value)] += count
+            self.total_count += total_count
+            self.clamped_count += clamped_count
+            self._total += total
+            if self._min is None or other_min < self._min:
+                self._min = other_min
+            if self._max is None or other_max > self._max:
+                self._max = min(other_max, self.highest_value)
+
+    def copy(self) -> "MqttLatencyHistogram":
+        histogram = MqttLatencyHistogram(self.highest_value, self.significant_digits)
+        histogram.add(self)
+        return histogram
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self.total_count = 0
+            self.clamped_count = 0
+            self._total = 0
+            self._min = None
+            self._max = None
+
+    def __repr__(self) -> str:
+        return "{}(count={}, min={}, p50={}, p99={}, p999={}, max={})".format(
+            type(self).__name__,
+            self.total_count,
+            self._min,
+            *self.percentiles().values(),
+            self._max,
+        )
@@ -1,18 +1,146 @@
 from dataclasses import dataclass, field
+import json
+import time
 from time import time_ns
 
+from paho.mqtt import client as PahoClient
 from paho.mqtt.client import MQTTMessageInfo as PahoMQTTMessageInfo
+from paho.mqtt.client import MQTTMessage as PahoMQTTMessage
+
+from .mqtt_serializer import MqttSerializer, get_serializer
+from .helper import wait
 
 # Help out with cyclic import
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Union
 
 if TYPE_CHECKING:
     from .mqtt_userdata import MqttUserdata
     from .mqtt_subscription import MqttSubscription
+    from .mqtt_publish_batch import MqttPublishListener
+
+
+_UNSET = object()
+
+
+def to_payload(payload) -> bytes:
+    """to_payload Turn a publish payload into something bytes-like without copying when possible
+
+    bytes, bytearray and memoryview are used as is, None becomes an empty payload,
+    str is utf-8 encoded and anything else is encoded from str(payload).
+
+    Args:
+        payload (Any): Payload given to publish
+
+    Returns:
+        bytes: bytes-like payload
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return payload
+    if payload is None:
+        return b""
+    if not isinstance(payload, str):
+        payload = str(payload)
+    return payload.encode("utf-8")
+
+
+def to_paho_payload(payload):
+    """to_paho_payload Hand a bytes-like payload to paho, which does not accept memoryview
+
+    A memoryview spanning a whole bytes or bytearray is unwrapped to the object it views,
+    only other views are copied.
+
+    Args:
+        payload (Any): Payload returned by to_payload
+
+    Returns:
+        Union[bytes, bytearray]: Payload accepted by paho publish
+    """
+    if not isinstance(payload, memoryview):
+        return payload
+
+    base = payload.obj
+    if (
+        isinstance(base, (bytes, bytearray))
+        and payload.contiguous
+        and payload.nbytes == len(base)
+    ):
+        return base
+
+    return payload.tobytes()
+
+
+class MqttPayloadMixin:
+    """MqttPayloadMixin Lazy, cached accessors for the payload
+
+    Nothing is decoded or copied until an accessor is used, then the result is kept.
+    """
+
+    __slots__ = ()
+
+    @property
+    def view(self) -> memoryview:
+        """view Zero-copy memoryview of the payload"""
+        view = getattr(self, "_view", _UNSET)
+        if view is _UNSET:
+            view = self._view = memoryview(self.payload)
+        return view
+
+    @property
+    def text(self) -> str:
+        """text Payload decoded as utf-8"""
+        text = getattr(self, "_text", _UNSET)
+        if text is _UNSET:
+            text = self._text = str(self.payload, "utf-8")
+        return text
+
+    def json(self):
+        """json Payload parsed as JSON
+
+        Returns:
+            Any: Parsed payload
+        """
+        decoded = getattr(self, "_json", _UNSET)
+        if decoded is _UNSET:
+            payload = self.payload
+            decoded = self._json = json.loads(
+                payload if isinstance(payload, (bytes, bytearray)) else self.text
+            )
+        return decoded
+
+    def decode(self, serializer: Union[str, MqttSerializer] = None) -> Any:
+        """decode Payload decoded by a serializer, the value is kept until another serializer is asked for
+
+        Args:
+            serializer (Union[str, MqttSerializer], optional): Registered name or serializer. Defaults to None, the one MqttConfig.serializers gives the topic
+
+        Returns:
+            Any: Decoded payload
+        """
+        if serializer is None:
+            serializer = self._topic_serializer()
+        else:
+            serializer = get_serializer(serializer)
+
+        decoded = getattr(self, "_decoded", _UNSET)
+        if decoded is _UNSET or decoded[0] is not serializer:
+            decoded = self._decoded = (serializer, serializer.loads(self.payload))
+        return decoded[1]
+
+    def _topic_serializer(self) -> MqttSerializer:
+        userdata = getattr(self, "userdata", None)
+        if userdata is None and self.subscription is not None:
+            userdata = self.subscription.userdata
+
+        serializer = None
+        if userdata is not None:
+            serializer = userdata.client.serializers.for_topic(self.topic)
+        if serializer is None:
+            raise ValueError(f"No serializer configured for topic '{self.topic}'")
+        return serializer
 
 
 @dataclass()
-class MqttMessage:
+class MqttMessage(MqttPayloadMixin):
     topic: str
     payload: bytes
     qos: int
@@ -25,11 +153,36 @@ class MqttMessage:
     paho_message_info: PahoMQTTMessageInfo = field(
         repr=False, default=None, compare=False
     )
+    listener: "MqttPublishListener" = field(repr=False, default=None, compare=False)
+    # Held by the offline queue or flow control, paho_message_info is set when it is sent
+    queued: bool = field(repr=False, default=False, compare=False)
+
     _timestamp_ns: int = field(
         init=False, repr=False, default_factory=time_ns, compare=False
     )
+    _acked_ns: int = field(init=False, repr=False, default=None, compare=False)
 
     def __post_init__(self):
+        # Payload: Incoming will always be bytes from paho, make sure outgoing is also bytes-like
+        self.payload = to_payload(self.payload)
+
+        # Make sure retained is bool and not int on received messages
+        """
+        Unlikely to matter, but if we have to receive a lot of messages this is a small optimization.
+
+        ❯ time python -c "for i in range(1000000000): bool(i)"
+        real    0m54.581s
+
+        ❯ time python -c "for i in range(1000000000): not not i"
+        real    0m28.148s
+        """
+        self.retain = not not self.retain
+
+        if self.listener is not None:
+            self.listener.add(self)
+            if self.is_failed():
+                self.listener.message_failed(self)
+
         # Incoming and outgoing has different parent/container
         if self.userdata and not self.subscription:
             self.userdata.add_sent_message(self)
@@ -41,30 +194,60 @@ class MqttMessage:
                 For incoming/received: subscription. For outgoing/sent: userdata."""
             )
 
-        # Payload: Incoming will always be bytes from paho, make sure outgoing is also bytes
-        payload = self.payload
-        if not isinstance(payload, bytes):
-            if not isinstance(payload, str):
-                payload = str(payload)
-            payload = payload.encode("utf-8")
+    @property
+    def timestamp_ns(self):
+        return self._timestamp_ns
 
-        self.payload = payload
+    @property
+    def acked_ns(self) -> int:
+        """acked_ns time_ns() when PUBACK/PUBCOMP arrived, None until then"""
+        return self._acked_ns
 
-        # Make sure retained is bool and not int on received messages
-        """
-        Unlikely to matter, but if we have to receive a lot of messages this is a small optimization.
+    @property
+    def latency_ns(self) -> int:
+        """latency_ns Nanoseconds from publish to PUBACK/PUBCOMP, None until acknowledged"""
+        if self._acked_ns is None:
+            return None
+        return self._acked_ns - self._timestamp_ns
 
-        ❯ time python -c "for i in range(1000000000): bool(i)"
-        real    0m54.581s
+    def published_callback(self, acked_ns: int):
+        self._acked_ns = acked_ns
+        if self.listener is not None:
+            self.listener.message_acked(self)
 
-        ❯ time python -c "for i in range(1000000000): not not i"
-        real    0m28.148s
+    def _queued_sent(self, paho_message_info: PahoMQTTMessageInfo):
+        self.mid = paho_message_info.mid
+        self.paho_message_info = paho_message_info
+        self.queued = False
+
+    def _queued_dropped(self):
+        # Dropped or rejected, same rc paho gives when its own queue is full
+        paho_message_info = PahoMQTTMessageInfo(self.mid)
+        paho_message_info.rc = PahoClient.MQTT_ERR_QUEUE_SIZE
+        self.paho_message_info = paho_message_info
+        self.queued = False
+
+        if self.listener is not None:
+            self.listener.message_failed(self)
+        self.userdata.notifier.notify()
+
+    def is_failed(self) -> bool:
+        """is_failed Checks if paho refused to send or queue an outgoing message
+
+        QoS 1 and 2 messages published while not connected are kept by paho and sent on reconnect,
+        those are not failed.
+
+        Returns:
+            bool: True if the message will never be sent
         """
-        self.retain = not not self.retain
+        if not self.paho_message_info:
+            return False
 
-    @property
-    def timestamp_ns(self):
-        return self._timestamp_ns
+        rc = self.paho_message_info.rc
+        if rc == PahoClient.MQTT_ERR_SUCCESS:
+            return False
+
+        return not (self.qos > 0 and rc == PahoClient.MQTT_ERR_NO_CONN)
 
     def is_communicated(self) -> bool:
         """is_communicated Checks if message is published if self.paho_message_info is populated otherwise returnes True
@@ -77,11 +260,22 @@ class MqttMessage:
             bool: Has the message completed transmission
         """
 
+        if self.queued:
+            return False
+
         if self.paho_message_info:
-            return self.paho_message_info.is_published()
+            if self._paho_waitable():
+                return self.paho_message_info.is_published()
+            # paho raises for any other rc, a message it kept while not connected is done when acknowledged
+            return self._acked_ns is not None
 
         return True
 
+    def _paho_waitable(self) -> bool:
+        """_paho_waitable paho's MQTTMessageInfo can be waited on, it raises for other rc"""
+        rc = self.paho_message_info.rc
+        return rc == PahoClient.MQTT_ERR_SUCCESS or rc == PahoClient.MQTT_ERR_AGAIN
+
     def wait_for_communication(self, timeout: int = 1) -> bool:
         """wait_for_communication waits for communication to complete up to timeout seconds
 
@@ -94,7 +288,150 @@ class MqttMessage:
             bool: result is taken from self.is_communicated()
         """
 
-        if self.paho_message_info:
-            self.paho_message_info.wait_for_publish(timeout=timeout)
+        # One deadline for both waits, a queued message does not get timeout twice
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        if self.queued:
+            wait(
+                condition=lambda: not self.queued,
+                timeout=timeout,
+                notifier=self.userdata.notifier,
+            )
+
+        if self.paho_message_info and not self.is_failed():
+            remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            if self._paho_waitable():
+                self.paho_message_info.wait_for_publish(timeout=remaining)
+            else:
+                # Kept by paho while not connected, acknowledged after a reconnect
+                wait(
+                    condition=self.is_communicated,
+                    timeout=remaining,
+                    notifier=self.userdata.notifier,
+                )
 
         return self.is_communicated()
+
+
+class MqttReceivedMessage(MqttPayloadMixin):
+    """MqttReceivedMessage Compact representation of a received message
+
+    Used on the receive hot path instead of MqttMessage, no per-instance __dict__ and no
+    dataclass machinery. Compares equal to an MqttMessage with the same topic, payload, qos and retain.
+    """
+
+    __slots__ = (
+        "topic",
+        "payload",
+        "qos",
+        "retain",
+        "mid",
+        "subscription",
+        "_timestamp_ns",
+        # Lazy payload accessor caches, unset until first use
+        "_view",
+        "_text",
+        "_json",
+        "_decoded",
+    )
+
+    def __init__(
+        self,
+        topic: str,
+        payload: bytes,
+        qos: int,
+        retain: bool,
+        mid: int = None,
+        subscription: "MqttSubscription" = None,
+    ):
+        self.topic = topic
+        self.payload = to_payload(payload)
+        self.qos = qos
+        self.retain = not not retain
+        self.mid = mid
+        self.subscription = subscription
+        self._timestamp_ns = time_ns()
+
+    @classmethod
+    def from_paho(
+        cls, subscription: "MqttSubscription", message: PahoMQTTMessage
+    ) -> "MqttReceivedMessage":
+        """from_paho Build from a paho message without any validation
+
+        Paho always gives a bytes payload and a valid topic, so __init__ checks are skipped.
+
+        Args:
+            subscription (MqttSubscription): Subscription the message was received on
+            message (PahoMQTTMessage): Message given by paho in on_message
+
+        Returns:
+            MqttReceivedMessage: New message, not yet added to the subscription
+        """
+        self = cls.__new__(cls)
+        self.topic = message.topic
+        self.payload = message.payload
+        self.qos = message.qos
+        self.retain = not not message.retain
+        self.mid = message.mid
+        self.subscription = subscription
+        self._timestamp_ns = time_ns()
+        return self
+
+    @property
+    def timestamp_ns(self):
+        return self._timestamp_ns
+
+    def __getstate__(self):
+        # Sent to process pool handlers, the subscription holds locks and loggers
+        return (
+            self.topic,
+            self.payload,
+            self.qos,
+            self.retain,
+            self.mid,
+            self._timestamp_ns,
+        )
+
+    def __setstate__(self, state):
+        (
+            self.topic,
+            self.payload,
+            self.qos,
+            self.retain,
+            self.mid,
+            self._timestamp_ns,
+        ) = state
+        self.subscription = None
+
+    def is_communicated(self) -> bool:
+        """is_communicated Received messages are always communicated
+
+        Returns:
+            bool: Always True
+        """
+        return True
+
+    def wait_for_communication(self, timeout: int = 1) -> bool:
+        """wait_for_communication Nothing to wait for on received messages
+
+        Returns:
+            bool: Always True
+        """
+        return True
+
+    def __eq__(self, other):
+        if isinstance(other, (MqttReceivedMessage, MqttMessage)):
+            return (self.topic, self.payload, self.qos, self.retain) == (
+                other.topic,
+                other.payload,
+                other.qos,
+                other.retain,
+            )
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "{}(topic={!r}, payload={!r}, qos={!r}, retain={!r})".format(
+            type(self).__name__, self.topic, self.payload, self.qos, self.retain
+        )
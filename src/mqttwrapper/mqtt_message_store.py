@@ -0,0 +1,156 @@
+from collections import deque
+from dataclasses import dataclass
+import threading
+from time import time_ns
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, Iterator, List
+
+if TYPE_CHECKING:
+    from .mqtt_message import MqttMessage
+
+
+@dataclass
+class MqttRetentionPolicy:
+    """Retention policy for stored messages
+
+    All limits are combined, a message is evicted as soon as any of them is exceeded.
+    None means no limit.
+
+    max_count: int = None
+        keep at most the last max_count messages
+    max_age: float = None
+        keep messages newer than max_age seconds
+    max_bytes: int = None
+        keep at most max_bytes of payload
+    keep_messages: bool = True
+        when False no messages are kept, only counted
+    columnar: bool = False
+        received messages only, keep them column-wise in an MqttColumnarMessageStore, needs numpy
+
+    Returns:
+        MqttRetentionPolicy: policy ment to be used by MqttMessageStore
+    """
+
+    max_count: int = None
+    max_age: float = None
+    max_bytes: int = None
+    keep_messages: bool = True
+    columnar: bool = False
+
+    @classmethod
+    def count_only(cls) -> "MqttRetentionPolicy":
+        return cls(keep_messages=False)
+
+    def is_bounded(self) -> bool:
+        return (
+            not self.keep_messages
+            or self.max_count is not None
+            or self.max_age is not None
+            or self.max_bytes is not None
+        )
+
+
+class MqttMessageStore:
+    """MqttMessageStore Eviction aware ring buffer of messages
+
+    Behaves like a read only list of the retained messages, oldest first.
+    total_count counts every message ever added, evicted_count the ones no longer retained.
+    """
+
+    def __init__(self, policy: MqttRetentionPolicy = None):
+        self.policy = policy if policy else MqttRetentionPolicy()
+
+        self._messages = deque()
+        self._lock = threading.Lock()
+
+        self._byte_count = 0
+        self._total_count = 0
+        self._evicted_count = 0
+
+    @property
+    def total_count(self) -> int:
+        return self._total_count
+
+    @property
+    def evicted_count(self) -> int:
+        return self._evicted_count
+
+    @property
+    def byte_count(self) -> int:
+        return self._byte_count
+
+    def append(self, message: "MqttMessage"):
+        with self._lock:
+            self._total_count += 1
+
+            if not self.policy.keep_messages:
+                self._evicted_count += 1
+                return
+
+            self._messages.append(message)
+            self._byte_count += len(message.payload)
+
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._evicted_count += len(self._messages)
+            self._messages.clear()
+            self._byte_count = 0
+
+    def _evict(self):
+        """_evict Drop messages from the old end until every limit is satisfied, lock must be held"""
+        policy = self.policy
+        messages = self._messages
+
+        if policy.max_count is not None:
+            while len(messages) > policy.max_count:
+                self._pop_oldest()
+
+        if policy.max_bytes is not None:
+            while messages and self._byte_count > policy.max_bytes:
+                self._pop_oldest()
+
+        if policy.max_age is not None:
+            oldest_allowed_ns = time_ns() - int(policy.max_age * 1e9)
+            while messages and messages[0].timestamp_ns < oldest_allowed_ns:
+                self._pop_oldest()
+
+    def _pop_oldest(self):
+        message = self._messages.popleft()
+        self._byte_count -= len(message.payload)
+        self._evicted_count += 1
+
+    def _snapshot(self) -> List["MqttMessage"]:
+        with self._lock:
+            if self.policy.max_age is not None:
+                self._evict()
+            return list(self._messages)
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self.policy.max_age is not None:
+                self._evict()
+            return len(self._messages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._snapshot()[index]
+
+        with self._lock:
+            if self.policy.max_age is not None:
+                self._evict()
+            return self._messages[index]
+
+    def __iter__(self) -> Iterator["MqttMessage"]:
+        return iter(self._snapshot())
+
+    def __repr__(self) -> str:
+        return "{}(retained={}, total_count={}, evicted_count={}, policy={})".format(
+            type(self).__name__,
+            len(self._messages),
+            self._total_count,
+            self._evicted_count,
+            self.policy,
+        )
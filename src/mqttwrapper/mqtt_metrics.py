@@ -0,0 +1,250 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+from .mqtt_histogram import MqttLatencyHistogram, DEFAULT_PERCENTILES
+
+from typing import Callable, Dict, Iterable, List, Union
+
+COUNTER = "counter"
+GAUGE = "gauge"
+SUMMARY = "summary"
+
+
+class MqttCounter:
+    """MqttCounter Value that only goes up
+
+    With function the value is read from it when collected instead, nothing is counted on the hot path.
+    """
+
+    kind = COUNTER
+
+    def __init__(self, name: str, help: str, function: Callable[[], int] = None):
+        self.name = name
+        self.help = help
+        self.function = function
+
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self.function() if self.function else self._value
+
+
+class MqttGauge:
+    """MqttGauge Value that goes up and down
+
+    With function the value is read from it when collected, which is how most gauges
+    on MqttClient work: they read state the client keeps anyway.
+    """
+
+    kind = GAUGE
+
+    def __init__(self, name: str, help: str, function: Callable[[], float] = None):
+        self.name = name
+        self.help = help
+        self.function = function
+
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    @property
+    def value(self) -> float:
+        return self.function() if self.function else self._value
+
+
+class MqttTimer:
+    """MqttTimer Distribution of durations, recorded in nanoseconds into an MqttLatencyHistogram
+
+    Exported as a Prometheus summary in seconds.
+    """
+
+    kind = SUMMARY
+
+    def __init__(self, name: str, help: str, significant_digits: int = 2):
+        self.name = name
+        self.help = help
+        self.histogram = MqttLatencyHistogram(significant_digits=significant_digits)
+
+    def record(self, duration_ns: int):
+        self.histogram.record(duration_ns)
+
+    @property
+    def value(self) -> Dict[float, int]:
+        return self.histogram.percentiles()
+
+
+Metric = Union[MqttCounter, MqttGauge, MqttTimer]
+
+
+class MqttMetrics:
+    """MqttMetrics Registry of the metrics of one client
+
+    Every metric carries the labels of the registry, client_id for the metrics of an MqttClient.
+    Exporters added with add_exporter are called with the registry on export(), to push
+    metrics somewhere else. For pulling, to_prometheus() gives the Prometheus text format
+    and serve() exposes it over HTTP.
+    """
+
+    def __init__(self, labels: Dict[str, str] = None):
+        self.labels = labels if labels else {}
+
+        self._metrics: Dict[str, Metric] = {}
+        self._exporters: List[Callable[["MqttMetrics"], None]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if existing.kind != metric.kind:
+                    raise ValueError(
+                        f"Metric '{metric.name}' already registered as a {existing.kind}"
+                    )
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, help: str = "", function: Callable[[], int] = None
+    ) -> MqttCounter:
+        """counter Get or create a counter, names should end with _total"""
+        return self._register(MqttCounter(name, help, function))
+
+    def gauge(
+        self, name: str, help: str = "", function: Callable[[], float] = None
+    ) -> MqttGauge:
+        return self._register(MqttGauge(name, help, function))
+
+    def timer(self, name: str, help: str = "") -> MqttTimer:
+        """timer Get or create a timer, names should end with _seconds"""
+        return self._register(MqttTimer(name, help))
+
+    def get(self, name: str) -> Metric:
+        return self._metrics.get(name)
+
+    def collect(self) -> List[Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self) -> Dict[str, Union[float, Dict[float, int]]]:
+        """snapshot Current value of every metric
+
+        Returns:
+            Dict[str, Union[float, Dict[float, int]]]: Name to value, percentile to nanoseconds for timers
+        """
+        return {metric.name: metric.value for metric in self.collect()}
+
+    def add_exporter(self, exporter: Callable[["MqttMetrics"], None]):
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Callable[["MqttMetrics"], None]):
+        self._exporters.remove(exporter)
+
+    def export(self):
+        """export Hand the registry to every exporter"""
+        for exporter in list(self._exporters):
+            exporter(self)
+
+    def to_prometheus(self) -> str:
+        return format_prometheus([self])
+
+    def serve(self, port: int = 9100, host: str = "") -> ThreadingHTTPServer:
+        """serve Expose to_prometheus() on http://host:port/metrics from a background thread
+
+        Returns:
+            ThreadingHTTPServer: Running server, call shutdown() to stop it
+        """
+        return serve_prometheus([self], port=port, host=host)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_prometheus(registries: Iterable[MqttMetrics]) -> str:
+    """format_prometheus Prometheus text format for one or more registries, like the clients of a pool
+
+    Returns:
+        str: Metrics in text exposition format 0.0.4
+    """
+    families: Dict[str, List] = {}
+    for registry in registries:
+        for metric in registry.collect():
+            families.setdefault(metric.name, []).append((registry.labels, metric))
+
+    lines = []
+    for name, members in families.items():
+        first = members[0][1]
+        lines.append(f"# HELP {name} {_escape(first.help)}")
+        lines.append(f"# TYPE {name} {first.kind}")
+
+        for labels, metric in members:
+            if metric.kind != SUMMARY:
+                lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                continue
+
+            histogram = metric.histogram
+            for percentile in DEFAULT_PERCENTILES:
+                value = histogram.value_at_percentile(percentile)
+                quantile_labels = dict(labels, quantile=f"{percentile / 100:g}")
+                lines.append(
+                    f"{name}{_format_labels(quantile_labels)} {value / 1e9 if value is not None else 'NaN'}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total / 1e9}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.total_count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(
+    registries: Iterable[MqttMetrics], port: int = 9100, host: str = ""
+) -> ThreadingHTTPServer:
+    """serve_prometheus Expose registries on http://host:port/metrics from a background thread
+
+    Returns:
+        ThreadingHTTPServer: Running server, call shutdown() to stop it
+    """
+    registries = list(registries)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = format_prometheus(registries).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(
+        target=server.serve_forever, name=f"Metrics.{port}", daemon=True
+    ).start()
+    return server
@@ -0,0 +1,280 @@
+from dataclasses import dataclass
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from time import time_ns
+
+from .mqtt_config import MqttConfig
+from .mqtt_client import MqttClient
+from .mqtt_message import MqttReceivedMessage
+from .mqtt_message_store import MqttRetentionPolicy
+
+from typing import Callable, List, Union
+
+Handler = Union[str, Callable[[MqttReceivedMessage], None]]
+
+# Per worker slots in the shared stats array
+_MESSAGE_COUNT = 0
+_FAILED_COUNT = 1
+_LATENCY_TOTAL_NS = 2
+_LATENCY_MAX_NS = 3
+_CONNECTED = 4
+_SLOT_COUNT = 5
+
+
+@dataclass
+class MqttWorkerStats:
+    """Stats of one worker process, or all of them added together
+
+    message_count: int
+    failed_count: int
+        messages where a handler raised
+    latency_total_ns: int
+    latency_max_ns: int
+        receive to last handler returning
+    connected: int
+        connected workers
+    restart_count: int
+    """
+
+    message_count: int = 0
+    failed_count: int = 0
+    latency_total_ns: int = 0
+    latency_max_ns: int = 0
+    connected: int = 0
+    restart_count: int = 0
+
+    @property
+    def latency_mean_ns(self) -> float:
+        return self.latency_total_ns / self.message_count if self.message_count else 0.0
+
+
+def resolve_handler(handler: Handler) -> Callable[[MqttReceivedMessage], None]:
+    """resolve_handler Function named by an import path like 'package.module:function', callables are returned as they are"""
+    if callable(handler):
+        return handler
+
+    module_name, _, attribute = handler.rpartition(":")
+    if not module_name:
+        module_name, _, attribute = handler.rpartition(".")
+    if not module_name:
+        raise ValueError(
+            f"Invalid handler '{handler}', valid values are callables and 'package.module:function'"
+        )
+
+    function = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        function = getattr(function, name)
+    return function
+
+
+def _worker_main(
+    config: MqttConfig,
+    topic: str,
+    qos: int,
+    handlers: List[Handler],
+    stats,
+    index: int,
+    stop_flag,
+):
+    """_worker_main Entry point of a worker process, runs until stop_flag is set"""
+    base = index * _SLOT_COUNT
+    log = logging.getLogger(f"Worker.{config.client_id}")
+    handlers = [resolve_handler(handler) for handler in handlers]
+
+    # Only the handlers see the messages, nothing is kept
+    client = MqttClient(
+        config.copy(retention=MqttRetentionPolicy.count_only()), log=log
+    )
+    subscription = client.subscribe(topic, qos)
+
+    def handle(message: MqttReceivedMessage):
+        failed = False
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception:
+                failed = True
+                log.exception(f"Handler failed on message: '{message=}'")
+
+        latency_ns = time_ns() - message.timestamp_ns
+
+        # Only this process writes its slots, no lock needed
+        stats[base + _MESSAGE_COUNT] += 1
+        stats[base + _FAILED_COUNT] += failed
+        stats[base + _LATENCY_TOTAL_NS] += latency_ns
+        if latency_ns > stats[base + _LATENCY_MAX_NS]:
+            stats[base + _LATENCY_MAX_NS] = latency_ns
+
+    subscription.add_listener(handle)
+
+    client.start(blocking=False)
+    while not stop_flag.value:
+        stats[base + _CONNECTED] = 1 if subscription.is_active() else 0
+        time.sleep(0.2)
+
+    stats[base + _CONNECTED] = 0
+    client.stop()
+
+
+class MqttProcessSupervisor:
+    """MqttProcessSupervisor Scale receiving over CPU cores with one MqttClient per worker process
+
+    Every worker subscribes '$share/<share_group>/<topic>' so the broker spreads messages over them.
+    Handlers are registered once here and run inline on the worker's network thread. Stats are
+    collected through shared memory and workers that die are restarted.
+
+    Workers are started through a forkserver, a single threaded process that forks them, because
+    forking this process from the monitor thread can deadlock on locks held by other threads.
+    Handlers are sent to the workers by import path: module level functions, or strings like
+    'package.module:function'. Lambdas and closures do not work. Not available on platforms without fork.
+    """
+
+    def __init__(
+        self,
+        config: MqttConfig,
+        topic: str,
+        workers: int = None,
+        share_group: str = "workers",
+        qos: int = 1,
+        restart: bool = True,
+        log: logging.Logger = None,
+    ):
+        self.config = config
+        self.topic = topic
+        self.workers = workers if workers else os.cpu_count()
+        self.share_group = share_group
+        self.qos = qos
+        self.restart = restart
+        self.log = log if log else logging.getLogger(f"Supervisor.{config.client_id}")
+
+        self._context = multiprocessing.get_context("forkserver")
+        # Loaded once in the forkserver instead of in every worker
+        self._context.set_forkserver_preload([__name__])
+        self._handlers: List[Handler] = []
+        self._stats = self._context.Array("q", self.workers * _SLOT_COUNT, lock=False)
+        self._restart_counts = [0] * self.workers
+        self._processes: List[multiprocessing.Process] = [None] * self.workers
+
+        # Polled instead of a multiprocessing.Event, setting an Event hangs
+        # when a worker was killed while waiting on it
+        self._stop_flag = self._context.RawValue("b", 0)
+        self._stop_event = threading.Event()
+        self._monitor: threading.Thread = None
+
+    @property
+    def subscription_topic(self) -> str:
+        if self.share_group:
+            return f"$share/{self.share_group}/{self.topic}"
+        return self.topic
+
+    def add_handler(self, function: Handler):
+        """add_handler Run function in the workers for every message, must be called before start
+
+        Args:
+            function (Handler): Module level function, or its import path like 'package.module:function'
+        """
+        if self.is_running():
+            raise RuntimeError("Handlers must be added before the workers are started")
+        # Fail here instead of in every worker
+        resolve_handler(function)
+        self._handlers.append(function)
+
+    def start(self):
+        self._stop_flag.value = 0
+        self._stop_event.clear()
+
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        self._monitor = threading.Thread(
+            target=self._monitor_workers, name=f"Supervisor.{self.config.client_id}", daemon=True
+        )
+        self._monitor.start()
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                self.config.copy(client_id=f"{self.config.client_id}-w{index}"),
+                self.subscription_topic,
+                self.qos,
+                self._handlers,
+                self._stats,
+                index,
+                self._stop_flag,
+            ),
+            name=f"Worker.{self.config.client_id}-w{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+        self.log.info(f"Started worker {index}: pid={process.pid}")
+
+    def _monitor_workers(self):
+        while not self._stop_event.wait(1):
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or not self.restart:
+                    continue
+
+                self.log.error(
+                    f"Worker {index} exited with code {process.exitcode}, restarting"
+                )
+                self._stats[index * _SLOT_COUNT + _CONNECTED] = 0
+                self._restart_counts[index] += 1
+                self._start_worker(index)
+
+    def stop(self, timeout: float = 5):
+        self._stop_flag.value = 1
+        self._stop_event.set()
+
+        if self._monitor:
+            self._monitor.join(timeout)
+            self._monitor = None
+
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                self.log.warning(f"Worker pid={process.pid} did not stop, terminating")
+                process.terminate()
+                process.join(timeout)
+
+    def is_running(self) -> bool:
+        return any(process and process.is_alive() for process in self._processes)
+
+    def worker_stats(self) -> List[MqttWorkerStats]:
+        stats = []
+        for index in range(self.workers):
+            base = index * _SLOT_COUNT
+            stats.append(
+                MqttWorkerStats(
+                    message_count=self._stats[base + _MESSAGE_COUNT],
+                    failed_count=self._stats[base + _FAILED_COUNT],
+                    latency_total_ns=self._stats[base + _LATENCY_TOTAL_NS],
+                    latency_max_ns=self._stats[base + _LATENCY_MAX_NS],
+                    connected=self._stats[base + _CONNECTED],
+                    restart_count=self._restart_counts[index],
+                )
+            )
+        return stats
+
+    def stats(self) -> MqttWorkerStats:
+        """stats Stats of every worker added together
+
+        Returns:
+            MqttWorkerStats: latency_max_ns is the max over all workers
+        """
+        total = MqttWorkerStats()
+        for stats in self.worker_stats():
+            total.message_count += stats.message_count
+            total.failed_count += stats.failed_count
+            total.latency_total_ns += stats.latency_total_ns
+            total.latency_max_ns = max(total.latency_max_ns, stats.latency_max_ns)
+            total.connected += stats.connected
+            total.restart_count += stats.restart_count
+        return total
@@ -0,0 +1,498 @@
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+import os
+import struct
+import threading
+import weakref
+import zlib
+
+from .mqtt_stream import DROP_OLDEST, DROP_NEWEST
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, Deque, List, Tuple
+
+if TYPE_CHECKING:
+    from .mqtt_message import MqttMessage
+
+OFFLINE_QUEUE_POLICIES = [DROP_OLDEST, DROP_NEWEST]
+
+# Body length and CRC32 of the body
+RECORD_HEADER = struct.Struct("!II")
+# Start of the body: qos, retain and topic length, followed by topic and payload
+RECORD_META = struct.Struct("!BBH")
+# Segment number and offset of the oldest message not acknowledged yet
+HEAD = struct.Struct("!QQ")
+
+HEAD_FILE = "head"
+SEGMENT_SUFFIX = ".seg"
+
+
+@dataclass
+class MqttOfflineQueuePolicy:
+    """Settings for the queue capturing publishes while disconnected
+
+    directory: str = None
+        where segment files are written, None keeps the queue in memory and it is lost on restart
+    max_messages: int = 100000
+        max messages queued, including replayed ones not acknowledged yet
+    max_bytes: int = 64 MiB
+        max topic and payload bytes queued
+    policy: str = drop_oldest
+        drop_oldest or drop_newest when a limit is hit
+    segment_bytes: int = 4 MiB
+        segment files are rolled at this size and deleted once replayed
+    replay_rate: float = None
+        max messages per second replayed after reconnect, None is only limited by max_inflight_messages
+    fsync: bool = False
+        fsync every write so messages also survive power loss, not only a process restart
+    commit_interval: int = 100
+        acknowledged messages between writes of the head file, up to this many are replayed twice after a crash
+
+    Returns:
+        MqttOfflineQueuePolicy: policy ment to be used by MqttOfflineQueue
+    """
+
+    directory: str = None
+    max_messages: int = 100000
+    max_bytes: int = 64 * 1024 * 1024
+    policy: str = DROP_OLDEST
+    segment_bytes: int = 4 * 1024 * 1024
+    replay_rate: float = None
+    fsync: bool = False
+    commit_interval: int = 100
+
+
+@dataclass
+class MqttOfflineRecord:
+    topic: str
+    qos: int
+    retain: bool
+    # Topic and payload bytes, what max_bytes limits
+    size: int
+    # Read back from the segment when replayed if the queue is on disk
+    payload: bytes = field(default=None, repr=False)
+    segment: int = None
+    offset: int = None
+
+    # Message returned by publish, only known in the process that queued it
+    message: weakref.ref = field(default=None, repr=False)
+    # Message handed to paho on replay
+    sent: "MqttMessage" = field(default=None, repr=False)
+
+    def is_complete(self) -> bool:
+        sent = self.sent
+        return sent is not None and (sent.acked_ns is not None or sent.is_failed())
+
+
+class MqttOfflineQueue:
+    """MqttOfflineQueue Publishes captured while disconnected, replayed in order after reconnect
+
+    With a directory, messages are appended to segment files and only their offsets are kept in memory,
+    so a long outage does not exhaust RAM and the queue survives a process restart.
+    The head file points at the oldest message not acknowledged yet, replay is at-least-once.
+
+    MqttClient captures every publish while not connected, and while the queue is not empty
+    so new messages are not sent ahead of queued ones.
+    """
+
+    def __init__(self, policy: MqttOfflineQueuePolicy = None, log: logging.Logger = None):
+        self.policy = policy if policy else MqttOfflineQueuePolicy()
+        if self.policy.policy not in OFFLINE_QUEUE_POLICIES:
+            raise ValueError(
+                f"Invalid offline queue policy '{self.policy.policy}', valid values are: {OFFLINE_QUEUE_POLICIES}"
+            )
+
+        self.log = log if log else logging.getLogger("OfflineQueue")
+
+        # Held by MqttClient while deciding to queue a publish and queueing it
+        self.lock = threading.RLock()
+
+        self._pending: Deque[MqttOfflineRecord] = deque()
+        self._in_flight: Deque[MqttOfflineRecord] = deque()
+        self._replaying = False
+
+        self._byte_count = 0
+        self._queued_count = 0
+        self._dropped_count = 0
+        self._replayed_count = 0
+        self._uncommitted = 0
+
+        self._segments: List[int] = []
+        self._tail = None
+        self._tail_segment = 0
+        self._tail_size = 0
+        self._reader = None
+        self._reader_segment = None
+
+        if self.policy.directory:
+            self._recover()
+
+    @property
+    def byte_count(self) -> int:
+        return self._byte_count
+
+    @property
+    def queued_count(self) -> int:
+        return self._queued_count
+
+    @property
+    def dropped_count(self) -> int:
+        return self._dropped_count
+
+    @property
+    def replayed_count(self) -> int:
+        return self._replayed_count
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    def is_replaying(self) -> bool:
+        return self._replaying
+
+    def is_capturing(self, connected: bool) -> bool:
+        """is_capturing Should a publish go to the queue instead of paho, hold lock while deciding and putting"""
+        return not connected or self._replaying or bool(self._pending)
+
+    def put(self, message: "MqttMessage") -> bool:
+        """put Queue a message, making room according to the policy
+
+        Returns:
+            bool: False if the message was dropped
+        """
+        topic = message.topic.encode("utf-8")
+        payload = bytes(message.payload)
+        size = len(topic) + len(payload)
+
+        with self.lock:
+            if not self._make_room(size):
+                self._dropped_count += 1
+                return False
+
+            record = MqttOfflineRecord(
+                topic=message.topic,
+                qos=message.qos,
+                retain=message.retain,
+                size=size,
+                message=weakref.ref(message),
+            )
+            if self.policy.directory:
+                self._write(record, topic, payload)
+            else:
+                record.payload = payload
+
+            self._pending.append(record)
+            self._byte_count += size
+            self._queued_count += 1
+
+        return True
+
+    def _make_room(self, size: int) -> bool:
+        policy = self.policy
+
+        def full():
+            return (
+                len(self) >= policy.max_messages
+                or self._byte_count + size > policy.max_bytes
+            )
+
+        if not full():
+            return True
+        if policy.policy == DROP_NEWEST:
+            return False
+
+        # Messages handed to paho are not taken back
+        while full() and self._pending:
+            self._drop(self._pending.popleft())
+
+        return not full()
+
+    def _drop(self, record: MqttOfflineRecord):
+        self._byte_count -= record.size
+        self._dropped_count += 1
+        self._uncommitted += 1
+
+        message = record.message() if record.message else None
+        if message is not None:
+            message._queued_dropped()
+
+    def get(self) -> MqttOfflineRecord:
+        """get Oldest queued message, tracked as in flight until complete() sees it acknowledged
+
+        Returns:
+            MqttOfflineRecord: Record with payload, None if nothing is queued
+        """
+        with self.lock:
+            if not self._pending:
+                return None
+
+            record = self._pending.popleft()
+            if record.payload is None:
+                record.payload = self._read(record)
+            self._in_flight.append(record)
+
+        return record
+
+    def has_completed(self) -> bool:
+        """has_completed True if the oldest in flight message is acknowledged, complete() has work to do"""
+        in_flight = self._in_flight
+        return bool(in_flight) and in_flight[0].is_complete()
+
+    def complete(self) -> int:
+        """complete Forget acknowledged messages, in order, and move the head past them
+
+        Returns:
+            int: Messages completed
+        """
+        completed = 0
+        with self.lock:
+            while self._in_flight and self._in_flight[0].is_complete():
+                record = self._in_flight.popleft()
+                self._byte_count -= record.size
+                if record.sent is not None and record.sent.is_failed():
+                    self._dropped_count += 1
+                else:
+                    self._replayed_count += 1
+                completed += 1
+
+            self._uncommitted += completed
+            if self._uncommitted >= self.policy.commit_interval:
+                self._commit()
+
+        return completed
+
+    def start_replay(self) -> bool:
+        """start_replay Claim the replay, only one thread replays at a time
+
+        Returns:
+            bool: True if the caller should replay
+        """
+        with self.lock:
+            if self._replaying or not (self._pending or self._in_flight):
+                return False
+            self._replaying = True
+            return True
+
+    def finish_replay(self) -> bool:
+        """finish_replay End the replay unless messages were queued meanwhile
+
+        Returns:
+            bool: True if the queue is empty and publishes go to paho again
+        """
+        with self.lock:
+            if self._pending or self._in_flight:
+                return False
+            self._replaying = False
+            self._commit()
+            return True
+
+    def stop_replay(self):
+        with self.lock:
+            self._replaying = False
+
+    def connection_lost(self):
+        """connection_lost Paho drops QoS 0 messages it did not write yet, they are replayed again first
+
+        QoS 1/2 messages stay in flight, paho sends them again on reconnect.
+        """
+        with self.lock:
+            in_flight: Deque[MqttOfflineRecord] = deque()
+            lost: List[MqttOfflineRecord] = []
+            for record in self._in_flight:
+                if record.qos == 0 and not record.is_complete():
+                    lost.append(record)
+                else:
+                    in_flight.append(record)
+
+            self._in_flight = in_flight
+            for record in reversed(lost):
+                # wait_for_communication waits for the replay again
+                if record.sent is not None:
+                    record.sent.queued = True
+                    record.sent = None
+                self._pending.appendleft(record)
+
+    def close(self):
+        """close Write the head and close segment files, they are opened again when needed"""
+        with self.lock:
+            self._commit()
+            if self._tail is not None:
+                self._tail.close()
+                self._tail = None
+            self._close_reader()
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._in_flight)
+
+    def __repr__(self) -> str:
+        return "{}(pending={}, in_flight={}, bytes={}, dropped={}, replayed={}, policy={})".format(
+            type(self).__name__,
+            len(self._pending),
+            len(self._in_flight),
+            self._byte_count,
+            self._dropped_count,
+            self._replayed_count,
+            self.policy,
+        )
+
+    # Segment files, lock must be held
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.policy.directory, f"{segment:016x}{SEGMENT_SUFFIX}")
+
+    def _write(self, record: MqttOfflineRecord, topic: bytes, payload: bytes):
+        if self._tail is None or self._tail_size >= self.policy.segment_bytes:
+            self._open_tail()
+
+        body = b"".join(
+            (RECORD_META.pack(record.qos, record.retain, len(topic)), topic, payload)
+        )
+        record.segment = self._tail_segment
+        record.offset = self._tail_size
+
+        self._tail.write(RECORD_HEADER.pack(len(body), zlib.crc32(body)))
+        self._tail.write(body)
+        self._tail.flush()
+        if self.policy.fsync:
+            os.fsync(self._tail.fileno())
+
+        self._tail_size += RECORD_HEADER.size + len(body)
+
+    def _open_tail(self):
+        if self._tail is not None:
+            self._tail.close()
+
+        if not self._segments or self._tail_size >= self.policy.segment_bytes:
+            self._tail_segment = self._segments[-1] + 1 if self._segments else 0
+            self._tail_size = 0
+            self._segments.append(self._tail_segment)
+
+        self._tail = open(self._segment_path(self._tail_segment), "ab")
+
+    def _read(self, record: MqttOfflineRecord) -> bytes:
+        if self._reader_segment != record.segment:
+            self._close_reader()
+            self._reader = open(self._segment_path(record.segment), "rb")
+            self._reader_segment = record.segment
+
+        self._reader.seek(record.offset)
+        length, _ = RECORD_HEADER.unpack(self._reader.read(RECORD_HEADER.size))
+        body = self._reader.read(length)
+        _, _, topic_length = RECORD_META.unpack_from(body)
+
+        return body[RECORD_META.size + topic_length :]
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+            self._reader_segment = None
+
+    def _head(self) -> Tuple[int, int]:
+        # Lost QoS 0 messages are pending again, ahead of later messages still in flight
+        heads = [
+            (records[0].segment, records[0].offset)
+            for records in (self._in_flight, self._pending)
+            if records
+        ]
+        return min(heads) if heads else (self._tail_segment, self._tail_size)
+
+    def _commit(self):
+        self._uncommitted = 0
+        if not self.policy.directory:
+            return
+
+        segment, offset = self._head()
+        path = os.path.join(self.policy.directory, HEAD_FILE)
+        with open(path + ".tmp", "wb") as file:
+            file.write(HEAD.pack(segment, offset))
+            if self.policy.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+        # Everything before the head is acknowledged
+        while self._segments and self._segments[0] < segment:
+            if self._reader_segment == self._segments[0]:
+                self._close_reader()
+            os.remove(self._segment_path(self._segments.pop(0)))
+
+    def _recover(self):
+        directory = self.policy.directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)], 16)
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        if not self._segments:
+            return
+
+        head_segment, head_offset = self._segments[0], 0
+        try:
+            with open(os.path.join(directory, HEAD_FILE), "rb") as file:
+                head_segment, head_offset = HEAD.unpack(file.read(HEAD.size))
+        except (FileNotFoundError, struct.error):
+            pass
+
+        for segment in list(self._segments):
+            if segment < head_segment:
+                os.remove(self._segment_path(segment))
+                self._segments.remove(segment)
+                continue
+
+            start = head_offset if segment == head_segment else 0
+            self._tail_segment = segment
+            self._tail_size = self._scan(segment, start)
+
+        for record in self._pending:
+            self._byte_count += record.size
+
+        self.log.info(
+            "Recovered %d queued messages, %d bytes", len(self._pending), self._byte_count
+        )
+
+    def _scan(self, segment: int, offset: int) -> int:
+        """_scan Index the records of a segment from offset, a torn write at the end is cut off
+
+        Returns:
+            int: Size of the segment
+        """
+        with open(self._segment_path(segment), "r+b") as file:
+            file.seek(offset)
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if not header:
+                    return offset
+
+                body = b""
+                if len(header) == RECORD_HEADER.size:
+                    length, crc = RECORD_HEADER.unpack(header)
+                    body = file.read(length)
+
+                if len(header) < RECORD_HEADER.size or len(body) < length or zlib.crc32(body) != crc:
+                    self.log.warning(
+                        "Truncating torn record in segment %d at offset %d", segment, offset
+                    )
+                    file.truncate(offset)
+                    return offset
+
+                qos, retain, topic_length = RECORD_META.unpack_from(body)
+                topic = body[RECORD_META.size : RECORD_META.size + topic_length]
+                self._pending.append(
+                    MqttOfflineRecord(
+                        topic=topic.decode("utf-8"),
+                        qos=qos,
+                        retain=bool(retain),
+                        size=length - RECORD_META.size,
+                        segment=segment,
+                        offset=offset,
+                    )
+                )
+                offset += RECORD_HEADER.size + length
@@ -0,0 +1,307 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import os
+import struct
+import threading
+from time import time_ns
+
+from .mqtt_client import MqttClient
+from .mqtt_message import MqttMessage, MqttReceivedMessage
+from .mqtt_publish_batch import MqttPublishListener
+from .mqtt_histogram import MqttLatencyHistogram
+from .helper import wait, Notifier
+
+from typing import Dict
+
+# Probe id, sequence number, publish time_ns
+PROBE_HEADER = struct.Struct("!8sQq")
+
+
+@dataclass
+class MqttProbeReport:
+    """MqttProbeReport Snapshot of a MqttLatencyProbe
+
+    sent_count: int
+    acked_count: int
+        PUBACK/PUBCOMP received, for QoS 0 the packet was written
+    received_count: int
+        probe messages received back, duplicates not included
+    failed_count: int
+        paho refused to send or queue
+    lost_count: int
+        not received within loss_timeout, a late arrival is taken back out
+    reordered_count: int
+        received after a message with a higher sequence number
+    duplicate_count: int
+        received more than once
+    in_flight_count: int
+        sent and neither received nor lost yet
+    ack_latency: MqttLatencyHistogram
+        publish to PUBACK/PUBCOMP
+    receive_latency: MqttLatencyHistogram
+        publish to received back on the subscription
+    """
+
+    sent_count: int
+    acked_count: int
+    received_count: int
+    failed_count: int
+    lost_count: int
+    reordered_count: int
+    duplicate_count: int
+    in_flight_count: int
+    ack_latency: MqttLatencyHistogram
+    receive_latency: MqttLatencyHistogram
+
+    @property
+    def loss_ratio(self) -> float:
+        done = self.received_count + self.lost_count
+        return self.lost_count / done if done else 0.0
+
+
+class MqttLatencyProbe(MqttPublishListener):
+    """MqttLatencyProbe Measure round trips through the broker with sequence numbered messages
+
+    Publishes through client.publish to topic, which the probe also subscribes, and matches
+    what comes back on the subscription. Every payload starts with a probe id, sequence number
+    and publish timestamp, optionally padded up to payload_size, so several probes can share
+    a topic and the probe works across client restarts.
+
+    Publish and receive happen in the same process, so latencies use the same clock.
+    For long running probes give the client a bounded retention policy, the probe itself
+    only keeps its histograms and the sequence numbers still in flight.
+    """
+
+    def __init__(
+        self,
+        client: MqttClient,
+        topic: str,
+        qos: int = 1,
+        payload_size: int = 0,
+        loss_timeout: float = 10,
+        significant_digits: int = 3,
+        log: logging.Logger = None,
+    ):
+        self.client = client
+        self.topic = topic
+        self.qos = qos
+        self.payload_size = max(payload_size, PROBE_HEADER.size)
+        self.loss_timeout_ns = int(loss_timeout * 10**9)
+        self.log = log if log else client.log.getChild("Probe")
+
+        self.probe_id = os.urandom(8)
+
+        self.ack_latency = MqttLatencyHistogram(significant_digits=significant_digits)
+        self.receive_latency = MqttLatencyHistogram(
+            significant_digits=significant_digits
+        )
+
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._highest_received_seq = -1
+        # Sequence number to publish time_ns, oldest first
+        self._in_flight: Dict[int, int] = OrderedDict()
+        # Declared lost but could still show up late, bounded to the most recent ones
+        self._lost: Dict[int, int] = OrderedDict()
+        self._max_lost_tracked = 10000
+        self._notifier = Notifier()
+
+        self._reset_counts()
+
+        self._thread: threading.Thread = None
+        self._stop_event = threading.Event()
+
+        self.subscription = client.subscribe(topic, qos)
+        self.subscription.add_listener(self._message_listener)
+
+    def _reset_counts(self):
+        self.sent_count = 0
+        self.acked_count = 0
+        self.received_count = 0
+        self.failed_count = 0
+        self.lost_count = 0
+        self.reordered_count = 0
+        self.duplicate_count = 0
+
+    def send(self) -> MqttMessage:
+        """send Publish one probe message
+
+        Returns:
+            MqttMessage: The sent message
+        """
+        self.expire()
+
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            publish_ns = time_ns()
+            self._in_flight[seq] = publish_ns
+            self.sent_count += 1
+
+        payload = PROBE_HEADER.pack(self.probe_id, seq, publish_ns).ljust(
+            self.payload_size, b"\0"
+        )
+
+        return self.client.publish(self.topic, payload, self.qos, listener=self)
+
+    def run(self, count: int, interval: float = 0) -> MqttProbeReport:
+        """run Send count probe messages interval seconds apart, then wait for the last one
+
+        Returns:
+            MqttProbeReport: Report after the last message was received or loss_timeout passed
+        """
+        for index in range(count):
+            if index and interval:
+                self._stop_event.wait(interval)
+            self.send()
+
+        self.wait_for_in_flight(self.loss_timeout_ns / 10**9)
+        return self.report()
+
+    def start(self, interval: float = 1):
+        """start Send a probe message every interval seconds from a background thread until stop"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+
+        def send_loop():
+            while not self._stop_event.is_set():
+                try:
+                    self.send()
+                except Exception:
+                    self.log.exception("Probe failed to send")
+                self._stop_event.wait(interval)
+
+        self._thread = threading.Thread(
+            target=send_loop, name=f"Probe.{self.client.config.client_id}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """close Stop sending and stop listening on the subscription"""
+        self.stop()
+        self.subscription.remove_listener(self._message_listener)
+
+    def wait_for_in_flight(self, timeout: float = None) -> bool:
+        """wait_for_in_flight Block until every sent probe message was received or lost
+
+        Returns:
+            bool: True if nothing is in flight
+        """
+        def done():
+            self.expire()
+            return not self._in_flight
+
+        return wait(
+            condition=done,
+            timeout=timeout,
+            log=self.log,
+            reason="Waiting for probe messages",
+            notifier=self._notifier,
+        )
+
+    def expire(self, now_ns: int = None):
+        """expire Count messages older than loss_timeout that did not come back as lost"""
+        now_ns = now_ns if now_ns is not None else time_ns()
+
+        with self._lock:
+            while self._in_flight:
+                seq, publish_ns = next(iter(self._in_flight.items()))
+                if now_ns - publish_ns < self.loss_timeout_ns:
+                    break
+
+                del self._in_flight[seq]
+                self._lost[seq] = publish_ns
+                self.lost_count += 1
+                if len(self._lost) > self._max_lost_tracked:
+                    self._lost.popitem(last=False)
+
+    def report(self, reset: bool = False) -> MqttProbeReport:
+        """report Snapshot of counts and latencies
+
+        Args:
+            reset (bool, optional): Start counting from zero after the snapshot, for interval reporting. Defaults to False.
+
+        Returns:
+            MqttProbeReport: Counts and copies of the histograms
+        """
+        self.expire()
+
+        with self._lock:
+            report = MqttProbeReport(
+                sent_count=self.sent_count,
+                acked_count=self.acked_count,
+                received_count=self.received_count,
+                failed_count=self.failed_count,
+                lost_count=self.lost_count,
+                reordered_count=self.reordered_count,
+                duplicate_count=self.duplicate_count,
+                in_flight_count=len(self._in_flight),
+                ack_latency=self.ack_latency.copy(),
+                receive_latency=self.receive_latency.copy(),
+            )
+
+            if reset:
+                self._reset_counts()
+                self.ack_latency.reset()
+                self.receive_latency.reset()
+
+        return report
+
+    def _message_listener(self, message: MqttReceivedMessage):
+        payload = message.payload
+        if len(payload) < PROBE_HEADER.size:
+            return
+
+        probe_id, seq, publish_ns = PROBE_HEADER.unpack_from(payload)
+        if probe_id != self.probe_id:
+            return
+
+        with self._lock:
+            if self._in_flight.pop(seq, None) is None:
+                if self._lost.pop(seq, None) is None:
+                    self.duplicate_count += 1
+                    return
+                self.lost_count -= 1
+
+            self.received_count += 1
+            if seq < self._highest_received_seq:
+                self.reordered_count += 1
+            else:
+                self._highest_received_seq = seq
+
+        self.receive_latency.record(message.timestamp_ns - publish_ns)
+        self._notifier.notify()
+
+    # MqttPublishListener, called for messages published by send
+
+    def message_acked(self, message: MqttMessage):
+        with self._lock:
+            self.acked_count += 1
+        self.ack_latency.record(message.latency_ns)
+
+    def message_failed(self, message: MqttMessage):
+        seq = PROBE_HEADER.unpack_from(message.payload)[1]
+
+        with self._lock:
+            self.failed_count += 1
+            self._in_flight.pop(seq, None)
+        self._notifier.notify()
+
+    def __repr__(self) -> str:
+        return "{}(topic={!r}, sent={}, received={}, lost={}, receive_latency={})".format(
+            type(self).__name__,
+            self.topic,
+            self.sent_count,
+            self.received_count,
+            self.lost_count,
+            self.receive_latency,
+        )
@@ -0,0 +1,127 @@
+import threading
+
+from .helper import wait
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from .mqtt_userdata import MqttUserdata
+    from .mqtt_message import MqttMessage
+
+
+class MqttPublishListener:
+    """MqttPublishListener Told about a published message, pass one to MqttClient.publish
+
+    Subclasses override what they need, the methods run on the thread that publishes
+    or on the paho network thread and must not block.
+    """
+
+    def add(self, message: "MqttMessage"):
+        """add The message was handed to paho, or queued to be sent later"""
+
+    def message_acked(self, message: "MqttMessage"):
+        """message_acked PUBACK/PUBCOMP arrived, for QoS 0 the packet was written"""
+
+    def message_failed(self, message: "MqttMessage"):
+        """message_failed paho refused to send or queue the message, or it was dropped from a queue"""
+
+
+class MqttPublishBatch(MqttPublishListener):
+    """MqttPublishBatch Handle for messages published together with MqttClient.publish_many
+
+    Tracks PUBACK/PUBCOMP for the whole batch without polling every message.
+    A message counts as failed when paho could not send or queue it.
+    """
+
+    def __init__(self, userdata: "MqttUserdata"):
+        self.userdata = userdata
+        self.messages: List["MqttMessage"] = []
+
+        self._lock = threading.Lock()
+        self._acked_count = 0
+        self._failed_count = 0
+
+    def add(self, message: "MqttMessage"):
+        with self._lock:
+            self.messages.append(message)
+
+    def message_acked(self, message: "MqttMessage"):
+        with self._lock:
+            self._acked_count += 1
+
+    def message_failed(self, message: "MqttMessage"):
+        with self._lock:
+            self._failed_count += 1
+
+    @property
+    def outstanding_count(self) -> int:
+        return len(self.messages) - self._acked_count - self._failed_count
+
+    @property
+    def completed(self) -> List["MqttMessage"]:
+        return [message for message in self.messages if message.acked_ns is not None]
+
+    @property
+    def failed(self) -> List["MqttMessage"]:
+        return [message for message in self.messages if message.is_failed()]
+
+    def is_done(self) -> bool:
+        return self.outstanding_count == 0
+
+    def wait_all(self, timeout: int = None) -> bool:
+        """wait_all Block until every message is acknowledged or failed
+
+        Args:
+            timeout (int, optional): Max seconds to wait. Defaults to None, blocking forever
+
+        Returns:
+            bool: True if no message is outstanding
+        """
+        return wait(
+            condition=self.is_done,
+            timeout=timeout,
+            reason="Waiting for batch acknowledgement",
+            notifier=self.userdata.notifier,
+        )
+
+    def wait_for_window(self, window: int, timeout: int = None) -> bool:
+        """wait_for_window Block until fewer than window messages are outstanding
+
+        Args:
+            window (int): Max outstanding messages, 0 means no limit
+            timeout (int, optional): Max seconds to wait. Defaults to None, blocking forever
+
+        Returns:
+            bool: True if there is room for another message
+        """
+        if not window:
+            return True
+
+        return wait(
+            condition=lambda: self.outstanding_count < window,
+            timeout=timeout,
+            notifier=self.userdata.notifier,
+        )
+
+    def latencies_ns(self) -> List[int]:
+        """latencies_ns Publish to PUBACK/PUBCOMP latency of every acknowledged message
+
+        Returns:
+            List[int]: Latencies in nanoseconds, in publish order
+        """
+        return [
+            message.latency_ns for message in self.messages if message.acked_ns is not None
+        ]
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __repr__(self) -> str:
+        return "{}(messages={}, acked={}, failed={})".format(
+            type(self).__name__,
+            len(self.messages),
+            self._acked_count,
+            self._failed_count,
+        )
+
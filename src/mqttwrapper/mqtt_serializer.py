@@ -0,0 +1,254 @@
+from abc import ABC, abstractmethod
+import json
+import struct
+
+from .mqtt_topic_trie import MqttTopicTrie
+
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+# Optional, used when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# struct format character to numpy type, standard sizes only
+_NUMPY_TYPES = {
+    "b": "i1",
+    "B": "u1",
+    "?": "b1",
+    "h": "i2",
+    "H": "u2",
+    "i": "i4",
+    "I": "u4",
+    "l": "i4",
+    "L": "u4",
+    "q": "i8",
+    "Q": "u8",
+    "e": "f2",
+    "f": "f4",
+    "d": "f8",
+}
+_BYTE_ORDERS = {"<": "<", ">": ">", "!": ">", "=": "="}
+
+
+class MqttSerializer(ABC):
+    """MqttSerializer Turns publish values into payloads and received payloads back into values
+
+    Subclasses set name and implement dumps and loads.
+    """
+
+    name: str = None
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        """dumps Payload for value"""
+
+    @abstractmethod
+    def loads(self, payload: bytes) -> Any:
+        """loads Value of a bytes-like payload"""
+
+    def loads_many(self, payloads: Iterable[bytes]) -> List[Any]:
+        """loads_many Decode several payloads, or messages with a payload"""
+        loads = self.loads
+        return [loads(getattr(payload, "payload", payload)) for payload in payloads]
+
+    def __repr__(self) -> str:
+        return "{}(name={!r})".format(type(self).__name__, self.name)
+
+
+class MqttJsonSerializer(MqttSerializer):
+    """MqttJsonSerializer Compact JSON, through orjson when it is installed"""
+
+    name = JSON
+
+    def dumps(self, value: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(value)
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, payload: bytes) -> Any:
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+
+
+class MqttMsgpackSerializer(MqttSerializer):
+    """MqttMsgpackSerializer MessagePack, needs msgpack"""
+
+    name = MSGPACK
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is needed for MqttMsgpackSerializer")
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    def loads(self, payload: bytes) -> Any:
+        return msgpack.unpackb(payload)
+
+
+class MqttStructSerializer(MqttSerializer):
+    """MqttStructSerializer Fixed schema of named fields packed with struct
+
+    MqttStructSerializer("power", [("timestamp", "q"), ("watts", "f"), ("phase", "B")])
+
+    Values are dicts, or tuples in field order. Fields use standard sizes in byte_order,
+    so payloads are the same on every platform and to_numpy() reads them without copying.
+    """
+
+    def __init__(self, name: str, fields: List[Tuple[str, str]], byte_order: str = "<"):
+        if byte_order not in _BYTE_ORDERS:
+            raise ValueError(
+                f"Invalid byte_order '{byte_order}', valid values are: {list(_BYTE_ORDERS)}"
+            )
+
+        self.name = name
+        self.fields = [field_name for field_name, _ in fields]
+        self.formats = [field_format for _, field_format in fields]
+        self.byte_order = byte_order
+        self._struct = struct.Struct(byte_order + "".join(self.formats))
+        self._dtype = None
+
+    @property
+    def size(self) -> int:
+        return self._struct.size
+
+    def dumps(self, value: Any) -> bytes:
+        if isinstance(value, dict):
+            return self._struct.pack(*[value[field_name] for field_name in self.fields])
+        return self._struct.pack(*value)
+
+    def loads(self, payload: bytes) -> Dict[str, Any]:
+        return dict(zip(self.fields, self._struct.unpack(payload)))
+
+    @property
+    def dtype(self) -> "numpy.dtype":
+        """dtype numpy structured type with the fields of the schema"""
+        if numpy is None:
+            raise ImportError("numpy is needed for MqttStructSerializer.dtype")
+
+        if self._dtype is None:
+            order = _BYTE_ORDERS[self.byte_order]
+            types = []
+            for field_name, field_format in zip(self.fields, self.formats):
+                if field_format[-1:] == "s":
+                    types.append((field_name, f"S{field_format[:-1] or 1}"))
+                elif field_format in _NUMPY_TYPES:
+                    types.append((field_name, order + _NUMPY_TYPES[field_format]))
+                else:
+                    raise ValueError(
+                        f"Field '{field_name}' format '{field_format}' has no numpy type"
+                    )
+            self._dtype = numpy.dtype(types)
+
+        return self._dtype
+
+    def to_numpy(self, payloads: Iterable[bytes]) -> "numpy.ndarray":
+        """to_numpy Decode several payloads, or messages with a payload, into one structured array
+
+        Returns:
+            numpy.ndarray: One record per payload, columns by field name
+        """
+        dtype = self.dtype
+        payloads = [getattr(payload, "payload", payload) for payload in payloads]
+        data = b"".join(payloads)
+        if len(data) != len(payloads) * dtype.itemsize:
+            raise ValueError(
+                f"Payloads do not match schema '{self.name}' of {dtype.itemsize} bytes"
+            )
+        return numpy.frombuffer(data, dtype=dtype)
+
+    def __repr__(self) -> str:
+        return "{}(name={!r}, fields={})".format(
+            type(self).__name__, self.name, list(zip(self.fields, self.formats))
+        )
+
+
+SERIALIZERS: Dict[str, MqttSerializer] = {}
+
+
+def register_serializer(serializer: MqttSerializer):
+    """register_serializer Make a serializer selectable by name, replacing one with the same name"""
+    SERIALIZERS[serializer.name] = serializer
+
+
+def get_serializer(serializer: Union[str, MqttSerializer]) -> MqttSerializer:
+    """get_serializer Serializer registered as name, serializer objects are returned as they are"""
+    if isinstance(serializer, MqttSerializer):
+        return serializer
+
+    found = SERIALIZERS.get(serializer)
+    if found is None:
+        raise ValueError(
+            f"Invalid serializer '{serializer}', valid values are: {list(SERIALIZERS)}"
+        )
+    return found
+
+
+register_serializer(MqttJsonSerializer())
+if msgpack is not None:
+    register_serializer(MqttMsgpackSerializer())
+
+
+class MqttSerializers:
+    """MqttSerializers Serializers picked by topic filter, for publishing and decoding messages
+
+    Topic filters use MQTT wildcards, the first one in the mapping matching a topic is used.
+    """
+
+    def __init__(self, rules: Dict[str, Union[str, MqttSerializer]] = None):
+        self._trie = MqttTopicTrie()
+        self._count = 0
+        for index, (topic_filter, serializer) in enumerate((rules or {}).items()):
+            self._trie.add(topic_filter, (index, get_serializer(serializer)))
+            self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def for_topic(self, topic: str) -> MqttSerializer:
+        """for_topic Serializer of the first filter matching topic, None if none does"""
+        if not self._count:
+            return None
+        matches = self._trie.match(topic)
+        if not matches:
+            return None
+        return min(matches, key=lambda match: match[0])[1]
+
+    def dumps(
+        self, topic: str, value: Any, serializer: Union[str, MqttSerializer] = None
+    ) -> Any:
+        """dumps Serialize a value published to topic
+
+        Without serializer the one of the topic is used, payloads that are already bytes-like
+        and topics without serializer are left as they are.
+
+        Returns:
+            Any: Payload for publish
+        """
+        if serializer is None:
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                return value
+            found = self.for_topic(topic)
+            if found is None:
+                return value
+            return found.dumps(value)
+
+        return get_serializer(serializer).dumps(value)
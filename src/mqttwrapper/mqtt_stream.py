@@ -0,0 +1,202 @@
+from collections import deque
+import threading
+import time
+import weakref
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, List, Union
+
+if TYPE_CHECKING:
+    from .mqtt_message import MqttReceivedMessage
+    from .mqtt_subscription import MqttSubscription
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+
+BACKPRESSURE_POLICIES = [DROP_OLDEST, DROP_NEWEST, BLOCK]
+
+
+class MqttMessageQueue:
+    """MqttMessageQueue Bounded queue between the paho network thread and a consumer
+
+    When full, policy decides what happens to a new message:
+
+    * drop_oldest: the oldest queued message is dropped to make room
+    * drop_newest: the new message is dropped
+    * block: put() blocks, which stalls the paho network thread until the consumer catches up
+    """
+
+    def __init__(self, maxsize: int = 1000, policy: str = DROP_OLDEST):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                f"Invalid backpressure policy '{policy}', valid values are: {BACKPRESSURE_POLICIES}"
+            )
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got '{maxsize}'")
+
+        self.maxsize = maxsize
+        self.policy = policy
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._dropped_count = 0
+
+    @property
+    def dropped_count(self) -> int:
+        return self._dropped_count
+
+    def put(self, message: "MqttReceivedMessage"):
+        with self._condition:
+            if len(self._queue) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped_count += 1
+                elif self.policy == DROP_NEWEST:
+                    self._dropped_count += 1
+                    return
+                else:
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self.maxsize or self._closed
+                    )
+
+            if self._closed:
+                return
+
+            self._queue.append(message)
+            self._condition.notify_all()
+
+    def get(self, timeout: float = None) -> "MqttReceivedMessage":
+        """get Take the oldest message
+
+        Args:
+            timeout (float, optional): Max seconds to wait. Defaults to None, blocking forever
+
+        Returns:
+            MqttReceivedMessage: Oldest message, None on timeout or when closed
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._queue or self._closed, timeout
+            ):
+                return None
+            if not self._queue:
+                return None
+
+            message = self._queue.popleft()
+            self._condition.notify_all()
+            return message
+
+    def get_batch(
+        self, max_size: int, max_wait: float, timeout: float = None
+    ) -> List["MqttReceivedMessage"]:
+        """get_batch Take up to max_size messages
+
+        Waits up to timeout for the first message, then up to max_wait for the batch to fill.
+
+        Returns:
+            List[MqttReceivedMessage]: Batch, empty on timeout or when closed
+        """
+        first = self.get(timeout)
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + max_wait
+
+        with self._condition:
+            while len(batch) < max_size:
+                if not self._queue:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._condition.wait_for(
+                        lambda: self._queue or self._closed, remaining
+                    ):
+                        break
+                    if not self._queue:
+                        break
+
+                take = min(max_size - len(batch), len(self._queue))
+                for _ in range(take):
+                    batch.append(self._queue.popleft())
+
+            self._condition.notify_all()
+
+        return batch
+
+    def close(self):
+        """close Wake up everyone waiting, nothing is queued after this"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+
+def _close_queue(subscription: "MqttSubscription", queue: MqttMessageQueue):
+    subscription.remove_listener(queue.put)
+    queue.close()
+
+
+class MqttMessageStream:
+    """MqttMessageStream Iterator over new messages on a subscription
+
+    Messages are queued from the moment the stream is created. Iteration stops when no message
+    arrived within timeout, or when closed. Consumed messages are not kept by the stream, use a
+    retention policy on the subscription to stop it from keeping them as well.
+
+    When batch_size is set each iteration yields a list of up to batch_size messages, waiting
+    at most batch_wait seconds for a batch to fill.
+
+    The subscription only holds the queue, a stream that is no longer referenced, e.g. after
+    breaking out of a for loop, is closed when garbage collected. Use it as a context manager
+    to close it right away when it is kept in a variable.
+    """
+
+    def __init__(
+        self,
+        subscription: "MqttSubscription",
+        timeout: float = None,
+        maxsize: int = 1000,
+        policy: str = DROP_OLDEST,
+        batch_size: int = None,
+        batch_wait: float = 1,
+    ):
+        self.subscription = subscription
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+
+        self.queue = MqttMessageQueue(maxsize, policy)
+        subscription.add_listener(self.queue.put)
+        # Must not reference self, or the stream is never collected
+        self._finalizer = weakref.finalize(self, _close_queue, subscription, self.queue)
+
+    @property
+    def dropped_count(self) -> int:
+        return self.queue.dropped_count
+
+    def close(self):
+        self._finalizer()
+
+    def __iter__(self) -> "MqttMessageStream":
+        return self
+
+    def __next__(self) -> Union["MqttReceivedMessage", List["MqttReceivedMessage"]]:
+        if self.batch_size:
+            item = self.queue.get_batch(self.batch_size, self.batch_wait, self.timeout)
+        else:
+            item = self.queue.get(self.timeout)
+
+        if not item:
+            self.close()
+            raise StopIteration
+
+        return item
+
+    def __enter__(self) -> "MqttMessageStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,17 +1,21 @@
 from dataclasses import dataclass, field
 import logging
-import time
+import threading
 
 # Paho lib
 from paho.mqtt import client as PahoClient
 from paho.mqtt.client import MQTTMessage as PahoMQTTMessage
 
 # This lib
-from .mqtt_message import MqttMessage
-from .helper import wait
+from .mqtt_message import MqttReceivedMessage
+from .mqtt_message_store import MqttMessageStore
+from .mqtt_columnar_store import MqttColumnarMessageStore
+from .mqtt_stream import MqttMessageStream, DROP_OLDEST
+from .mqtt_handler import MqttHandler, INLINE
+from .helper import wait, Notifier
 
 # Help out with cyclic import
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Callable, Tuple
 
 if TYPE_CHECKING:
     from .mqtt_userdata import MqttUserdata
@@ -25,23 +29,44 @@ class MqttSubscription:
     qos: int = 1
     log: logging.Logger = logging.getLogger("Subscription.INITIALIZING")
 
-    messages: List["MqttMessage"] = field(default_factory=list, repr=False)
+    messages: MqttMessageStore = field(default=None, repr=False)
 
-    _total_message_count: int = field(init=False, default=0)
     _rc: int = field(init=False, default=PahoClient.MQTT_ERR_NO_CONN)
     _mid: int = field(init=False, default=None)
     _granted_qos: int = field(init=False, default=0)
+    _subacked: bool = field(init=False, default=False)
+    _notifier: Notifier = field(
+        init=False, repr=False, default_factory=Notifier, compare=False
+    )
+    _activate_lock: threading.Lock = field(
+        init=False, repr=False, default_factory=threading.Lock, compare=False
+    )
+    # Replaced, never mutated, so add_message can iterate without locking
+    _listeners: Tuple[Callable[[MqttReceivedMessage], None], ...] = field(
+        init=False, repr=False, default=(), compare=False
+    )
+    _listeners_lock: threading.Lock = field(
+        init=False, repr=False, default_factory=threading.Lock, compare=False
+    )
 
     def __post_init__(self):
         if self.log.name == "Subscription.INITIALIZING":
             self.log.name = "Subscription.{}".format(self.topic)
 
-        if self.userdata.client.is_connected():
-            self.activate()
+        if self.messages is None:
+            retention = self.userdata.client.config.retention
+            if retention is not None and retention.columnar:
+                self.messages = MqttColumnarMessageStore(retention, subscription=self)
+            else:
+                self.messages = MqttMessageStore(retention)
 
     @property
     def total_message_count(self) -> int:
-        return self._total_message_count
+        return self.messages.total_count
+
+    @property
+    def evicted_message_count(self) -> int:
+        return self.messages.evicted_count
 
     @property
     def rc(self) -> int:
@@ -56,8 +81,12 @@ class MqttSubscription:
         return self._granted_qos
 
     def is_active(self) -> bool:
-        self.log.debug(f"Paho RC: {self._rc}")
-        return self._rc == PahoClient.MQTT_ERR_SUCCESS
+        # Polled while waiting
+        if not self.userdata.client.config.quiet_hot_path and self.log.isEnabledFor(
+            logging.DEBUG
+        ):
+            self.log.debug("Paho RC: %s", self._rc)
+        return self._rc == PahoClient.MQTT_ERR_SUCCESS and self._subacked
 
     def wait_for_active(self, timeout: int = None):
         """wait_for_active Block until SUBACK arrive or timeout
@@ -72,49 +101,137 @@ class MqttSubscription:
         if self.is_active():
             return True
 
-        if not self.activate():
-
-            # timeout_time = None if timeout is None else time.time() + timeout
-            # timeout_sleep = None if timeout is None else min(1, timeout / 10.0)
-
-            # def timed_out():
-            #     return False if timeout is None else time.time() > timeout_time
-
-            # while not self.is_active() and not timed_out():
-            #     time.sleep(timeout_sleep)
-            #     self.log.info(
-            #         "Waiting for subscription, {0:.2f}/{1:.2f} seconds elapsed.".format(
-            #             time.time() - (timeout_time - timeout), timeout
-            #         )
-            #     )
+        # If not connected the subscription is activated by MqttClient._on_connect
+        self.activate()
 
-            wait(
-                condition=self.is_active,
-                timeout=timeout,
-                log=self.log,
-                reason="Waiting for subscription",
-            )
+        wait(
+            condition=self.is_active,
+            timeout=timeout,
+            log=self.log,
+            reason="Waiting for subscription",
+            notifier=self._notifier,
+        )
 
         return self.is_active()
 
     def activate(self):
-        self.log.info(f"Activating subscription '{self=}'")
-        paho_client = self.userdata.client.get_paho()
+        """activate Send SUBSCRIBE unless it is already sent on this connection
 
-        self._rc, self._mid = paho_client.subscribe(self.topic, self.qos)
+        Returns:
+            bool: True if SUBSCRIBE was sent, SUBACK arrive later
+        """
+        # _on_connect and a waiting user thread can race to activate after a reconnect,
+        #   userdata lets only one of them send it
+        self.userdata.activate_subscriptions([self])
 
-        self.log.debug(
-            f"Subscription result: '{self._rc=}', '{self._rc=}', '{self._mid=}'"
-        )
         return self._rc == PahoClient.MQTT_ERR_SUCCESS
 
+    def subscribe_sent(self, rc: int, mid: int):
+        """subscribe_sent Result of handing the SUBSCRIBE carrying this subscription to paho"""
+        self._subacked = False
+        self._rc = rc
+        self._mid = mid if rc == PahoClient.MQTT_ERR_SUCCESS else None
+
     def deactivate(self, rc):
+        self.userdata.release_subscription_mid(self)
         self._rc = PahoClient.MQTT_ERR_CONN_LOST
         self._mid = None
+        self._subacked = False
+        self._notifier.notify()
 
-    def add_message(self, message: MqttMessage):
-        self._total_message_count += 1
+    def add_message(self, message: MqttReceivedMessage):
         self.messages.append(message)
+        self._notifier.notify()
+
+        for listener in self._listeners:
+            listener(message)
+
+    def add_listener(self, listener: Callable[[MqttReceivedMessage], None]):
+        """add_listener Call listener with every message added to this subscription
+
+        Listeners run on the thread receiving the message, normally the paho network thread.
+
+        Args:
+            listener (Callable[[MqttReceivedMessage], None]): Called with each new message
+        """
+        with self._listeners_lock:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener: Callable[[MqttReceivedMessage], None]):
+        with self._listeners_lock:
+            # == so bound methods of the same object match
+            self._listeners = tuple(l for l in self._listeners if l != listener)
+
+    def add_handler(
+        self,
+        function: Callable[[MqttReceivedMessage], None],
+        executor: str = INLINE,
+        ordered: bool = False,
+    ) -> MqttHandler:
+        """add_handler Run function for every new message
+
+        Args:
+            function (Callable[[MqttReceivedMessage], None]): Called with each message
+            executor (str, optional): inline, thread or process, see MqttHandler. Defaults to inline.
+            ordered (bool, optional): Handle messages on the same topic one at a time in order. Defaults to False.
+
+        Returns:
+            MqttHandler: Handler with stats, close() removes it
+        """
+        handler = MqttHandler(self, function, executor=executor, ordered=ordered)
+        self.add_listener(handler)
+        return handler
+
+    def remove_handler(self, handler: MqttHandler):
+        handler.close()
+
+    def stream(
+        self, timeout: float = None, maxsize: int = 1000, policy: str = DROP_OLDEST
+    ) -> MqttMessageStream:
+        """stream Iterate over new messages as they arrive
+
+        for message in subscription.stream(timeout=10): ...
+
+        with subscription.stream() as stream: ...
+
+        Args:
+            timeout (float, optional): Stop after this many seconds without a message. Defaults to None, never stopping
+            maxsize (int, optional): Max messages queued for the consumer. Defaults to 1000.
+            policy (str, optional): drop_oldest, drop_newest or block when the queue is full. Defaults to drop_oldest.
+
+        Returns:
+            MqttMessageStream: Iterator yielding MqttReceivedMessage
+        """
+        return MqttMessageStream(self, timeout=timeout, maxsize=maxsize, policy=policy)
+
+    def batches(
+        self,
+        max_size: int = 100,
+        max_wait: float = 1,
+        timeout: float = None,
+        maxsize: int = 1000,
+        policy: str = DROP_OLDEST,
+    ) -> MqttMessageStream:
+        """batches Iterate over lists of new messages as they arrive
+
+        Args:
+            max_size (int, optional): Max messages per batch. Defaults to 100.
+            max_wait (float, optional): Max seconds to wait for a batch to fill after its first message. Defaults to 1.
+            timeout (float, optional): Stop after this many seconds without a message. Defaults to None, never stopping
+            maxsize (int, optional): Max messages queued for the consumer. Defaults to 1000.
+            policy (str, optional): drop_oldest, drop_newest or block when the queue is full. Defaults to drop_oldest.
+
+        Returns:
+            MqttMessageStream: Iterator yielding List[MqttReceivedMessage]
+        """
+        return MqttMessageStream(
+            self,
+            timeout=timeout,
+            maxsize=maxsize,
+            policy=policy,
+            batch_size=max_size,
+            batch_wait=max_wait,
+        )
 
     def wait_for_message(self, timeout: int = None):
         """wait_for_message Block until message arrive or timeout
@@ -125,33 +242,31 @@ class MqttSubscription:
         Returns:
             bool: True if a message arrived before timeout
         """
-        total_message_count = self._total_message_count
-
-        timeout_time = None if timeout is None else time.time() + timeout
-        timeout_sleep = None if timeout is None else min(1, timeout / 10.0)
+        total_message_count = self.total_message_count
+
+        return wait(
+            condition=lambda: total_message_count != self.total_message_count,
+            timeout=timeout,
+            log=self.log,
+            reason="Waiting for message",
+            notifier=self._notifier,
+        )
 
-        def timed_out():
-            return False if timeout is None else time.time() > timeout_time
+    def subscribe_callback(self, granted_qos: int):
+        # MQTTv5 gives a ReasonCodes object instead of int
+        granted_qos = getattr(granted_qos, "value", granted_qos)
 
-        while total_message_count == self._total_message_count and not timed_out():
-            time.sleep(timeout_sleep)
-            self.log.info(
-                "Waiting for message, {0:.2f}/{1:.2f} seconds elapsed.".format(
-                    time.time() - (timeout_time - timeout), timeout
-                )
-            )
+        self._granted_qos = granted_qos
+        if granted_qos >= 0x80:
+            self.log.error(f"Subscription refused by broker: '{granted_qos=}'")
+            self._rc = PahoClient.MQTT_ERR_ACL_DENIED
+        else:
+            self._subacked = True
 
-        return True if total_message_count != self._total_message_count else False
+        self._notifier.notify()
 
-    def subscribe_callback(self, granted_qos: int):
-        self._granted_qos = granted_qos
+    def unsubscribe_callback(self):
+        self.deactivate(PahoClient.MQTT_ERR_SUCCESS)
 
     def message_callback(self, client, userdata, message: PahoMQTTMessage):
-        MqttMessage(
-            subscription=self,
-            topic=message.topic,
-            payload=message.payload,
-            qos=message.qos,
-            retain=message.retain,
-            mid=message.mid,
-        )
+        self.add_message(MqttReceivedMessage.from_paho(self, message))
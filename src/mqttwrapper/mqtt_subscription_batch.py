@@ -0,0 +1,106 @@
+from paho.mqtt import client as PahoClient
+
+from .helper import wait
+
+# Help out with cyclic import
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    from .mqtt_userdata import MqttUserdata
+    from .mqtt_subscription import MqttSubscription
+
+SUBSCRIBE = "subscribe"
+UNSUBSCRIBE = "unsubscribe"
+
+
+class MqttSubscriptionBatch:
+    """MqttSubscriptionBatch Handle for subscriptions made or removed together
+
+    Returned by MqttClient.subscribe_many and unsubscribe_many. A subscribe batch is done when
+    every subscription got its SUBACK, granted or refused. An unsubscribe batch is done when every
+    subscription is removed. SUBACKs and UNSUBACKs wake up waiters, nothing is polled.
+    """
+
+    def __init__(
+        self,
+        userdata: "MqttUserdata",
+        subscriptions: List["MqttSubscription"],
+        action: str = SUBSCRIBE,
+    ):
+        if action not in (SUBSCRIBE, UNSUBSCRIBE):
+            raise ValueError(
+                f"Invalid action '{action}', valid values are: {[SUBSCRIBE, UNSUBSCRIBE]}"
+            )
+
+        self.userdata = userdata
+        self.subscriptions = subscriptions
+        self.action = action
+
+    @property
+    def active(self) -> List["MqttSubscription"]:
+        return [subscription for subscription in self.subscriptions if subscription.is_active()]
+
+    @property
+    def refused(self) -> List["MqttSubscription"]:
+        return [
+            subscription
+            for subscription in self.subscriptions
+            if subscription.rc == PahoClient.MQTT_ERR_ACL_DENIED
+        ]
+
+    @property
+    def granted_qos(self) -> Dict[str, int]:
+        """granted_qos QoS granted by the broker per topic, for subscriptions with a granted SUBACK"""
+        return {
+            subscription.topic: subscription.granted_qos for subscription in self.active
+        }
+
+    def _is_removed(self, subscription: "MqttSubscription") -> bool:
+        return self.userdata.get_subscription(topic=subscription.topic) is not subscription
+
+    @property
+    def outstanding_count(self) -> int:
+        if self.action == UNSUBSCRIBE:
+            return sum(
+                1 for subscription in self.subscriptions if not self._is_removed(subscription)
+            )
+
+        return sum(
+            1
+            for subscription in self.subscriptions
+            if not subscription.is_active()
+            and subscription.rc != PahoClient.MQTT_ERR_ACL_DENIED
+        )
+
+    def is_done(self) -> bool:
+        return self.outstanding_count == 0
+
+    def wait_all(self, timeout: int = None) -> bool:
+        """wait_all Block until every subscription is acknowledged, or removed for unsubscribe
+
+        Args:
+            timeout (int, optional): Max seconds to wait. Defaults to None, blocking forever
+
+        Returns:
+            bool: True if no subscription is outstanding
+        """
+        return wait(
+            condition=self.is_done,
+            timeout=timeout,
+            reason=f"Waiting for {self.action} batch",
+            notifier=self.userdata.notifier,
+        )
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def __iter__(self):
+        return iter(self.subscriptions)
+
+    def __repr__(self) -> str:
+        return "{}(action={}, subscriptions={}, outstanding={})".format(
+            type(self).__name__,
+            self.action,
+            len(self.subscriptions),
+            self.outstanding_count,
+        )
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import threading
+
+from typing import Dict, Tuple
+
+# Topic Alias property on the wire, identifier byte and two byte value
+ALIAS_PROPERTY_SIZE = 3
+
+
+class MqttTopicAliases:
+    """MqttTopicAliases Topic aliases for publishes on one MQTTv5 connection
+
+    Holds at most maximum aliases, the broker's Topic Alias Maximum. When full the least
+    recently published topic gives its alias to the new one. The first publish of a topic
+    carries the topic and its alias, later ones only the alias.
+
+    Aliases are only valid for the connection they were set up on, reset() on every CONNACK.
+    Packets must reach the broker in the order alias() handed them out, callers hold lock
+    from alias() until the packet is queued for sending.
+    """
+
+    def __init__(self, maximum: int = 0):
+        self.lock = threading.Lock()
+
+        self.maximum = maximum
+        self._aliases: "OrderedDict[str, int]" = OrderedDict()
+
+        # Over the life of the client, not reset with the aliases
+        self.aliased_count = 0
+        self.assigned_count = 0
+        self.evicted_count = 0
+        self.bytes_saved = 0
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+    def reset(self, maximum: int):
+        """reset Forget every alias, for a new connection allowing maximum aliases"""
+        with self.lock:
+            self.maximum = maximum
+            self._aliases.clear()
+
+    def alias(self, topic: str, topic_size: int) -> Tuple[str, int]:
+        """alias Pick the alias to publish topic with, the caller holds lock
+
+        Args:
+            topic (str): Topic of the publish
+            topic_size (int): Encoded length of topic
+
+        Returns:
+            Tuple[str, int]: Topic to put in the PUBLISH, "" when the alias is enough, and the alias, 0 for none
+        """
+        if topic_size <= ALIAS_PROPERTY_SIZE:
+            # The alias would be as long as the topic
+            return topic, 0
+
+        aliases = self._aliases
+        alias = aliases.get(topic)
+        if alias is not None:
+            aliases.move_to_end(topic)
+            self.aliased_count += 1
+            self.bytes_saved += topic_size - ALIAS_PROPERTY_SIZE
+            return "", alias
+
+        if len(aliases) < self.maximum:
+            alias = len(aliases) + 1
+        else:
+            _, alias = aliases.popitem(last=False)
+            self.evicted_count += 1
+
+        aliases[topic] = alias
+        self.assigned_count += 1
+        self.bytes_saved -= ALIAS_PROPERTY_SIZE
+        return topic, alias
+
+    def __repr__(self) -> str:
+        return "{}(maximum={}, aliases={}, aliased={}, evicted={}, bytes_saved={})".format(
+            type(self).__name__,
+            self.maximum,
+            len(self._aliases),
+            self.aliased_count,
+            self.evicted_count,
+            self.bytes_saved,
+        )
+
+
+class MqttReceivedTopicAliases:
+    """MqttReceivedTopicAliases Topic aliases the broker sets up for messages it sends us
+
+    Only used from the paho network thread, reset() on every CONNACK.
+    """
+
+    def __init__(self):
+        self._topics: Dict[int, bytes] = {}
+
+        self.resolved_count = 0
+        self.bytes_saved = 0
+
+    def reset(self):
+        self._topics.clear()
+
+    def resolve(self, topic: bytes, alias: int) -> bytes:
+        """resolve Topic of a received PUBLISH carrying alias
+
+        Args:
+            topic (bytes): Topic in the PUBLISH, empty when the broker sent only the alias
+            alias (int): Topic Alias property of the PUBLISH
+
+        Returns:
+            bytes: The topic, None for an alias the broker never set up
+        """
+        if topic:
+            self._topics[alias] = topic
+            self.bytes_saved -= ALIAS_PROPERTY_SIZE
+            return topic
+
+        topic = self._topics.get(alias)
+        if topic is not None:
+            self.resolved_count += 1
+            self.bytes_saved += len(topic) - ALIAS_PROPERTY_SIZE
+        return topic
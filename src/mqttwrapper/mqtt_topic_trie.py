@@ -0,0 +1,142 @@
+import threading
+
+from typing import Any, Dict, List, Tuple
+
+SHARED_PREFIX = "$share/"
+
+
+def strip_shared_prefix(topic_filter: str) -> str:
+    """strip_shared_prefix Remove '$share/<group>/' from a shared subscription filter
+
+    Messages on shared subscriptions arrive with the topic they were published on,
+    so only the filter after the group name takes part in matching.
+
+    Args:
+        topic_filter (str): Topic filter, shared or not
+
+    Returns:
+        str: Topic filter used for matching
+    """
+    if topic_filter.startswith(SHARED_PREFIX):
+        group_and_filter = topic_filter[len(SHARED_PREFIX) :].split("/", 1)
+        if len(group_and_filter) != 2 or not group_and_filter[1]:
+            raise ValueError(f"Invalid shared subscription filter '{topic_filter}'")
+        return group_and_filter[1]
+
+    return topic_filter
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # Replaced, never mutated, so match() can read it without locking
+        self.values: Tuple[Any, ...] = ()
+
+
+class MqttTopicTrie:
+    """MqttTopicTrie Map MQTT topic filters to values and find all filters matching a topic
+
+    Matching cost is proportional to topic depth and the number of wildcard branches,
+    not the number of filters. Follows the MQTT rules:
+
+    * '+' matches exactly one level, '#' matches the parent and any number of levels below
+    * Topics starting with '$' are not matched by '+' or '#' on the first level
+    * '$share/<group>/<filter>' is matched as <filter>
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def add(self, topic_filter: str, value: Any):
+        levels = strip_shared_prefix(topic_filter).split("/")
+
+        with self._lock:
+            node = self._root
+            for level in levels:
+                child = node.children.get(level)
+                if child is None:
+                    child = _Node()
+                    node.children[level] = child
+                node = child
+
+            node.values = node.values + (value,)
+            self._count += 1
+
+    def remove(self, topic_filter: str, value: Any) -> bool:
+        """remove Remove value from topic_filter
+
+        Returns:
+            bool: False if value was not found on topic_filter
+        """
+        levels = strip_shared_prefix(topic_filter).split("/")
+
+        with self._lock:
+            path = [self._root]
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+
+            node = path[-1]
+            if value not in node.values:
+                return False
+
+            values = list(node.values)
+            values.remove(value)
+            node.values = tuple(values)
+            self._count -= 1
+
+            # Prune branches that no longer lead to any value
+            for level, parent in zip(reversed(levels), reversed(path[:-1])):
+                child = parent.children[level]
+                if child.values or child.children:
+                    break
+                del parent.children[level]
+
+        return True
+
+    def match(self, topic: str) -> List[Any]:
+        """match Find values of every filter matching topic
+
+        Args:
+            topic (str): Topic of a published message, no wildcards
+
+        Returns:
+            List[Any]: Matching values, one entry per matching filter registration
+        """
+        levels = topic.split("/")
+        depth = len(levels)
+        matches = []
+
+        # Depth first over (node, level index), wildcard branches fan out
+        stack = [(self._root, 0)]
+        while stack:
+            node, index = stack.pop()
+            children = node.children
+
+            # '#' also matches the parent level, "a/#" matches "a"
+            hash_node = children.get("#")
+            if hash_node is not None and not (index == 0 and topic[:1] == "$"):
+                matches.extend(hash_node.values)
+
+            if index == depth:
+                matches.extend(node.values)
+                continue
+
+            child = children.get(levels[index])
+            if child is not None:
+                stack.append((child, index + 1))
+
+            plus_node = children.get("+")
+            if plus_node is not None and not (index == 0 and topic[:1] == "$"):
+                stack.append((plus_node, index + 1))
+
+        return matches
+
+    def __len__(self) -> int:
+        return self._count
@@ -1,10 +1,17 @@
 from dataclasses import dataclass, field
 import logging
+import threading
+from time import time_ns
+
+from paho.mqtt import client as PahoClient
 
 from .mqtt_subscription import MqttSubscription
+from .mqtt_message_store import MqttMessageStore, MqttRetentionPolicy
+from .mqtt_topic_trie import MqttTopicTrie
+from .helper import Notifier
 
 # Help out with cyclic import
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
 
 if TYPE_CHECKING:
     from .mqtt_client import MqttClient
@@ -16,43 +23,393 @@ class MqttUserdata:
 
     client: "MqttClient" = field(repr=False)
     subscriptions: List[MqttSubscription] = field(default_factory=list)
-    sent_messages: List["MqttMessage"] = field(default_factory=list)
+    sent_messages: MqttMessageStore = field(default=None)
     log: logging.Logger = logging.getLogger("Userdata")
 
+    # Signaled when a PUBACK/PUBCOMP, SUBACK or UNSUBACK arrives
+    notifier: Notifier = field(
+        init=False, repr=False, default_factory=Notifier, compare=False
+    )
+
+    # Lookup indexes, kept in sync with subscriptions under _lock
+    _subscriptions_by_topic: Dict[str, MqttSubscription] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    # One SUBSCRIBE can carry several subscriptions, in topic order
+    _subscriptions_by_mid: Dict[int, Tuple[MqttSubscription, ...]] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    _unsubscriptions_by_mid: Dict[int, Tuple[MqttSubscription, ...]] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    # SUBACKs and UNSUBACKs that arrived before their mid was registered
+    _pending_subacks: Dict[int, List[int]] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    _pending_unsubacks: Set[int] = field(init=False, repr=False, default_factory=set)
+    # Outgoing messages waiting for PUBACK/PUBCOMP, and acks that arrived before the message was known
+    _messages_by_mid: Dict[int, "MqttMessage"] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    _pending_pubacks: Dict[int, int] = field(
+        init=False, repr=False, default_factory=dict
+    )
+    # Incoming message dispatch, topic filter -> subscription
+    _topic_trie: MqttTopicTrie = field(
+        init=False, repr=False, default_factory=MqttTopicTrie, compare=False
+    )
+    _lock: threading.RLock = field(
+        init=False, repr=False, default_factory=threading.RLock, compare=False
+    )
+
+    def __post_init__(self):
+        if self.sent_messages is None:
+            config = self.client.config
+            policy = (
+                config.sent_retention
+                if config.save_sent_messages
+                else MqttRetentionPolicy.count_only()
+            )
+            self.sent_messages = MqttMessageStore(policy)
+
     def subscribe(self, topic: str, qos: int = 1):
-        subscription = MqttSubscription(
-            userdata=self,
-            topic=topic,
-            qos=qos,
-            log=self.log.getChild(f"Subscription.{topic}"),
+        return self.subscribe_many([(topic, qos)])[0]
+
+    def subscribe_many(self, topics: Iterable[Tuple[str, int]]) -> List[MqttSubscription]:
+        """subscribe_many Get or create a subscription per (topic, qos), new ones share SUBSCRIBE packets
+
+        Args:
+            topics (Iterable[Tuple[str, int]]): (topic, qos) pairs
+
+        Returns:
+            List[MqttSubscription]: One subscription per pair, in the same order
+        """
+        subscriptions = []
+        created = []
+        with self._lock:
+            for topic, qos in topics:
+                subscription = self._subscriptions_by_topic.get(topic)
+                if subscription is None:
+                    subscription = MqttSubscription(
+                        userdata=self,
+                        topic=topic,
+                        qos=qos,
+                        log=self.log.getChild(f"Subscription.{topic}"),
+                    )
+                    self.subscriptions.append(subscription)
+                    self._subscriptions_by_topic[topic] = subscription
+
+                    # Added before SUBSCRIBE is sent so messages right after SUBACK are not missed
+                    self._topic_trie.add(topic, subscription)
+                    created.append(subscription)
+
+                subscriptions.append(subscription)
+
+        self.log.debug(
+            "Adding %d subscriptions, %d already subscribed",
+            len(created),
+            len(subscriptions) - len(created),
         )
-        self.subscriptions.append(subscription)
 
-        self.log.debug(f"Adding subscription: '{subscription=}'")
-        return subscription
+        # Not connected yet means they are activated by MqttClient._on_connect
+        if created and self.client.is_connected():
+            self.activate_subscriptions(created)
+
+        return subscriptions
 
     def get_subscription(self, *, topic=None, mid=None) -> MqttSubscription:
-        self.log.debug(f"Looking up subscription: '{topic=}', '{mid=}'")
         if topic and mid:
-            for subscription in self.subscriptions:
-                if subscription.mid == mid and subscription.topic == topic:
-                    self.log.debug(f"Found subscription: '{subscription=}'")
-                    return subscription
-        elif topic:
-            for subscription in self.subscriptions:
+            for subscription in self._subscriptions_by_mid.get(mid, ()):
                 if subscription.topic == topic:
-                    self.log.debug(f"Found subscription: '{subscription=}'")
                     return subscription
+        elif topic:
+            return self._subscriptions_by_topic.get(topic)
         elif mid:
-            for subscription in self.subscriptions:
-                if subscription.mid == mid:
-                    self.log.debug(f"Found subscription: '{subscription=}'")
-                    return subscription
+            subscriptions = self._subscriptions_by_mid.get(mid)
+            return subscriptions[0] if subscriptions else None
         else:
             raise IndexError(f"Requested subscription not found: '{topic=}', '{mid=}'")
 
-        self.log.warning(f"Did not find subscription: '{topic=}', '{mid=}'")
+    def match_subscriptions(self, topic: str) -> List[MqttSubscription]:
+        """match_subscriptions Find every subscription whose topic filter matches topic
+
+        Args:
+            topic (str): Topic of a received message
+
+        Returns:
+            List[MqttSubscription]: Matching subscriptions, empty if none
+        """
+        return self._topic_trie.match(topic)
+
+    def remove_subscription(self, subscription: MqttSubscription):
+        self.log.debug(f"Removing subscription: '{subscription=}'")
+        with self._lock:
+            self.release_subscription_mid(subscription)
+            if self._subscriptions_by_topic.get(subscription.topic) is subscription:
+                del self._subscriptions_by_topic[subscription.topic]
+                self._topic_trie.remove(subscription.topic, subscription)
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def activate_subscriptions(
+        self, subscriptions: Sequence[MqttSubscription]
+    ) -> List[int]:
+        """activate_subscriptions Send SUBSCRIBE for every subscription not already sent on this connection
+
+        Topics are packed into as few SUBSCRIBE packets as _packets allows. Nothing waits for
+        the SUBACKs, so this is safe on the paho network thread.
+        Subscriptions another thread is activating right now are left to that thread.
+
+        Args:
+            subscriptions (Sequence[MqttSubscription]): Subscriptions to activate
+
+        Returns:
+            List[int]: Mid of every SUBSCRIBE sent
+        """
+        claimed = []
+        try:
+            for subscription in subscriptions:
+                # Non-blocking so two batches claiming in different order can not deadlock
+                if not subscription._activate_lock.acquire(blocking=False):
+                    continue
+                if subscription.rc == PahoClient.MQTT_ERR_SUCCESS:
+                    subscription._activate_lock.release()
+                    continue
+                claimed.append(subscription)
+
+            if not claimed:
+                return []
+
+            self.log.info("Activating %d subscriptions", len(claimed))
+            paho_client = self.client.get_paho()
+
+            mids = []
+            # Every topic filter is followed by a subscription options byte
+            for batch in self._packets(claimed, options_size=1):
+                rc, mid = paho_client.subscribe(
+                    [(subscription.topic, subscription.qos) for subscription in batch]
+                )
+                self.log.debug("Subscribe result: 'rc=%s', 'mid=%s'", rc, mid)
+
+                for subscription in batch:
+                    subscription.subscribe_sent(rc, mid)
+
+                if rc == PahoClient.MQTT_ERR_SUCCESS:
+                    # Applies the SUBACK right away if it won the race against us
+                    self.register_subscription_mid(batch, mid)
+                    mids.append(mid)
+
+            return mids
+        finally:
+            for subscription in claimed:
+                subscription._activate_lock.release()
+
+    def unsubscribe_subscriptions(
+        self, subscriptions: Sequence[MqttSubscription]
+    ) -> List[int]:
+        """unsubscribe_subscriptions Send UNSUBSCRIBE for subscriptions, packed like activate_subscriptions
+
+        Subscriptions are removed when the UNSUBACK arrives, right away if there is nothing to tell the broker.
+
+        Args:
+            subscriptions (Sequence[MqttSubscription]): Subscriptions to remove
+
+        Returns:
+            List[int]: Mid of every UNSUBSCRIBE sent
+        """
+        paho_client = self.client.get_paho()
+
+        mids = []
+        for batch in self._packets(subscriptions, options_size=0):
+            rc, mid = paho_client.unsubscribe([subscription.topic for subscription in batch])
+            if rc == PahoClient.MQTT_ERR_SUCCESS:
+                self.register_unsubscribe_mid(batch, mid)
+                mids.append(mid)
+            else:
+                self._unsubscribed(batch)
+
+        return mids
+
+    def _packets(
+        self, subscriptions: Sequence[MqttSubscription], options_size: int
+    ) -> Iterator[List[MqttSubscription]]:
+        """_packets Split subscriptions into the topics of each SUBSCRIBE/UNSUBSCRIBE packet
+
+        At most config.subscribe_batch_size topics per packet, and no bigger than the
+        Maximum Packet Size the broker gave in its MQTTv5 CONNACK.
+
+        Args:
+            subscriptions (Sequence[MqttSubscription]): Subscriptions to send
+            options_size (int): Bytes following each topic filter, 1 for SUBSCRIBE and 0 for UNSUBSCRIBE
+
+        Yields:
+            List[MqttSubscription]: Subscriptions of one packet
+        """
+        max_count = self.client.config.subscribe_batch_size
+        max_size = self.client.maximum_packet_size
+        # Fixed header with the longest remaining length, packet id and MQTTv5 property length
+        header_size = 5 + 2 + 1
+
+        batch = []
+        size = header_size
+        for subscription in subscriptions:
+            # Length prefix and UTF-8 topic filter
+            size_of_topic = 2 + len(subscription.topic.encode("utf-8")) + options_size
+            if batch and (
+                len(batch) >= max_count or (max_size and size + size_of_topic > max_size)
+            ):
+                yield batch
+                batch = []
+                size = header_size
+
+            batch.append(subscription)
+            size += size_of_topic
+
+        if batch:
+            yield batch
+
+    def register_subscription_mid(
+        self, subscriptions: Sequence[MqttSubscription], mid: int
+    ):
+        """register_subscription_mid Track an in-flight SUBSCRIBE until its SUBACK arrive
+
+        If the SUBACK already arrived it is applied to the subscriptions right away.
+        """
+        with self._lock:
+            granted_qos = self._pending_subacks.pop(mid, None)
+            if granted_qos is None:
+                self._subscriptions_by_mid[mid] = tuple(subscriptions)
+                return
+
+        for subscription, qos in zip(subscriptions, granted_qos):
+            subscription.subscribe_callback(qos)
+        self.notifier.notify()
+
+    def release_subscription_mid(self, subscription: MqttSubscription):
+        """release_subscription_mid Stop waiting for the SUBACK of subscription, others in the same SUBSCRIBE still wait"""
+        with self._lock:
+            subscriptions = self._subscriptions_by_mid.get(subscription.mid)
+            if not subscriptions or not any(
+                waiting is subscription for waiting in subscriptions
+            ):
+                return
+
+            # Replaced by None, SUBACK return codes are matched by position
+            remaining = tuple(
+                None if waiting is subscription else waiting
+                for waiting in subscriptions
+            )
+            if any(remaining):
+                self._subscriptions_by_mid[subscription.mid] = remaining
+            else:
+                del self._subscriptions_by_mid[subscription.mid]
+
+    def subscribe_callback(
+        self, mid: int, granted_qos: List[int]
+    ) -> Tuple[MqttSubscription, ...]:
+        """subscribe_callback Hand a SUBACK to the subscriptions waiting for it
+
+        Paho can deliver the SUBACK before subscribe() returned the mid to us,
+        in that case it is parked until register_subscription_mid is called.
+
+        Args:
+            mid (int): Mid of the SUBSCRIBE
+            granted_qos (List[int]): Granted QoS or reason code per topic, in SUBSCRIBE order
+
+        Returns:
+            Tuple[MqttSubscription, ...]: The acknowledged subscriptions, None if the mid is not known yet
+        """
+        with self._lock:
+            subscriptions = self._subscriptions_by_mid.pop(mid, None)
+            if subscriptions is None:
+                self._pending_subacks[mid] = list(granted_qos)
+                return None
+
+        for subscription, qos in zip(subscriptions, granted_qos):
+            if subscription is not None:
+                subscription.subscribe_callback(qos)
+        self.notifier.notify()
+        return subscriptions
+
+    def register_unsubscribe_mid(
+        self, subscriptions: Sequence[MqttSubscription], mid: int
+    ):
+        with self._lock:
+            if mid in self._pending_unsubacks:
+                self._pending_unsubacks.remove(mid)
+            else:
+                self._unsubscriptions_by_mid[mid] = tuple(subscriptions)
+                return
+
+        self._unsubscribed(subscriptions)
+
+    def unsubscribe_callback(self, mid: int) -> Tuple[MqttSubscription, ...]:
+        with self._lock:
+            subscriptions = self._unsubscriptions_by_mid.pop(mid, None)
+            if subscriptions is None:
+                self._pending_unsubacks.add(mid)
+                return None
+
+        self._unsubscribed(subscriptions)
+
+        return subscriptions
+
+    def _unsubscribed(self, subscriptions: Sequence[MqttSubscription]):
+        for subscription in subscriptions:
+            subscription.unsubscribe_callback()
+            self.remove_subscription(subscription)
+        self.notifier.notify()
+
+    def connection_lost(self, rc: int):
+        with self._lock:
+            self._pending_subacks.clear()
+            self._pending_unsubacks.clear()
+            unsubscriptions = list(self._unsubscriptions_by_mid.values())
+            self._unsubscriptions_by_mid.clear()
+
+        # The UNSUBACK will not come, removed here so they are not restored on reconnect
+        for subscriptions in unsubscriptions:
+            self._unsubscribed(subscriptions)
+
+        for subscription in list(self.subscriptions):
+            subscription.deactivate(rc)
 
     def add_sent_message(self, message: "MqttMessage"):
-        self.log.debug(f"Adding sent message: '{message=}'")
+        # Runs for every publish, repr of the message includes the payload
+        if not self.client.config.quiet_hot_path and self.log.isEnabledFor(
+            logging.DEBUG
+        ):
+            self.log.debug("Adding sent message: 'message=%r'", message)
         self.sent_messages.append(message)
+
+        # Queued messages are tracked when replayed
+        if message.is_failed() or message.queued:
+            return
+
+        self.track_sent_message(message)
+
+    def track_sent_message(self, message: "MqttMessage"):
+        """track_sent_message Wait for the PUBACK/PUBCOMP of a message paho accepted"""
+        # QoS 0 is usually acknowledged before we get here
+        with self._lock:
+            acked_ns = self._pending_pubacks.pop(message.mid, None)
+            if acked_ns is None:
+                self._messages_by_mid[message.mid] = message
+                return
+
+        message.published_callback(acked_ns)
+        self.client._message_acked(message)
+
+    def published_callback(self, mid: int):
+        acked_ns = time_ns()
+
+        with self._lock:
+            message = self._messages_by_mid.pop(mid, None)
+            if message is None:
+                self._pending_pubacks[mid] = acked_ns
+
+        if message:
+            message.published_callback(acked_ns)
+            self.client._message_acked(message)
+
+        self.notifier.notify()
@@ -1,3 +1,41 @@
+import os
+
+import pytest
+
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker, MqttFakeBrokerListener
+
+CERT_DIR = os.path.join(os.path.dirname(__file__), "certs")
+
+
 def pytest_addoption(parser):
     parser.addoption("--username", action="store")
-    parser.addoption("--password", action="store")
\ No newline at end of file
+    parser.addoption("--password", action="store")
+    parser.addoption(
+        "--fake-broker",
+        action="store_true",
+        help="Run the tests against an in-process MqttFakeBroker instead of a real broker",
+    )
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_broker(pytestconfig):
+    if not pytestconfig.getoption("fake_broker"):
+        yield None
+        return
+
+    # Same ports as the client fixture and the broker started by the Makefile
+    broker = MqttFakeBroker(
+        listeners=[
+            MqttFakeBrokerListener(1883, "tcp", False),
+            MqttFakeBrokerListener(8883, "tcp", True),
+            MqttFakeBrokerListener(8083, "websockets", False),
+            MqttFakeBrokerListener(8084, "websockets", True),
+        ],
+        username=pytestconfig.getoption("username"),
+        password=pytestconfig.getoption("password"),
+        certfile=os.path.join(CERT_DIR, "fake_broker.crt"),
+        keyfile=os.path.join(CERT_DIR, "fake_broker.key"),
+    )
+
+    with broker:
+        yield broker
@@ -1,8 +1,9 @@
-from typing import Iterator
+from typing import Callable, Iterator
 import pytest
 import itertools
 
 from mqttwrapper import mqtt_client, mqtt_config
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
 
 # Create all parameters combinations.
 host = ["127.0.0.1"]
@@ -53,4 +54,40 @@ def client(request, caplog, pytestconfig):
 
     client = mqtt_client.MqttClient(config)
 
-    return client
+    yield client
+
+    # Tests leave their client connected, free the connection for the next one
+    client.stop()
+
+
+@pytest.fixture
+def broker_client() -> Iterator[Callable[..., mqtt_client.MqttClient]]:
+    """broker_client Factory for clients of an MqttFakeBroker, every client is stopped on teardown
+
+    broker_client(broker, protocol="5", keepalive=10) returns a started client,
+    pass start=False to configure or start it in the test. Stopping clients in the test,
+    while the broker still runs, keeps teardown quick, it only has to catch the clients a
+    failing test left running.
+    """
+    clients = []
+
+    def make_client(
+        broker: MqttFakeBroker, protocol: str = "3.1.1", start: bool = True, **config
+    ) -> mqtt_client.MqttClient:
+        client = mqtt_client.MqttClient(
+            mqtt_config.MqttConfig(
+                host=broker.host,
+                port=broker.listeners[0].port,
+                protocol=protocol,
+                **config,
+            )
+        )
+        clients.append(client)
+        if start:
+            client.start(timeout=1)
+        return client
+
+    yield make_client
+
+    for client in clients:
+        client.stop()
@@ -0,0 +1,58 @@
+from .fixtures import client, broker_client
+from mqttwrapper.mqtt_async_client import AsyncMqttClient
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_offline_queue import MqttOfflineQueuePolicy
+
+import asyncio
+
+
+def test_async_client(caplog, client):
+    caplog.set_level("DEBUG")
+
+    topic = "test_async_client"
+
+    async def run():
+        async_client = AsyncMqttClient.from_client(client)
+
+        assert await async_client.start(timeout=1), "Did not connect"
+
+        subscription = await async_client.subscribe(topic, timeout=1)
+        assert subscription.is_active(), "Did not receive SUBACK"
+
+        pub_message = await async_client.publish(topic, b"async", timeout=1)
+        assert pub_message.is_communicated(), "Did not receive PUBACK"
+
+        sub_message = await asyncio.wait_for(subscription.__anext__(), 1)
+        assert pub_message == sub_message
+
+        subscription.close()
+        await async_client.unsubscribe(topic, timeout=1)
+        assert await async_client.stop(timeout=1), "Did not disconnect"
+
+    asyncio.run(run())
+
+
+def test_async_client_stop_closes_offline_queue(caplog, broker_client, tmp_path):
+    caplog.set_level("INFO")
+
+    topic = "test_async_client_stop"
+    policy = MqttOfflineQueuePolicy(directory=str(tmp_path))
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(broker, start=False, offline_queue=policy)
+        message = client.publish(topic, b"offline")
+        assert message.queued
+
+        async def run():
+            async_client = AsyncMqttClient.from_client(client)
+
+            assert await async_client.start(timeout=1), "Did not connect"
+            assert await async_client.wait_for(lambda: len(client.offline_queue) == 0, 2)
+            assert await async_client.stop(timeout=1), "Did not disconnect"
+
+        asyncio.run(run())
+
+        # Segment files are closed and the head written, the replayed record is not sent again
+        assert client.offline_queue._tail is None
+        restarted = broker_client(broker, start=False, offline_queue=policy)
+        assert len(restarted.offline_queue) == 0
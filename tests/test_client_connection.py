@@ -1,6 +1,11 @@
-from .fixtures import client
+from .fixtures import client, broker_client
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.helper import wait, Backoff
+
 import time
 
+import pytest
+
 
 def test_client_connection(caplog, client):
     caplog.set_level("DEBUG")
@@ -12,3 +17,57 @@ def test_client_connection(caplog, client):
         exception = e
 
     assert client.is_connected(), f"{exception=} Make sure you have a broker running."
+
+
+def test_backoff():
+    backoff = Backoff(min_delay=1, max_delay=10, jitter=0.5, random=lambda: 1.0)
+    assert [backoff.next_delay() for _ in range(6)] == [0.5, 1, 2, 4, 5, 5]
+
+    backoff.reset()
+    assert backoff.next_delay() == 0.5
+
+    backoff = Backoff(min_delay=1, max_delay=10, jitter=0)
+    assert [backoff.next_delay() for _ in range(3)] == [1, 2, 4]
+
+    with pytest.raises(ValueError):
+        Backoff(jitter=2)
+
+
+@pytest.mark.parametrize("protocol", ["3.1.1", "5"])
+def test_client_reconnect(caplog, broker_client, protocol):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(
+            broker,
+            protocol,
+            reconnect_min_delay=0.05,
+            reconnect_max_delay=0.2,
+            subscribe_batch_size=2,
+        )
+        assert client.is_connected()
+
+        topics = ["reconnect/a", "reconnect/b", "reconnect/c"]
+        subscriptions = [client.subscribe(topic) for topic in topics]
+        assert all(subscription.wait_for_active(1) for subscription in subscriptions)
+
+        broker.disconnect_clients()
+
+        metrics = client.metrics
+        assert wait(
+            condition=lambda: metrics.get("mqtt_outage_seconds").histogram.total_count == 1,
+            timeout=5,
+        ), "Subscriptions were not restored"
+        assert metrics.get("mqtt_reconnects_total").value == 1
+        assert metrics.get("mqtt_reconnect_seconds").histogram.total_count == 1
+        assert all(subscription.is_active() for subscription in subscriptions)
+
+        # Restored with batched SUBSCRIBEs, two topics in the first
+        assert subscriptions[0].mid == subscriptions[1].mid
+        assert subscriptions[2].mid != subscriptions[0].mid
+
+        client.publish("reconnect/c", b"back").wait_for_communication(1)
+        wait(condition=lambda: subscriptions[2].total_message_count == 1, timeout=1)
+        assert subscriptions[2].messages[-1].payload == b"back"
+
+        client.stop()
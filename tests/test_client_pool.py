@@ -0,0 +1,49 @@
+from .fixtures import client
+from mqttwrapper.mqtt_client_pool import MqttClientPool
+from mqttwrapper.helper import wait
+
+
+def test_client_pool(caplog, client):
+    caplog.set_level("INFO")
+
+    pool = MqttClientPool(client.config, size=3)
+    assert pool.start(timeout=2), "Not all pool clients connected"
+    assert pool.connected_count == 3
+
+    topic = "test_client_pool"
+    count = 10
+
+    group = pool.subscribe(topic)
+    assert group.wait_for_active(1), "Subscription did not activate"
+
+    publisher = pool.client_for_topic(topic)
+    messages = [pool.publish(topic, i) for i in range(count)]
+    assert all(message.userdata.client is publisher for message in messages)
+
+    assert wait(condition=lambda: group.total_message_count == count, timeout=2)
+    assert [message.payload for message in group.messages] == [
+        str(i).encode("utf-8") for i in range(count)
+    ], "Per topic order not kept"
+
+    pool.stop()
+
+
+def test_client_pool_shared(caplog, client):
+    caplog.set_level("INFO")
+
+    pool = MqttClientPool(client.config, size=3, sharding="round_robin")
+    assert pool.start(timeout=2), "Not all pool clients connected"
+
+    topic = "test_client_pool_shared"
+    count = 30
+
+    group = pool.subscribe(topic, share_group="pool")
+    assert group.wait_for_active(1), "Shared subscription did not activate"
+
+    for i in range(count):
+        pool.publish(topic, i).wait_for_communication()
+
+    assert wait(condition=lambda: group.total_message_count == count, timeout=2)
+    assert sorted(int(message.payload) for message in group.messages) == list(range(count))
+
+    pool.stop()
@@ -0,0 +1,159 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_message import MqttReceivedMessage
+from mqttwrapper.mqtt_message_store import MqttRetentionPolicy
+from mqttwrapper.mqtt_serializer import MqttStructSerializer
+from mqttwrapper.helper import wait
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from mqttwrapper.mqtt_columnar_store import MqttColumnarMessageStore
+
+
+def message(topic: str, payload: bytes, timestamp_ns: int = None, qos: int = 1):
+    message = MqttReceivedMessage(topic, payload, qos, False, mid=1)
+    if timestamp_ns is not None:
+        message._timestamp_ns = timestamp_ns
+    return message
+
+
+def test_columnar_store_limits():
+    store = MqttColumnarMessageStore(MqttRetentionPolicy(max_count=3))
+    for i in range(20):
+        store.append(message(f"columnar/{i % 2}", str(i).encode("utf-8")))
+
+    assert [m.payload for m in store] == [b"17", b"18", b"19"], "Did not keep the newest messages"
+    assert store[-1].topic == "columnar/1" and store[0].mid == 1
+    assert store.total_count == 20 and store.evicted_count == 17
+    assert store.byte_count == 6
+
+    store = MqttColumnarMessageStore(MqttRetentionPolicy(max_bytes=10))
+    for i in range(5):
+        store.append(message("columnar", b"1234"))
+
+    assert len(store) == 2 and store.byte_count == 8, "Byte budget not respected"
+
+    store = MqttColumnarMessageStore(MqttRetentionPolicy(max_age=1))
+    store.append(message("columnar", b"old", timestamp_ns=1))
+    store.append(message("columnar", b"new"))
+
+    assert store[-1].payload == b"new" and len(store) == 1, "Expired message kept"
+
+    with pytest.raises(IndexError):
+        store[1]
+
+
+def test_columnar_store_grows():
+    store = MqttColumnarMessageStore()
+    payload = b"x" * 100
+    for i in range(5000):
+        store.append(message("columnar", payload, timestamp_ns=i))
+
+    assert len(store) == 5000 and store.byte_count == 500000
+    assert store[4999].timestamp_ns == 4999 and store[4999].payload == payload
+
+    store.clear()
+    assert len(store) == 0 and store.evicted_count == 5000
+
+
+def test_columnar_store_exports():
+    store = MqttColumnarMessageStore(MqttRetentionPolicy(max_count=4))
+    for i in range(6):
+        store.append(message(f"columnar/{i % 2}", b"p" * i, timestamp_ns=i * 1000, qos=i % 3))
+
+    columns = store.to_numpy()
+    assert columns["timestamp_ns"].tolist() == [2000, 3000, 4000, 5000]
+    assert columns["qos"].tolist() == [2, 0, 1, 2]
+    assert columns["length"].tolist() == [2, 3, 4, 5]
+    assert columns["offsets"].tolist() == [0, 2, 5, 9, 14]
+    assert columns["payloads"].tobytes() == b"p" * 14
+    assert columns["topics"][columns["topic_id"]].tolist() == [
+        "columnar/0",
+        "columnar/1",
+        "columnar/0",
+        "columnar/1",
+    ]
+
+
+def test_columnar_store_to_arrow():
+    pytest.importorskip("pyarrow")
+
+    store = MqttColumnarMessageStore()
+    store.append(message("columnar/a", b"one"))
+    store.append(message("columnar/b", b""))
+
+    table = store.to_arrow()
+    assert table.column("payload").to_pylist() == [b"one", b""]
+    assert table.column("topic").to_pylist() == ["columnar/a", "columnar/b"]
+    assert table.num_rows == 2
+
+
+def test_columnar_store_queries():
+    store = MqttColumnarMessageStore()
+    second = 1_000_000_000
+    # 10 messages 0.1 s apart, then 5 messages 0.5 s apart
+    timestamps = [i * second // 10 for i in range(10)] + [
+        second + i * second // 2 for i in range(5)
+    ]
+    for timestamp_ns in timestamps:
+        store.append(message("columnar", b"1234", timestamp_ns=timestamp_ns))
+
+    now_ns = timestamps[-1]
+    assert store.rate(1, now_ns=now_ns) == 3, "Messages in [now - 1s, now]"
+    assert store.byte_rate(1, now_ns=now_ns) == 12
+    assert store.rates(1).tolist() == [10, 2, 2, 1]
+
+    stats = store.inter_arrival_stats()
+    assert stats["count"] == 14
+    assert stats["min"] == pytest.approx(0.1)
+    assert stats["max"] == pytest.approx(0.5)
+
+    assert MqttColumnarMessageStore().inter_arrival_stats() == {"count": 0}
+
+
+def test_columnar_store_to_records():
+    schema = MqttStructSerializer("reading", [("sensor", "H"), ("value", "d")])
+    store = MqttColumnarMessageStore()
+    for i in range(10):
+        store.append(message("columnar", schema.dumps((i, i / 2))))
+
+    records = store.to_records(schema)
+    assert records["sensor"].tolist() == list(range(10))
+    assert records["value"][-1] == 4.5
+
+    store.append(message("columnar", b"short"))
+    with pytest.raises(ValueError):
+        store.to_records(schema)
+
+
+def test_columnar_subscription(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(
+            broker, retention=MqttRetentionPolicy(max_count=50, columnar=True)
+        )
+
+        subscription = client.subscribe("columnar/#", qos=1)
+        assert subscription.wait_for_active(1)
+        assert isinstance(subscription.messages, MqttColumnarMessageStore)
+
+        client.publish_many((f"columnar/{i}", f"{i}") for i in range(100)).wait_all(2)
+        assert wait(condition=lambda: subscription.total_message_count == 100, timeout=2)
+
+        assert len(subscription.messages) == 50
+        assert subscription.messages[-1].payload == b"99"
+        assert subscription.messages[-1].subscription is subscription
+        assert subscription.messages.to_numpy()["length"].sum() == sum(
+            len(str(i)) for i in range(50, 100)
+        )
+
+        client.stop()
+
+    with pytest.raises(ValueError):
+        MqttConfig(
+            host="127.0.0.1", port=1883, sent_retention=MqttRetentionPolicy(columnar=True)
+        )
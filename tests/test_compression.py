@@ -0,0 +1,186 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_compression import (
+    MqttCompression,
+    MqttCompressionPolicy,
+    CODECS,
+    GZIP,
+    LZMA,
+    ZLIB,
+)
+from mqttwrapper.helper import wait
+
+import json
+
+import pytest
+
+TELEMETRY = json.dumps(
+    [{"device": f"sensor-{i}", "temperature": 21.5, "humidity": 40} for i in range(50)]
+).encode("utf-8")
+
+
+@pytest.mark.parametrize("codec", list(CODECS))
+@pytest.mark.parametrize("framed", [False, True])
+def test_compression_round_trip(codec, framed):
+    compression = MqttCompression([MqttCompressionPolicy(codec=codec)], framed=framed)
+
+    payload, encoding = compression.encode("telemetry", TELEMETRY)
+    assert encoding == codec
+    assert len(payload) < len(TELEMETRY)
+    assert compression.decode("telemetry", payload, encoding) == TELEMETRY
+
+    # Under min_size, framed payloads still get the uncompressed marker
+    payload, encoding = compression.encode("telemetry", b"{}")
+    assert encoding is None
+    assert payload == (b"\x00{}" if framed else b"{}")
+    assert compression.decode("telemetry", payload, encoding) == b"{}"
+
+    stats = compression.stats
+    assert stats.compressed_count == 1 and stats.skipped_count == 1
+    assert stats.decompressed_count == 1
+    assert 0 < stats.ratio < 1
+
+
+def test_compression_policies():
+    compression = MqttCompression(
+        [
+            MqttCompressionPolicy(codec=LZMA, topic_prefix="telemetry/bulk/"),
+            MqttCompressionPolicy(codec=GZIP, topic_prefix="telemetry/", min_size=0),
+        ]
+    )
+
+    assert compression.encode("telemetry/bulk/1", TELEMETRY)[1] == LZMA
+    assert compression.encode("telemetry/1", TELEMETRY)[1] == GZIP
+    assert compression.encode("commands/1", TELEMETRY) == (TELEMETRY, None)
+
+    # Random bytes do not get smaller, sent as they are
+    assert compression.encode("telemetry/1", bytes(range(256)))[1] is None
+
+    # Broken payloads are delivered as received
+    assert compression.decode("telemetry/1", b"not gzip", GZIP) == b"not gzip"
+    assert compression.stats.failed_count == 1
+
+    with pytest.raises(ValueError):
+        MqttConfig(
+            host="127.0.0.1", port=1883, compression=[MqttCompressionPolicy(codec="brotli")]
+        )
+
+
+@pytest.mark.parametrize("protocol", ["5", "3.1.1"])
+def test_compression_publish_and_receive(caplog, broker_client, protocol):
+    caplog.set_level("INFO")
+    policies = [MqttCompressionPolicy(topic_prefix="compress/telemetry/")]
+
+    with MqttFakeBroker() as broker:
+        # Over MQTTv5 the receiver learns the codec from the message
+        receiver = broker_client(
+            broker,
+            protocol,
+            compression=policies if protocol != "5" else None,
+            decompress_received=protocol == "5",
+        )
+        subscription = receiver.subscribe("compress/#", qos=1)
+        assert subscription.wait_for_active(1)
+
+        client = broker_client(broker, protocol, compression=policies)
+        messages = [
+            client.publish("compress/telemetry/1", TELEMETRY),
+            client.publish("compress/telemetry/2", "small"),
+            client.publish("compress/other", TELEMETRY),
+        ]
+        assert all(message.wait_for_communication(1) for message in messages)
+
+        assert wait(condition=lambda: subscription.total_message_count == 3, timeout=2)
+        received = sorted(subscription.messages, key=lambda message: message.topic)
+        assert [message.payload for message in received] == [TELEMETRY, TELEMETRY, b"small"]
+
+        # Sent messages keep the payload given to publish
+        assert messages[0].payload == TELEMETRY
+
+        stats = client.compression.stats
+        assert stats.compressed_count == 1 and stats.skipped_count == 1
+        snapshot = client.metrics.snapshot()
+        assert snapshot["mqtt_compressed_messages_total"] == 1
+        assert snapshot["mqtt_compression_ratio"] == stats.ratio < 1
+        assert snapshot["mqtt_published_bytes_total"] < 2 * len(TELEMETRY)
+
+        assert receiver.compression.stats.decompressed_count == 1
+
+        client.stop()
+        receiver.stop()
+
+
+@pytest.mark.parametrize("codec", list(CODECS))
+@pytest.mark.parametrize("framed", [False, True])
+def test_compression_max_decompressed_size(caplog, codec, framed):
+    caplog.set_level("CRITICAL")
+    compression = MqttCompression(
+        [MqttCompressionPolicy(codec=codec)], framed=framed, max_decompressed_size=1000
+    )
+
+    # Compresses to a few hundred bytes at most
+    bomb, encoding = compression.encode("telemetry", bytes(100_000))
+    assert len(bomb) < 1000
+    assert compression.decode("telemetry", bomb, encoding) == bomb
+    assert compression.stats.failed_count == 1 and compression.stats.decompressed_count == 0
+
+    payload, encoding = compression.encode("telemetry", b"a" * 1000)
+    assert compression.decode("telemetry", payload, encoding) == b"a" * 1000
+
+    # Truncated streams fail as with the unbounded decompressors
+    assert compression.decode("telemetry", payload[:-4], encoding) == payload[:-4]
+    assert compression.stats.failed_count == 2
+
+    with pytest.raises(ValueError):
+        MqttConfig(host="127.0.0.1", port=1883, max_decompressed_size=0)
+
+
+def test_compression_receive_opt_in(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        # MQTTv5 without policies and without decompress_received
+        receiver = broker_client(broker, "5")
+        subscription = receiver.subscribe("compress/#", qos=1)
+        assert subscription.wait_for_active(1)
+
+        client = broker_client(broker, "5", compression=[MqttCompressionPolicy()])
+        assert client.publish("compress/telemetry", TELEMETRY).wait_for_communication(1)
+
+        assert wait(condition=lambda: subscription.total_message_count == 1, timeout=2)
+        assert subscription.messages[0].payload == CODECS[ZLIB].compress(TELEMETRY, None)
+        assert receiver.compression.stats.decompressed_count == 0
+
+        client.stop()
+        receiver.stop()
+
+
+def test_compression_with_topic_alias(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker(latency=0.1) as broker:
+        receiver = broker_client(
+            broker, "5", topic_alias_receive_maximum=5, decompress_received=True
+        )
+        subscription = receiver.subscribe("compress/alias", qos=1)
+        assert subscription.wait_for_active(1)
+
+        client = broker_client(broker, "5", compression=[MqttCompressionPolicy()])
+        assert wait(condition=lambda: client.topic_aliases.maximum > 0, timeout=1)
+
+        client.publish("compress/alias", TELEMETRY)
+        message = client.publish("compress/alias", TELEMETRY)
+
+        # The copy paho keeps for a resend has the topic and codec, not the alias
+        paho_message = client._paho_client._out_messages[message.mid]
+        assert paho_message.topic == "compress/alias"
+        assert not hasattr(paho_message.properties, "TopicAlias")
+        assert paho_message.properties.UserProperty == [("content-encoding", "zlib")]
+
+        assert message.wait_for_communication(2)
+        assert wait(condition=lambda: subscription.total_message_count == 2, timeout=2)
+        assert all(message.payload == TELEMETRY for message in subscription.messages)
+
+        client.stop()
+        receiver.stop()
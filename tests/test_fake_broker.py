@@ -0,0 +1,84 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_probe import MqttLatencyProbe
+from mqttwrapper.helper import wait
+
+import pytest
+
+
+@pytest.mark.parametrize("protocol", ["3.1.1", "5"])
+def test_fake_broker_retain_and_wildcards(caplog, broker_client, protocol):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(broker, protocol)
+        assert client.is_connected()
+
+        client.publish("fake/retained", "kept", qos=2, retain=True).wait_for_communication()
+
+        subscription = client.subscribe("fake/#", qos=2)
+        assert subscription.wait_for_active(1)
+        wait(condition=lambda: subscription.total_message_count == 1, timeout=1)
+        assert subscription.messages[0].payload == b"kept"
+        assert subscription.messages[0].retain
+
+        client.publish("fake/a/b", "live", qos=1).wait_for_communication()
+        wait(condition=lambda: subscription.total_message_count == 2, timeout=1)
+        assert subscription.messages[-1].payload == b"live"
+        assert not subscription.messages[-1].retain
+
+        client.publish("fake/retained", "", retain=True).wait_for_communication()
+        wait(condition=lambda: "fake/retained" not in broker.retained, timeout=1)
+        assert "fake/retained" not in broker.retained
+
+        client.stop()
+
+
+def test_fake_broker_authentication(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker(username="admin", password="testing") as broker:
+        client = broker_client(broker, username="admin", password="wrong")
+        assert not client.is_connected(), "Connected with the wrong password"
+        client.stop()
+
+        client = broker_client(broker, username="admin", password="testing")
+        assert client.is_connected()
+        client.stop()
+
+
+def test_fake_broker_shared_subscription(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        clients = [broker_client(broker) for _ in range(2)]
+        subscriptions = [client.subscribe("$share/group/fake/shared") for client in clients]
+        assert all(subscription.wait_for_active(1) for subscription in subscriptions)
+
+        clients[0].publish_many(("fake/shared", i) for i in range(10)).wait_all(1)
+        wait(
+            condition=lambda: sum(s.total_message_count for s in subscriptions) == 10,
+            timeout=1,
+        )
+        assert [s.total_message_count for s in subscriptions] == [5, 5]
+
+        for client in clients:
+            client.stop()
+
+
+def test_fake_broker_latency_and_loss(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker(latency=0.05, loss=0.5, seed=1) as broker:
+        client = broker_client(broker)
+
+        probe = MqttLatencyProbe(client, "fake/probe", qos=1, loss_timeout=0.5)
+        assert probe.subscription.wait_for_active(1)
+
+        report = probe.run(40)
+        probe.close()
+        client.stop()
+
+    assert report.lost_count == broker.dropped_count > 0
+    assert report.received_count + report.lost_count == 40
+    assert report.receive_latency.min >= 0.05 * 10**9, "Latency not injected"
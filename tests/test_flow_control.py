@@ -0,0 +1,148 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_flow_control import MqttRateLimit, MqttTokenBucket, REJECT, QUEUE
+from mqttwrapper.helper import wait
+
+import time
+
+import pytest
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = MqttTokenBucket(rate=10, burst=2, clock=lambda: now[0])
+
+    assert bucket.delay() == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.1)
+
+    # Goes into debt, the next waiter is served after this one
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.delay() == pytest.approx(0.2)
+
+    now[0] = 1.0
+    assert bucket.delay() == 0, "Not refilled"
+    assert bucket._tokens == 2, "Refilled past burst"
+
+    with pytest.raises(ValueError):
+        MqttTokenBucket(rate=0)
+
+
+def test_flow_control_reject(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(
+            broker, rate_limits=[MqttRateLimit(rate=1, burst=2)], flow_control=REJECT
+        )
+
+        messages = [client.publish("flow/reject", f"{i}") for i in range(5)]
+        assert [message.is_failed() for message in messages] == [False, False, True, True, True]
+
+        stats = client.flow_control.stats
+        assert stats.sent_count == 2 and stats.rejected_count == 3
+        assert client.metrics.snapshot()["mqtt_flow_control_rejected_total"] == 3
+
+        client.stop()
+
+    with pytest.raises(ValueError):
+        MqttConfig(host="127.0.0.1", port=1883, flow_control="drop")
+
+
+def test_flow_control_queue(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(
+            broker, rate_limits=[MqttRateLimit(rate=50, burst=1)], flow_control=QUEUE
+        )
+        subscription = client.subscribe("flow/queue")
+        assert subscription.wait_for_active(1)
+
+        start = time.monotonic()
+        messages = [client.publish("flow/queue", f"{i}") for i in range(10)]
+        assert messages[0].is_communicated() or not messages[0].queued
+        assert all(message.queued for message in messages[1:])
+
+        assert all(message.wait_for_communication(2) for message in messages)
+        assert time.monotonic() - start >= 0.15, "Not rate limited"
+
+        wait(condition=lambda: subscription.total_message_count == 10, timeout=1)
+        assert [message.payload for message in subscription.messages] == [
+            f"{i}".encode("utf-8") for i in range(10)
+        ], "Queued messages sent out of order"
+
+        stats = client.flow_control.stats
+        assert stats.queued_count == 9 and stats.throttled_count == 9
+        assert stats.send_rate > 0
+
+        client.stop()
+
+
+def test_flow_control_queue_stop(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        receiver = broker_client(broker)
+        subscription = receiver.subscribe("flow/stop")
+        assert subscription.wait_for_active(1)
+
+        client = broker_client(
+            broker, rate_limits=[MqttRateLimit(rate=2, burst=1)], flow_control=QUEUE
+        )
+        messages = [client.publish("flow/stop", f"{i}") for i in range(5)]
+        assert all(message.queued for message in messages[1:])
+
+        # The drain thread sleeps for the token of the second message meanwhile
+        client.stop()
+        assert all(message.is_failed() and not message.queued for message in messages[1:])
+        assert client.flow_control.stats.rejected_count == 4
+
+        time.sleep(1)
+        assert subscription.total_message_count == 1, "Queued message sent after stop"
+
+        receiver.stop()
+
+
+def test_flow_control_topic_prefix(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(
+            broker, rate_limits=[MqttRateLimit(rate=20, burst=1, topic_prefix="flow/limited/")]
+        )
+
+        start = time.monotonic()
+        for i in range(5):
+            client.publish("flow/free", f"{i}")
+        assert time.monotonic() - start < 0.1, "Topic outside the prefix was limited"
+
+        start = time.monotonic()
+        for i in range(5):
+            client.publish("flow/limited/a", f"{i}")
+        assert time.monotonic() - start >= 0.15, "Blocking mode did not block"
+        assert client.flow_control.stats.throttled_count == 4
+
+        client.stop()
+
+
+def test_flow_control_receive_maximum(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker(receive_maximum=3, topic_alias_maximum=7) as broker:
+        client = broker_client(broker, protocol="5")
+        # is_connected() turns True just before on_connect runs
+        assert wait(condition=lambda: client.inflight_window == 3, timeout=1)
+        assert client.topic_alias_maximum == 7
+
+        batch = client.publish_many(("flow/receive_maximum", f"{i}") for i in range(20))
+        assert batch.wait_all(2) and len(batch.completed) == 20
+
+        client.stop()
+
+        client = broker_client(broker, protocol="3.1.1")
+        assert client.inflight_window == client.config.max_inflight_messages
+        assert client.topic_alias_maximum == 0
+        client.stop()
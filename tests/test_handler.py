@@ -0,0 +1,112 @@
+from .fixtures import client
+from mqttwrapper.mqtt_client import MqttClient
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_message import MqttReceivedMessage
+from mqttwrapper.helper import wait
+
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+
+
+def payload_length(message):
+    return len(message.payload)
+
+
+def offline_subscription(topic: str):
+    """offline_subscription Subscription on a client that is never started, messages are fed to handlers directly"""
+    client = MqttClient(MqttConfig(host="127.0.0.1", port=1883))
+    return client, client.subscribe(topic)
+
+
+def test_handlers(caplog, client):
+    caplog.set_level("INFO")
+
+    client.start(timeout=1)
+
+    topic = "test_handlers"
+    count = 20
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    handled = []
+    lock = threading.Lock()
+
+    def slow_handler(message):
+        time.sleep(0.01)
+        with lock:
+            handled.append(message.payload)
+
+    ordered = subscription.add_handler(slow_handler, executor="thread", ordered=True)
+    process = subscription.add_handler(payload_length, executor="process")
+
+    client.publish_many(((topic, i) for i in range(count))).wait_all(1)
+
+    assert wait(
+        condition=lambda: ordered.stats.completed_count == count
+        and process.stats.completed_count == count,
+        timeout=5,
+    ), f"Handlers did not complete: '{ordered.stats=}', '{process.stats=}'"
+
+    assert handled == [str(i).encode("utf-8") for i in range(count)], "Order not kept"
+    assert ordered.stats.queue_depth == 0 and ordered.stats.failed_count == 0
+    assert ordered.stats.latency_max_ns >= 10_000_000, "Latency not measured"
+
+    client.shutdown_executors()
+
+
+def test_handler_executor_shut_down(caplog):
+    caplog.set_level("CRITICAL")
+
+    client, subscription = offline_subscription("test_handler_executor_shut_down")
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_handler(message):
+        started.set()
+        release.wait(5)
+
+    handler = subscription.add_handler(blocking_handler, executor="thread", ordered=True)
+
+    # One message runs, the rest wait in the backlog of the topic
+    count = 3000
+    for i in range(count):
+        handler(MqttReceivedMessage(subscription.topic, str(i).encode("utf-8"), 1, False))
+    assert started.wait(1)
+
+    client.shutdown_executors(wait=False)
+    release.set()
+
+    # The backlog is dropped one by one, not recursively
+    assert wait(condition=lambda: handler.stats.queue_depth == 0, timeout=5), f"{handler.stats=}"
+    assert handler.stats.completed_count == 1 and handler.stats.failed_count == count - 1
+    assert not handler._backlogs
+
+
+def test_handler_cancelled(caplog):
+    caplog.set_level("CRITICAL")
+
+    client, subscription = offline_subscription("test_handler_cancelled")
+
+    handler = subscription.add_handler(payload_length, executor="thread", ordered=True)
+    first = MqttReceivedMessage(subscription.topic, b"first", 1, False)
+    second = MqttReceivedMessage(subscription.topic, b"second", 1, False)
+
+    # The first message is still being handled, the second waits for it
+    handler.stats.submitted()
+    handler._backlogs[subscription.topic] = deque()
+    handler(second)
+
+    future = Future()
+    future.cancel()
+    handler._future_done(first, future)
+
+    # The cancelled message does not stall the topic
+    assert wait(condition=lambda: handler.stats.queue_depth == 0, timeout=2), f"{handler.stats=}"
+    assert handler.stats.failed_count == 1 and handler.stats.completed_count == 1
+    assert not handler._backlogs
+
+    client.shutdown_executors()
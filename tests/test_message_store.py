@@ -0,0 +1,59 @@
+from .fixtures import client
+from mqttwrapper.mqtt_message_store import MqttMessageStore, MqttRetentionPolicy
+
+from types import SimpleNamespace
+from time import time_ns
+
+
+def message(payload: bytes, age: float = 0):
+    return SimpleNamespace(
+        payload=payload, timestamp_ns=time_ns() - int(age * 1e9)
+    )
+
+
+def test_store_limits():
+    store = MqttMessageStore(MqttRetentionPolicy(max_count=2))
+    for i in range(5):
+        store.append(message(str(i).encode("utf-8")))
+
+    assert [m.payload for m in store] == [b"3", b"4"], "Did not keep the newest messages"
+    assert store.total_count == 5 and store.evicted_count == 3
+
+    store = MqttMessageStore(MqttRetentionPolicy(max_bytes=10))
+    for i in range(5):
+        store.append(message(b"1234"))
+
+    assert len(store) == 2 and store.byte_count == 8, "Byte budget not respected"
+
+    store = MqttMessageStore(MqttRetentionPolicy(max_age=1))
+    store.append(message(b"old", age=2))
+    store.append(message(b"new"))
+
+    assert store[-1].payload == b"new" and len(store) == 1, "Expired message kept"
+
+    store = MqttMessageStore(MqttRetentionPolicy.count_only())
+    store.append(message(b"1"))
+
+    assert len(store) == 0 and store.total_count == 1 and store.evicted_count == 1
+
+
+def test_subscription_retention(caplog, client):
+    caplog.set_level("DEBUG")
+
+    client.config.retention = MqttRetentionPolicy(max_count=1)
+    client.start(timeout=1)
+
+    topic = "test_subscription_retention"
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    for i in range(3):
+        client.publish(topic=topic, payload=i).wait_for_communication()
+        subscription.wait_for_message(1)
+
+    assert subscription.total_message_count == 3, "Expected exactly 3 messages to be received"
+    assert subscription.evicted_message_count == 2, "Expected 2 messages to be evicted"
+    assert subscription.messages[-1].payload == b"2", "Last message not retained"
+    assert client.userdata.sent_messages.total_count == 3
+    assert len(client.userdata.sent_messages) == 0, "Sent messages saved while disabled"
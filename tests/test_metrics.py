@@ -0,0 +1,76 @@
+from .fixtures import client
+from mqttwrapper.mqtt_metrics import MqttMetrics
+from mqttwrapper.helper import wait
+
+from urllib.request import urlopen
+
+import pytest
+
+
+def test_metrics_registry():
+    metrics = MqttMetrics(labels={"client_id": 'a"b'})
+
+    counter = metrics.counter("test_total", "Test counter")
+    counter.inc()
+    counter.inc(2)
+    assert metrics.counter("test_total") is counter, "Same name gave a new counter"
+    with pytest.raises(ValueError):
+        metrics.gauge("test_total")
+
+    metrics.gauge("test_gauge", "Test gauge", lambda: 7)
+    timer = metrics.timer("test_seconds", "Test timer")
+    timer.record(2 * 10**6)
+
+    exported = []
+    metrics.add_exporter(exported.append)
+    metrics.export()
+    assert exported == [metrics]
+
+    snapshot = metrics.snapshot()
+    assert snapshot["test_total"] == 3
+    assert snapshot["test_gauge"] == 7
+
+    text = metrics.to_prometheus()
+    assert "# TYPE test_total counter" in text
+    assert 'test_total{client_id="a\\"b"} 3' in text
+    assert 'test_gauge{client_id="a\\"b"} 7' in text
+    assert "# TYPE test_seconds summary" in text
+    assert 'test_seconds_count{client_id="a\\"b"} 1' in text
+    assert 'test_seconds{client_id="a\\"b",quantile="0.5"} 0.002' in text
+
+
+def test_client_metrics(caplog, client):
+    caplog.set_level("INFO")
+
+    client.start(timeout=1)
+
+    topic = "test_client_metrics"
+    count = 10
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    client.publish_many((topic, "payload") for _ in range(count)).wait_all(1)
+    wait(condition=lambda: subscription.total_message_count == count, timeout=1)
+
+    snapshot = client.metrics.snapshot()
+    assert snapshot["mqtt_messages_published_total"] == count
+    assert snapshot["mqtt_published_bytes_total"] == count * len("payload")
+    assert snapshot["mqtt_messages_acked_total"] == count
+    assert snapshot["mqtt_messages_received_total"] == count
+    assert snapshot["mqtt_received_bytes_total"] == count * len("payload")
+    assert snapshot["mqtt_active_subscriptions"] == 1
+    assert snapshot["mqtt_connected"] == 1
+    assert client.metrics.get("mqtt_ack_latency_seconds").histogram.total_count == count
+
+    server = client.metrics.serve(port=0, host="127.0.0.1")
+    try:
+        with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+
+    assert (
+        f'mqtt_messages_received_total{{client_id="{client.config.client_id}"}} {count}'
+        in text
+    )
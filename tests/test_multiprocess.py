@@ -0,0 +1,62 @@
+from .fixtures import client
+from mqttwrapper.mqtt_multiprocess import MqttProcessSupervisor, resolve_handler
+from mqttwrapper.helper import wait
+
+import os
+
+import pytest
+
+
+def crash_on_payload(message):
+    if message.payload == b"crash":
+        os._exit(1)
+
+
+def count_payload(message):
+    return len(message.payload)
+
+
+def test_process_supervisor(caplog, client):
+    caplog.set_level("INFO")
+
+    client.start(timeout=1)
+
+    topic = "test_process_supervisor"
+    count = 20
+
+    supervisor = MqttProcessSupervisor(client.config, topic, workers=2)
+    supervisor.add_handler(crash_on_payload)
+    supervisor.add_handler("tests.test_multiprocess:count_payload")
+    supervisor.start()
+
+    try:
+        assert wait(
+            condition=lambda: supervisor.stats().connected == 2, timeout=5
+        ), "Workers did not subscribe"
+
+        client.publish_many((topic, i) for i in range(count)).wait_all(1)
+
+        assert wait(
+            condition=lambda: supervisor.stats().message_count == count, timeout=5
+        ), f"Messages not received by workers: '{supervisor.worker_stats()}'"
+
+        client.publish(topic, "crash").wait_for_communication()
+
+        assert wait(
+            condition=lambda: supervisor.stats().restart_count == 1
+            and supervisor.stats().connected == 2,
+            timeout=5,
+        ), f"Crashed worker not restarted: '{supervisor.worker_stats()}'"
+    finally:
+        supervisor.stop()
+
+    assert not supervisor.is_running()
+
+
+def test_resolve_handler():
+    assert resolve_handler("tests.test_multiprocess:crash_on_payload") is crash_on_payload
+    assert resolve_handler("os.path.join") is os.path.join
+    assert resolve_handler(count_payload) is count_payload
+
+    with pytest.raises(ValueError):
+        resolve_handler("crash_on_payload")
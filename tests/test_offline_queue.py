@@ -0,0 +1,152 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_client import MqttClient
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_offline_queue import MqttOfflineQueuePolicy, SEGMENT_SUFFIX
+from mqttwrapper.mqtt_stream import DROP_NEWEST
+from mqttwrapper.helper import wait
+
+import os
+
+import pytest
+
+
+def offline_client(policy: MqttOfflineQueuePolicy) -> MqttClient:
+    """offline_client Client that is never started, every publish goes to the offline queue"""
+    return MqttClient(MqttConfig(host="127.0.0.1", port=1883, offline_queue=policy))
+
+
+def test_offline_queue_replay_after_restart(caplog, broker_client, tmp_path):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        policy = MqttOfflineQueuePolicy(directory=str(tmp_path), segment_bytes=200)
+
+        # Never connected, every publish is captured
+        client = broker_client(broker, start=False, offline_queue=policy)
+        messages = [client.publish("offline/replay", f"{i}", qos=i % 2) for i in range(20)]
+        assert len(client.offline_queue) == 20
+        assert all(message.queued and not message.is_failed() for message in messages)
+        client.offline_queue.close()
+
+        # Same directory in a new process
+        client = broker_client(broker, start=False, offline_queue=policy)
+        assert len(client.offline_queue) == 20
+
+        receiver = broker_client(broker)
+        subscription = receiver.subscribe("offline/replay", qos=1)
+        assert subscription.wait_for_active(1)
+
+        client.start(timeout=1)
+        assert wait(condition=lambda: len(client.offline_queue) == 0, timeout=5)
+        assert not client.offline_queue.is_replaying()
+
+        wait(condition=lambda: subscription.total_message_count == 20, timeout=2)
+        assert [message.payload for message in subscription.messages] == [
+            f"{i}".encode("utf-8") for i in range(20)
+        ], "Replayed out of order"
+
+        # Replayed segments are deleted, only the tail is left
+        assert len([name for name in os.listdir(tmp_path) if name.endswith(SEGMENT_SUFFIX)]) == 1
+
+        # Connected and empty, published directly
+        message = client.publish("offline/replay", "live")
+        assert not message.queued
+        assert message.wait_for_communication(1)
+
+        client.stop()
+        receiver.stop()
+
+
+def test_offline_queue_placeholder_completes(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(
+            broker, start=False, offline_queue=MqttOfflineQueuePolicy(replay_rate=1000)
+        )
+        message = client.publish("offline/placeholder", "queued", qos=1)
+        assert message.queued and not message.is_communicated()
+
+        client.start(timeout=1)
+        assert message.wait_for_communication(2), "Queued message was not replayed"
+        assert message.mid > 0 and message.acked_ns is not None
+        assert wait(condition=lambda: len(client.offline_queue) == 0, timeout=1)
+
+        metrics = client.metrics.snapshot()
+        assert metrics["mqtt_offline_queued_total"] == 1
+        assert metrics["mqtt_offline_replayed_total"] == 1
+
+        client.stop()
+
+
+@pytest.mark.parametrize("drop_newest", [False, True])
+def test_offline_queue_limits(caplog, drop_newest):
+    caplog.set_level("INFO")
+
+    policy = MqttOfflineQueuePolicy(max_messages=5, max_bytes=1000)
+    if drop_newest:
+        policy.policy = DROP_NEWEST
+
+    client = offline_client(policy)
+    messages = [client.publish("offline/limits", f"{i}") for i in range(8)]
+
+    queue = client.offline_queue
+    assert len(queue) == 5 and queue.dropped_count == 3
+
+    dropped = messages[5:] if drop_newest else messages[:3]
+    assert all(message.is_failed() for message in dropped)
+    assert not any(message.is_failed() for message in messages if message not in dropped)
+
+    # Too big for max_bytes on its own
+    assert client.publish("offline/limits", b"x" * 2000).is_failed()
+
+    with pytest.raises(ValueError):
+        offline_client(MqttOfflineQueuePolicy(policy="block"))
+
+
+def test_offline_queue_connection_lost(caplog, tmp_path):
+    caplog.set_level("INFO")
+
+    policy = MqttOfflineQueuePolicy(directory=str(tmp_path))
+    client = offline_client(policy)
+    client.publish("offline/lost", "0", qos=0)
+    client.publish("offline/lost", "1", qos=1)
+
+    # Both handed to paho, the QoS 0 one is dropped by paho on disconnect
+    queue = client.offline_queue
+    queue.get()
+    queue.get()
+    queue.connection_lost()
+
+    assert queue.pending_count == 1 and queue.in_flight_count == 1
+    assert queue.complete() == 0 and queue.replayed_count == 0, "Lost message counted as replayed"
+
+    # The head stays on the lost message, not on the later one in flight
+    queue.close()
+    client = offline_client(policy)
+    assert [client.offline_queue.get().payload for _ in range(2)] == [b"0", b"1"]
+
+
+def test_offline_queue_torn_write(caplog, tmp_path):
+    caplog.set_level("INFO")
+
+    policy = MqttOfflineQueuePolicy(directory=str(tmp_path))
+    client = offline_client(policy)
+    for i in range(3):
+        client.publish("offline/torn", f"{i}")
+    client.offline_queue.close()
+
+    # Crash in the middle of writing a fourth record
+    (segment,) = [name for name in os.listdir(tmp_path) if name.endswith(SEGMENT_SUFFIX)]
+    path = os.path.join(tmp_path, segment)
+    size = os.path.getsize(path)
+    with open(path, "ab") as file:
+        file.write(b"\x00\x00\x00\x40torn")
+
+    client = offline_client(policy)
+    assert len(client.offline_queue) == 3
+    assert os.path.getsize(path) == size, "Torn record not truncated"
+
+    record = client.offline_queue.get()
+    assert (record.topic, record.payload) == ("offline/torn", b"0")
@@ -0,0 +1,88 @@
+from .fixtures import client
+from mqttwrapper.mqtt_client import MqttClient
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_histogram import MqttLatencyHistogram
+from mqttwrapper.mqtt_probe import MqttLatencyProbe, PROBE_HEADER
+from mqttwrapper.mqtt_message import MqttReceivedMessage
+from mqttwrapper.helper import wait
+
+import pytest
+
+
+def test_histogram_percentiles():
+    histogram = MqttLatencyHistogram(significant_digits=3)
+    histogram.record_many(range(1, 100001))
+
+    assert histogram.total_count == 100000
+    assert histogram.min == 1 and histogram.max == 100000
+    for percentile, exact in ((50.0, 50000), (99.0, 99000), (99.9, 99900)):
+        value = histogram.value_at_percentile(percentile)
+        assert abs(value - exact) / exact < 0.001, f"p{percentile} off: '{value=}'"
+
+    merged = MqttLatencyHistogram(significant_digits=3)
+    merged.add(histogram)
+    merged.add(histogram)
+    assert merged.total_count == 200000
+    assert merged.percentiles() == histogram.percentiles()
+
+    histogram.reset()
+    assert histogram.value_at_percentile(50) is None
+
+    with pytest.raises(ValueError):
+        MqttLatencyHistogram(significant_digits=0)
+
+
+def test_probe_counts(caplog):
+    caplog.set_level("INFO")
+
+    # Never started, probe messages are fed to the listener directly
+    client = MqttClient(MqttConfig(host="127.0.0.1", port=1883))
+    probe = MqttLatencyProbe(client, "test_probe_counts", loss_timeout=1)
+
+    def received(seq):
+        payload = PROBE_HEADER.pack(probe.probe_id, seq, 0)
+        probe._message_listener(MqttReceivedMessage("test_probe_counts", payload, 1, False))
+
+    with probe._lock:
+        probe._in_flight.update({0: 0, 1: 0, 2: 0, 3: 0})
+        probe._next_seq = 4
+
+    received(1)
+    received(0)
+    received(1)
+    received(2)
+    probe.expire(now_ns=2 * 10**9)
+    received(3)
+
+    report = probe.report()
+    assert report.received_count == 4
+    assert report.reordered_count == 1
+    assert report.duplicate_count == 1
+    assert report.lost_count == 0, "Late arrival still counted as lost"
+    assert report.in_flight_count == 0
+
+
+def test_probe_round_trip(caplog, client):
+    caplog.set_level("INFO")
+
+    client.start(timeout=1)
+
+    probe = MqttLatencyProbe(client, "test_probe_round_trip", qos=1, payload_size=64)
+    assert probe.subscription.wait_for_active(1), "Subscription did not activate"
+
+    count = 50
+    probe.run(count)
+    probe.close()
+
+    # PUBACK can arrive after the message came back
+    wait(condition=lambda: probe.acked_count == count, timeout=1)
+    report = probe.report()
+
+    assert report.sent_count == count
+    assert report.received_count == count, f"Probe messages missing: '{report=}'"
+    assert report.lost_count == 0 and report.duplicate_count == 0
+    assert report.acked_count == count
+    assert report.ack_latency.total_count == count
+    assert report.receive_latency.total_count == count
+    assert all(value > 0 for value in report.receive_latency.percentiles().values())
+    assert all(len(message.payload) == 64 for message in probe.subscription.messages)
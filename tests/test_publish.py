@@ -17,3 +17,47 @@ def test_publish(caplog, client):
     assert (
         pub_message.is_communicated() == True
     ), "Did not receive confirmation that the message was received by broker"
+
+
+def test_publish_memoryview(caplog, client):
+    caplog.set_level("DEBUG")
+
+    client.start(timeout=1)
+
+    topic = "test_publish_memoryview"
+    payload = memoryview(bytearray(b"zero-copy"))
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    pub_message = client.publish(topic=topic, payload=payload)
+    pub_message.wait_for_communication()
+
+    assert pub_message.payload is payload, "Payload was copied"
+
+    subscription.wait_for_message(1)
+
+    assert subscription.messages[-1].payload == b"zero-copy"
+    assert pub_message == subscription.messages[-1]
+
+
+def test_publish_quiet_hot_path(caplog, client):
+    caplog.set_level("DEBUG")
+
+    client.config.quiet_hot_path = True
+    client.start(timeout=1)
+
+    topic = "test_publish_quiet_hot_path"
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    caplog.clear()
+    pub_message = client.publish(topic=topic, payload=b"quiet")
+    pub_message.wait_for_communication()
+    subscription.wait_for_message(1)
+
+    assert subscription.messages[-1].payload == b"quiet"
+    assert not [
+        record for record in caplog.records if "Adding sent message" in record.message
+    ], "Per message logging with quiet_hot_path"
@@ -0,0 +1,72 @@
+from .fixtures import client, broker_client
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_publish_batch import MqttPublishBatch, MqttPublishListener
+from mqttwrapper.helper import wait
+
+
+def test_publish_many(caplog, client):
+    caplog.set_level("INFO")
+
+    client.config.max_inflight_messages = 5
+    client.start(timeout=1)
+
+    topic = "test_publish_many"
+    count = 50
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    batch = client.publish_many(((topic, i) for i in range(count)), qos=1, timeout=5)
+
+    assert batch.wait_all(5), f"Batch not acknowledged: '{batch=}'"
+    assert len(batch) == count
+    assert len(batch.completed) == count and not batch.failed
+    assert all(latency > 0 for latency in batch.latencies_ns()), "Latency not measured"
+
+    wait(condition=lambda: subscription.total_message_count == count, timeout=2)
+    assert subscription.total_message_count == count, "Not all messages were received"
+    assert [message.payload for message in subscription.messages] == [
+        str(i).encode("utf-8") for i in range(count)
+    ], "Messages received out of order"
+
+
+def test_publish_listener(caplog, client):
+    caplog.set_level("INFO")
+
+    client.start(timeout=1)
+
+    class Listener(MqttPublishListener):
+        def __init__(self):
+            self.acked = []
+
+        def message_acked(self, message):
+            self.acked.append(message)
+
+    listener = Listener()
+    batch = MqttPublishBatch(client.userdata)
+    messages = [
+        client.publish("test_publish_listener", i, listener=listener) for i in range(3)
+    ] + [client.publish("test_publish_listener", "batch", listener=batch)]
+
+    assert wait(condition=lambda: len(listener.acked) == 3, timeout=2), f"{listener.acked=}"
+    assert sorted(listener.acked, key=lambda message: message.mid) == messages[:3]
+    assert batch.wait_all(2) and batch.messages == messages[3:]
+
+
+def test_publish_while_not_connected(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(broker, start=False)
+
+        # Kept by paho and sent once connected, QoS 0 is refused
+        message = client.publish("test_publish_while_not_connected", "kept", qos=1)
+        assert not message.is_failed() and not message.is_communicated()
+        assert not message.wait_for_communication(0.1)
+        assert client.publish("test_publish_while_not_connected", "lost", qos=0).is_failed()
+
+        client.start(timeout=1)
+        assert message.wait_for_communication(2), "Kept message not sent after connecting"
+        assert message.acked_ns is not None
+
+        client.stop()
@@ -1,5 +1,7 @@
 from .fixtures import client
 
+from mqttwrapper.mqtt_message import MqttReceivedMessage
+
 from time import time_ns
 
 
@@ -29,3 +31,21 @@ def test_receive(caplog, client):
         pub_message is not sub_message
     ), "Sent and received messages are the same object, did the message go through a broker and return?"
     assert sub_message_count == 1, "Expected exactly 1 message to be received"
+
+
+def test_received_message_equality():
+    sent = MqttReceivedMessage(topic="a", payload=1, qos=1, retain=1)
+    received = MqttReceivedMessage(topic="a", payload=b"1", qos=1, retain=True)
+
+    assert sent == received, "Payload and retain not normalized"
+    assert sent != MqttReceivedMessage(topic="b", payload=b"1", qos=1, retain=True)
+    assert not hasattr(received, "__dict__"), "Received message should not have a __dict__"
+
+
+def test_received_payload_accessors():
+    message = MqttReceivedMessage(topic="a", payload=b'{"value": 1}', qos=1, retain=0)
+
+    assert message.text == '{"value": 1}'
+    assert message.json() == {"value": 1}
+    assert message.json() is message.json(), "Decoded payload not cached"
+    assert message.view.obj is message.payload, "View is not zero-copy"
@@ -0,0 +1,110 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_config import MqttConfig
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_serializer import (
+    MqttSerializer,
+    MqttSerializers,
+    MqttStructSerializer,
+    get_serializer,
+    JSON,
+    MSGPACK,
+)
+from mqttwrapper.helper import wait
+
+import pytest
+
+POWER = MqttStructSerializer("power", [("timestamp", "q"), ("watts", "f"), ("phase", "B")])
+
+
+def test_json_serializer():
+    serializer = get_serializer(JSON)
+
+    payload = serializer.dumps({"a": [1, 2], "b": "c"})
+    assert payload == b'{"a":[1,2],"b":"c"}'
+    assert serializer.loads(memoryview(payload)) == {"a": [1, 2], "b": "c"}
+
+    with pytest.raises(ValueError):
+        get_serializer("pickle")
+
+    # dumps and loads are abstract
+    with pytest.raises(TypeError):
+        MqttSerializer()
+
+
+def test_msgpack_serializer():
+    pytest.importorskip("msgpack")
+    serializer = get_serializer(MSGPACK)
+
+    assert serializer.loads(serializer.dumps({"a": [1, 2]})) == {"a": [1, 2]}
+
+
+def test_struct_serializer():
+    payload = POWER.dumps({"timestamp": 1, "watts": 2.5, "phase": 3})
+    assert len(payload) == POWER.size == 13
+    assert POWER.dumps((1, 2.5, 3)) == payload
+    assert POWER.loads(payload) == {"timestamp": 1, "watts": 2.5, "phase": 3}
+
+    with pytest.raises(ValueError):
+        MqttStructSerializer("native", [("a", "i")], byte_order="@")
+
+
+def test_struct_serializer_to_numpy():
+    pytest.importorskip("numpy")
+
+    payloads = [POWER.dumps((i, i * 1.5, i % 3)) for i in range(10)]
+    records = POWER.to_numpy(payloads)
+
+    assert records.dtype.names == ("timestamp", "watts", "phase")
+    assert records["timestamp"].tolist() == list(range(10))
+    assert records["watts"].sum() == pytest.approx(sum(i * 1.5 for i in range(10)))
+
+    with pytest.raises(ValueError):
+        POWER.to_numpy(payloads + [b"short"])
+
+
+def test_serializers_by_topic():
+    serializers = MqttSerializers({"power/+/raw": POWER, "power/#": JSON})
+
+    assert serializers.for_topic("power/1/raw") is POWER
+    assert serializers.for_topic("power/1/summary") is get_serializer(JSON)
+    assert serializers.for_topic("other") is None
+
+    # bytes-like payloads are already serialized, unless a serializer is asked for
+    assert serializers.dumps("power/1/summary", b"{}") == b"{}"
+    assert serializers.dumps("power/1/summary", {"a": 1}) == b'{"a":1}'
+    assert serializers.dumps("other", {"a": 1}) == {"a": 1}
+    assert serializers.dumps("other", "text", serializer=JSON) == b'"text"'
+
+    with pytest.raises(ValueError):
+        MqttConfig(host="127.0.0.1", port=1883, serializers={"#": "pickle"})
+
+
+def test_serializer_publish_and_receive(caplog, broker_client):
+    caplog.set_level("INFO")
+    serializers = {"serial/power": POWER, "serial/#": JSON}
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(broker, serializers=serializers)
+        subscription = client.subscribe("serial/#", qos=1)
+        assert subscription.wait_for_active(1)
+
+        sent = [
+            client.publish("serial/status", {"state": "on", "load": [1, 2]}),
+            client.publish("serial/power", (1, 2.5, 3)),
+            client.publish("serial/raw", {"a": 1}, serializer=JSON),
+        ]
+        assert all(message.wait_for_communication(1) for message in sent)
+        assert sent[0].payload == b'{"state":"on","load":[1,2]}'
+
+        assert wait(condition=lambda: subscription.total_message_count == 3, timeout=2)
+        received = {message.topic: message for message in subscription.messages}
+
+        status = received["serial/status"]
+        assert status.decode() == {"state": "on", "load": [1, 2]}
+        # Decoded once and kept
+        assert status.decode() is status.decode()
+
+        assert received["serial/power"].decode() == {"timestamp": 1, "watts": 2.5, "phase": 3}
+        assert received["serial/raw"].decode(JSON) == {"a": 1}
+
+        client.stop()
@@ -0,0 +1,78 @@
+from .fixtures import client, broker_client
+from mqttwrapper.mqtt_message_store import MqttRetentionPolicy
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_stream import MqttMessageQueue, BLOCK
+from mqttwrapper.helper import wait
+
+import threading
+
+import pytest
+
+
+def test_queue_policies():
+    queue = MqttMessageQueue(maxsize=2, policy="drop_oldest")
+    for i in range(3):
+        queue.put(i)
+
+    assert [queue.get(0), queue.get(0), queue.get(0)] == [1, 2, None]
+    assert queue.dropped_count == 1
+
+    queue = MqttMessageQueue(maxsize=2, policy="drop_newest")
+    for i in range(3):
+        queue.put(i)
+
+    assert queue.get_batch(max_size=5, max_wait=0) == [0, 1]
+    assert queue.dropped_count == 1
+
+    with pytest.raises(ValueError):
+        MqttMessageQueue(policy="invalid")
+
+
+def test_stream(caplog, client):
+    caplog.set_level("INFO")
+
+    client.config.retention = MqttRetentionPolicy.count_only()
+    client.start(timeout=1)
+
+    topic = "test_stream"
+    count = 10
+
+    subscription = client.subscribe(topic)
+    assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    stream = subscription.stream(timeout=1)
+    batches = subscription.batches(max_size=4, max_wait=0.5, timeout=1)
+
+    client.publish_many(((topic, i) for i in range(count))).wait_all(1)
+
+    received = [message.payload for message in stream]
+    batched = [len(batch) for batch in batches]
+
+    assert received == [str(i).encode("utf-8") for i in range(count)]
+    assert sum(batched) == count and max(batched) <= 4
+    assert len(subscription.messages) == 0, "Consumed messages retained"
+    assert subscription.total_message_count == count
+
+
+def test_stream_abandoned(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    topic = "test_stream_abandoned"
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(broker)
+        subscription = client.subscribe(topic)
+        assert subscription.wait_for_active(1), "Subscription did not activate"
+
+        # Published once the stream exists, which is only referenced by the for loop
+        threading.Timer(0.1, client.publish, (topic, "first")).start()
+        for message in subscription.stream(timeout=1, maxsize=1, policy=BLOCK):
+            break
+        assert message.payload == b"first"
+
+        # A blocking queue left on the subscription would stall the network thread
+        client.publish_many(((topic, i) for i in range(5))).wait_all(1)
+        assert wait(condition=lambda: subscription.total_message_count == 6, timeout=2)
+        assert not subscription._listeners, "Listener left on the subscription"
+
+        client.stop()
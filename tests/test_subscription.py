@@ -1,5 +1,11 @@
-from .fixtures import client
+from .fixtures import client, broker_client
 import mqttwrapper
+import mqttwrapper.helper
+import mqttwrapper.mqtt_client
+import mqttwrapper.mqtt_config
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+
+from types import SimpleNamespace
 
 
 def test_subscribe(caplog, client):
@@ -18,3 +24,91 @@ def test_subscribe(caplog, client):
         subscription.wait_for_active() == True
     ), "Did not receive SUBACK within the timeout period"
     assert subscription.is_active() == True, "SUBACK not received"
+
+
+def test_unsubscribe(caplog, client):
+    caplog.set_level("DEBUG")
+
+    client.start(timeout=1)
+
+    topic = "test_unsubscribe"
+
+    subscription = client.subscribe(topic=topic)
+    assert subscription.wait_for_active(1), "Did not receive SUBACK within the timeout period"
+    assert client.userdata.get_subscription(topic=topic) is subscription
+
+    client.unsubscribe(topic)
+
+    assert mqttwrapper.helper.wait(
+        condition=lambda: client.userdata.get_subscription(topic=topic) is None,
+        timeout=1,
+    ), "Did not receive UNSUBACK within the timeout period"
+    assert subscription.is_active() == False, "Subscription still active after UNSUBACK"
+    assert subscription not in client.userdata.subscriptions
+
+
+def test_subscribe_many(caplog, client):
+    caplog.set_level("INFO")
+
+    client.config.subscribe_batch_size = 20
+    client.start(timeout=1)
+
+    topics = [(f"test_subscribe_many/{i}", i % 3) for i in range(50)]
+
+    batch = client.subscribe_many(topics)
+    assert batch.wait_all(2), f"Not every SUBACK arrived: '{batch=}'"
+    assert len(batch) == 50 and not batch.refused
+    assert batch.granted_qos == {topic: qos for topic, qos in topics}
+
+    # 20 topics per SUBSCRIBE
+    assert len({subscription.mid for subscription in batch}) == 3
+
+    # Already subscribed, nothing is sent
+    assert client.subscribe_many(topics[:1]).subscriptions[0] is batch.subscriptions[0]
+
+    unsubscribe = client.unsubscribe_many(topic for topic, _ in topics)
+    assert unsubscribe.wait_all(2), f"Not every UNSUBACK arrived: '{unsubscribe=}'"
+    assert not client.userdata.subscriptions
+    assert not any(subscription.is_active() for subscription in batch)
+
+
+def test_unsubscribe_connection_lost(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    # UNSUBACKs are held back long enough to drop the connection before they arrive
+    with MqttFakeBroker(latency=0.5) as broker:
+        client = broker_client(broker, reconnect_min_delay=0.05, reconnect_max_delay=0.2)
+
+        topics = [f"test_unsubscribe_connection_lost/{i}" for i in range(3)]
+        batch = client.subscribe_many((topic, 1) for topic in topics)
+        assert batch.wait_all(2), f"Not every SUBACK arrived: '{batch=}'"
+
+        unsubscribe = client.unsubscribe_many(topics[:2])
+        broker.disconnect_clients()
+
+        assert unsubscribe.wait_all(1), f"Unsubscribe still waiting: '{unsubscribe=}'"
+        assert client.userdata.subscriptions == [batch.subscriptions[2]]
+
+        # Only the remaining subscription is restored
+        assert batch.subscriptions[2].wait_for_active(3)
+        assert not any(subscription.is_active() for subscription in batch.subscriptions[:2])
+
+        client.stop()
+
+
+def test_subscribe_packets_maximum_packet_size():
+    client = mqttwrapper.mqtt_client.MqttClient(
+        mqttwrapper.mqtt_config.MqttConfig(host="127.0.0.1", port=1883, protocol="5")
+    )
+    client.connack_properties = SimpleNamespace(MaximumPacketSize=100)
+
+    subscriptions = client.userdata.subscribe_many(
+        (f"test/packets/{i:02}", 1) for i in range(20)
+    )
+    # 8 bytes of headers, 18 per topic
+    packets = list(client.userdata._packets(subscriptions, options_size=1))
+    assert [len(packet) for packet in packets] == [5, 5, 5, 5]
+
+    client.config.subscribe_batch_size = 3
+    packets = list(client.userdata._packets(subscriptions, options_size=1))
+    assert [len(packet) for packet in packets] == [3, 3, 3, 3, 3, 3, 2]
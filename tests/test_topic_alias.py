@@ -0,0 +1,96 @@
+from .fixtures import broker_client
+from mqttwrapper.mqtt_fake_broker import MqttFakeBroker
+from mqttwrapper.mqtt_topic_alias import MqttTopicAliases, ALIAS_PROPERTY_SIZE
+from mqttwrapper.helper import wait
+
+import pytest
+
+
+def test_topic_aliases_lru():
+    aliases = MqttTopicAliases(maximum=2)
+    size = len("alias/a")
+
+    assert aliases.alias("alias/a", size) == ("alias/a", 1)
+    assert aliases.alias("alias/b", size) == ("alias/b", 2)
+    assert aliases.alias("alias/a", size) == ("", 1)
+
+    # Full, alias/b was used least recently and gives up its alias
+    assert aliases.alias("alias/c", size) == ("alias/c", 2)
+    assert aliases.alias("alias/b", size) == ("alias/b", 1)
+    assert aliases.evicted_count == 2
+
+    assert aliases.bytes_saved == (size - ALIAS_PROPERTY_SIZE) - 4 * ALIAS_PROPERTY_SIZE
+
+    # Not worth an alias
+    assert aliases.alias("a/b", 3) == ("a/b", 0)
+
+    aliases.reset(0)
+    assert len(aliases) == 0
+
+
+def test_topic_alias_publish_and_receive(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker(topic_alias_maximum=2) as broker:
+        receiver = broker_client(broker, "5", topic_alias_receive_maximum=2)
+        subscription = receiver.subscribe("alias/#", qos=1)
+        assert subscription.wait_for_active(1)
+
+        client = broker_client(broker, "5")
+        assert wait(condition=lambda: client.topic_aliases.maximum == 2, timeout=1)
+
+        # Two hot topics fit the table, a third one takes an alias over now and then
+        topics = [f"alias/device/{i % 2}/temperature" for i in range(30)]
+        topics[10::7] = ["alias/device/2/temperature"] * len(topics[10::7])
+        messages = [client.publish(topic, f"{i}", qos=i % 2) for i, topic in enumerate(topics)]
+        assert all(message.wait_for_communication(1) for message in messages)
+
+        # The broker resolved our aliases, and the receiver resolved the broker's
+        assert wait(condition=lambda: subscription.total_message_count == 30, timeout=2)
+        assert [message.topic for message in subscription.messages] == topics
+
+        aliases = client.topic_aliases
+        assert aliases.aliased_count > 0 and aliases.evicted_count > 0
+        assert aliases.bytes_saved > 0
+        assert client.metrics.snapshot()["mqtt_topic_alias_bytes_saved"] == aliases.bytes_saved
+
+        received = receiver.received_topic_aliases
+        assert received.resolved_count > 0 and received.bytes_saved > 0
+
+        client.stop()
+        receiver.stop()
+
+
+def test_topic_alias_resend_has_topic(caplog, broker_client):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker(latency=0.2) as broker:
+        client = broker_client(broker, "5")
+        assert wait(condition=lambda: client.topic_aliases.maximum > 0, timeout=1)
+
+        client.publish("alias/resend", "first")
+        message = client.publish("alias/resend", "second")
+
+        # Sent with only the alias, kept by paho with the topic for a resend after reconnect
+        paho_message = client._paho_client._out_messages[message.mid]
+        assert paho_message.topic == "alias/resend"
+        assert paho_message.properties is None
+        assert client.topic_aliases.aliased_count == 1
+
+        assert message.wait_for_communication(2)
+        client.stop()
+
+
+@pytest.mark.parametrize("protocol,topic_aliases", [("3.1.1", True), ("5", False)])
+def test_topic_alias_disabled(caplog, broker_client, protocol, topic_aliases):
+    caplog.set_level("INFO")
+
+    with MqttFakeBroker() as broker:
+        client = broker_client(broker, protocol, topic_aliases=topic_aliases)
+        client.publish("alias/disabled", "1").wait_for_communication(1)
+        client.publish("alias/disabled", "2").wait_for_communication(1)
+
+        assert client.topic_aliases.maximum == 0
+        assert client.topic_aliases.aliased_count == 0
+
+        client.stop()
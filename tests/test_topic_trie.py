@@ -0,0 +1,57 @@
+from .fixtures import client
+from mqttwrapper.mqtt_topic_trie import MqttTopicTrie
+
+import pytest
+
+
+def test_trie_match():
+    trie = MqttTopicTrie()
+    for topic_filter in [
+        "a/b/c",
+        "a/+/c",
+        "a/#",
+        "#",
+        "+/b/+",
+        "$share/group/a/b/c",
+        "$SYS/#",
+        "+/monitor",
+    ]:
+        trie.add(topic_filter, topic_filter)
+
+    assert sorted(trie.match("a/b/c")) == sorted(
+        ["a/b/c", "a/+/c", "a/#", "#", "+/b/+", "$share/group/a/b/c"]
+    )
+    assert sorted(trie.match("a")) == sorted(["a/#", "#"]), "'#' should match parent level"
+    assert sorted(trie.match("$SYS/monitor")) == ["$SYS/#"], "Wildcards matched '$' topic"
+    assert trie.match("b") == ["#"]
+
+    assert trie.remove("a/#", "a/#")
+    assert not trie.remove("a/#", "a/#"), "Removed value twice"
+    assert "a/#" not in trie.match("a/b/c")
+    assert len(trie) == 7
+
+    with pytest.raises(ValueError):
+        trie.add("$share/group", "invalid")
+
+
+def test_wildcard_receive(caplog, client):
+    caplog.set_level("DEBUG")
+
+    client.start(timeout=1)
+
+    topic = "test_wildcard_receive/device/1"
+
+    exact = client.subscribe(topic)
+    single = client.subscribe("test_wildcard_receive/+/1")
+    multi = client.subscribe("test_wildcard_receive/#")
+    for subscription in [exact, single, multi]:
+        assert subscription.wait_for_active(1), "Subscription did not activate"
+
+    client.publish(topic=topic, payload="wildcard").wait_for_communication()
+
+    # Brokers may deliver one copy per matching subscription, each copy is fanned out to all of them
+    for subscription in [exact, single, multi]:
+        subscription.wait_for_message(1)
+        assert (
+            subscription.total_message_count >= 1
+        ), f"Expected a message on '{subscription.topic}'"
@@ -0,0 +1,32 @@
+from mqttwrapper.helper import wait, Notifier
+
+import threading
+import time
+
+
+def test_wait_notifier():
+    notifier = Notifier()
+    state = {"done": False}
+
+    def set_done():
+        state["done"] = True
+        notifier.notify()
+
+    timer = threading.Timer(0.05, set_done)
+    timer.start()
+
+    start = time.time()
+    result = wait(
+        condition=lambda: state["done"], timeout=5, notifier=notifier, resolution=1
+    )
+    elapsed = time.time() - start
+
+    assert result, "Condition was not met before timeout"
+    assert elapsed < 1, "Notified wait did not wake up on notification"
+
+
+def test_wait_timeout():
+    assert not wait(condition=lambda: False, timeout=0.1), "Polling wait did not time out"
+    assert not wait(
+        condition=lambda: False, timeout=0.1, notifier=Notifier()
+    ), "Notified wait did not time out"